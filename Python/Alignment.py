@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+
+"""
+File: Alignment.py
+Description: Resynchronization of traces that drift in time, e.g. with the temperature of a thermal chamber. Each trace
+is cross-correlated with a window of a reference trace over a bounded range of shifts, using FFTs over whole batches of
+traces, and moved by the shift of the best normalized correlation.
+"""
+
+
+class Aligner:
+    def __init__(self, reference: np.ndarray, max_shift: int = None, window: tuple[int, int] | slice = None,
+                 dtype: any = np.float64):
+        """
+        Estimates and applies the shift of every trace relative to a reference. A trace is shifted by s when its samples
+        window[0] + s to window[1] + s match the reference window best, for -max_shift <= s <= max_shift.
+        :param reference: The reference trace, e.g. the mean of traces captured at a stable temperature
+        :type reference: np.ndarray
+        :param max_shift: The largest shift searched in either direction. None for a tenth of the trace length.
+        :type max_shift: int
+        :param window: The (start, stop) samples of the reference that are matched, e.g. around a distinctive peak.
+                       It needs max_shift samples of margin on both sides. None for the whole trace minus that margin.
+        :type window: tuple[int, int] | slice
+        :param dtype: The working precision of the FFTs, np.float32 halves their buffers
+        :type dtype: any
+        :returns: None
+        """
+        reference = np.asarray(reference, dtype=np.float64).ravel()
+        self.num_samples = len(reference)
+        self.max_shift = self.num_samples // 10 if max_shift is None else int(max_shift)
+        if window is None:
+            window = (self.max_shift, self.num_samples - self.max_shift)
+        elif isinstance(window, slice):
+            window = window.indices(self.num_samples)[:2]
+        self.window = (int(window[0]), int(window[1]))
+        self.dtype = np.dtype(dtype)
+
+        start, stop = self.window
+        if stop - start < 2:
+            raise ValueError(f"The alignment window {self.window} must hold at least two samples")
+        if start - self.max_shift < 0 or stop + self.max_shift > self.num_samples:
+            raise ValueError(f"The alignment window {self.window} needs {self.max_shift} samples of margin on both "
+                             f"sides within the {self.num_samples} samples of a trace")
+
+        # every shift of the window lies inside the segment, so a circular correlation of at least the segment length
+        # has no wrapped terms at the shifts that are searched
+        self.segment = slice(start - self.max_shift, stop + self.max_shift)
+        self.fft_size = _fft_length(stop - start + 2 * self.max_shift)
+        template = reference[start:stop] - reference[start:stop].mean()
+        self.template_norm = np.sqrt(np.dot(template, template))
+        self.template_spectrum = np.conj(np.fft.rfft(template.astype(self.dtype), self.fft_size))
+
+    def estimate(self, traces: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Estimate the shift of every trace of a batch.
+        :param traces: The traces as a (traces x samples) array. A single trace may be passed as a 1D array.
+        :type traces: np.ndarray
+        :returns: The shift of every trace and the normalized correlation with the reference at that shift, between -1
+                  and 1. A low correlation means the trace did not match the reference window at any shift.
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        traces = np.asarray(traces)
+        if traces.ndim == 1:
+            traces = traces[np.newaxis]
+        if traces.shape[1] != self.num_samples:
+            raise ValueError(f"Traces of {traces.shape[1]} samples cannot be aligned to a reference of "
+                             f"{self.num_samples} samples")
+
+        width = self.window[1] - self.window[0]
+        num_shifts = 2 * self.max_shift + 1
+        segment = np.array(traces[:, self.segment], dtype=self.dtype)
+        segment -= segment.mean(axis=1, dtype=np.float64, keepdims=True).astype(self.dtype)
+
+        spectrum = np.fft.rfft(segment, self.fft_size, axis=1)
+        spectrum *= self.template_spectrum
+        correlation = np.fft.irfft(spectrum, self.fft_size, axis=1)[:, :num_shifts]
+
+        # energy of every shifted window of the segment, from running sums
+        sums = np.zeros((segment.shape[0], segment.shape[1] + 1))
+        np.cumsum(segment, axis=1, out=sums[:, 1:])
+        window_sum = sums[:, width:width + num_shifts] - sums[:, :num_shifts]
+        segment *= segment
+        np.cumsum(segment, axis=1, out=sums[:, 1:])
+        energy = sums[:, width:width + num_shifts] - sums[:, :num_shifts] - window_sum ** 2 / width
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation /= np.sqrt(np.maximum(energy, 0)) * self.template_norm
+        correlation = np.nan_to_num(correlation, nan=-np.inf, posinf=-np.inf, neginf=-np.inf)
+        best = np.argmax(correlation, axis=1)
+        scores = correlation[np.arange(len(best)), best]
+        return best - self.max_shift, np.where(np.isfinite(scores), scores, 0.0)
+
+    def align(self, traces: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Estimate and apply the shift of every trace of a batch.
+        :param traces: The traces as a (traces x samples) array
+        :type traces: np.ndarray
+        :returns: The aligned traces, the shift of every trace and the normalized correlation at that shift
+        :rtype: (np.ndarray, np.ndarray, np.ndarray)
+        """
+        traces = np.asarray(traces)
+        shifts, scores = self.estimate(traces)
+        return apply_shifts(traces, shifts), shifts, scores
+
+
+def apply_shifts(traces: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+    """
+    Move every trace by its shift, so that sample j of the result is sample j + shift of the trace. Samples shifted in
+    from beyond either end repeat the first or the last sample of the trace.
+    :param traces: The traces as a (traces x samples) array. A single trace may be passed as a 1D array.
+    :type traces: np.ndarray
+    :param shifts: One integer shift per trace
+    :type shifts: np.ndarray
+    :returns: The shifted traces, in the datatype of the traces
+    :rtype: np.ndarray
+    """
+    traces = np.asarray(traces)
+    if traces.ndim == 1:
+        return apply_shifts(traces[np.newaxis], shifts)[0]
+    num_samples = traces.shape[1]
+    shifts = np.clip(np.asarray(shifts, dtype=np.int64).ravel(), 1 - num_samples, num_samples - 1)
+    # one contiguous copy per trace is several times faster than gathering every sample with an index array
+    aligned = np.empty_like(traces)
+    for row, shift in enumerate(shifts.tolist()):
+        if shift >= 0:
+            aligned[row, :num_samples - shift] = traces[row, shift:]
+            aligned[row, num_samples - shift:] = traces[row, -1]
+        else:
+            aligned[row, -shift:] = traces[row, :num_samples + shift]
+            aligned[row, :-shift] = traces[row, 0]
+    return aligned
+
+
+def align_chunks(chunks: Iterable, aligner: Aligner) -> Iterator[(np.ndarray, np.ndarray, np.ndarray)]:
+    """
+    Align an iterator of trace chunks, e.g. `DatasetView.iter_chunks()`.
+    :param chunks: The chunks of traces
+    :type chunks: Iterable
+    :param aligner: The aligner
+    :type aligner: Aligner
+    :returns: An iterator over the aligned chunks with the shifts and correlations of their traces
+    :rtype: Iterator[(np.ndarray, np.ndarray, np.ndarray)]
+    """
+    for chunk in chunks:
+        yield aligner.align(chunk)
+
+
+class AlignedView:
+    def __init__(self, traces: any, aligner: Aligner):
+        """
+        A lazy, aligned view of traces. Rows are read from `traces` and aligned only when they are indexed, so it can be
+        passed to the analysis functions in place of the traces, e.g. `calculate_dpa(AlignedView(...), iv)`. The shift
+        of every row is estimated once and cached.
+        :param traces: The traces, e.g. an array, a memory map or a `DatasetView`
+        :type traces: any
+        :param aligner: The aligner
+        :type aligner: Aligner
+        :returns: None
+        """
+        self.traces = traces
+        self.aligner = aligner
+        self._shifts = np.zeros(len(traces), dtype=np.int64)
+        self._known = np.zeros(len(traces), dtype=bool)
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(self.traces.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.traces.dtype)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return len(self._shifts)
+
+    def __getitem__(self, key: any) -> np.ndarray:
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+
+        if isinstance(key, (int, np.integer)):
+            return self[[range(len(self))[key]]][0][rest]
+        if isinstance(key, slice):
+            rows = np.arange(len(self))[key]
+            traces = np.asarray(self.traces[key])
+        else:
+            rows = np.asarray(key)
+            if rows.dtype == bool:
+                rows = np.flatnonzero(rows)
+            rows = np.where(rows < 0, rows + len(self), rows)
+            traces = np.asarray(self.traces[rows])
+
+        unknown = ~self._known[rows]
+        if unknown.any():
+            self._shifts[rows[unknown]] = self.aligner.estimate(traces[unknown])[0]
+            self._known[rows[unknown]] = True
+        return apply_shifts(traces, self._shifts[rows])[(slice(None),) + rest]
+
+    def __array__(self, dtype: any = None, copy: bool = None) -> np.ndarray:
+        return np.asarray(self[:], dtype=dtype)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        Iterate over the aligned traces in chunks.
+        :param chunk_size: The number of traces per chunk
+        :type chunk_size: int
+        :returns: An iterator over the chunks
+        :rtype: Iterator[np.ndarray]
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self[start:start + chunk_size]
+
+    def shifts(self, chunk_size: int = 1000) -> np.ndarray:
+        """
+        Get the shift of every trace, estimating the ones that are not known yet.
+        :param chunk_size: The number of traces estimated at once
+        :type chunk_size: int
+        :returns: The shift of every trace
+        :rtype: np.ndarray
+        """
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            if self._known[start:stop].all():
+                continue
+            self._shifts[start:stop] = self.aligner.estimate(np.asarray(self.traces[start:stop]))[0]
+            self._known[start:stop] = True
+        return self._shifts.copy()
+
+
+def _fft_length(length: int) -> int:
+    # the smallest product of powers of 2, 3 and 5 that is at least length, which the FFT handles quickly
+    best = 1 << max(0, length - 1).bit_length()
+    power_5 = 1
+    while power_5 < best:
+        power_35 = power_5
+        while power_35 < best:
+            candidate = power_35 << max(0, -(-length // power_35) - 1).bit_length()
+            best = min(best, candidate)
+            power_35 *= 3
+        power_5 *= 5
+    return best
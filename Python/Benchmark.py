@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from DPA import calculate_dpa, calculate_second_order_dpa_mem_efficient, calculate_window_averages
+from FileFormat import FileParent
+from LeakageModels import intermediate_values
+from Metrics import TTestAccumulator
+
+"""
+File: Benchmark.py
+Description: Benchmark suite for the metric and file format code, driven by a deterministic generator of synthetic
+first-order masked leakage traces so that no captured dataset is needed. Run `python Benchmark.py --help` for the
+options. Results are written as JSON and can be compared against a previous run to track regressions.
+"""
+
+# variance of the Hamming weight of a uniformly random 16-bit share
+HW16_VARIANCE = 4.0
+
+
+def generate_masked_traces(num_traces: int, num_samples: int, snr: float = 1.0, seed: int = 0,
+                           mask_sample: int = None, masked_sample: int = None, first_order_leak: float = 0.0,
+                           fixed_value: int = None, dtype: any = np.float32) -> (np.ndarray, np.ndarray):
+    """
+    Generate synthetic traces of a first-order Boolean masked 16-bit value together with the matching intermediate
+    value bytes. The bytes follow the layout of `DPA.intermediate_value`: the mask m is stored in bytes 14 and 15 and
+    the masked value v ^ m in bytes 12 and 13, so `intermediate_values(iv)` is the Hamming weight of v. The Hamming
+    weight of the mask leaks at `mask_sample` and the one of the masked value at `masked_sample`, each under Gaussian
+    noise, so only a second-order analysis finds v unless `first_order_leak` is set.
+    :param num_traces: The number of traces
+    :type num_traces: int
+    :param num_samples: The number of samples per trace
+    :type num_samples: int
+    :param snr: The signal-to-noise ratio at each leaking sample, var(HW of a share) / var(noise)
+    :type snr: float
+    :param seed: The seed of the random generator. The same seed always gives the same traces.
+    :type seed: int
+    :param mask_sample: The sample leaking the mask. Defaults to num_samples // 4.
+    :type mask_sample: int
+    :param masked_sample: The sample leaking the masked value. Defaults to num_samples // 2.
+    :type masked_sample: int
+    :param first_order_leak: The amplitude of an unmasked leak of HW(v) at sample 3 * num_samples // 4, 0 for none
+    :type first_order_leak: float
+    :param fixed_value: The value v of every trace, e.g. for the fixed set of a TVLA. None for a random v per trace.
+    :type fixed_value: int
+    :param dtype: The datatype of the traces
+    :type dtype: any
+    :returns: The (traces x samples) traces and the (traces x 16) intermediate value bytes
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+    if mask_sample is None:
+        mask_sample = num_samples // 4
+    if masked_sample is None:
+        masked_sample = num_samples // 2
+
+    iv = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    mask = rng.integers(0, 1 << 16, num_traces, dtype=np.uint16)
+    if fixed_value is None:
+        value = rng.integers(0, 1 << 16, num_traces, dtype=np.uint16)
+    else:
+        value = np.full(num_traces, fixed_value, dtype=np.uint16)
+    masked = value ^ mask
+
+    iv[:, 14], iv[:, 15] = mask >> 8, mask & 0xFF
+    iv[:, 12], iv[:, 13] = masked >> 8, masked & 0xFF
+
+    noise_std = np.sqrt(HW16_VARIANCE / snr)
+    traces = rng.standard_normal((num_traces, num_samples), dtype=np.float64 if np.dtype(dtype) == np.float64
+                                 else np.float32)
+    traces *= noise_std
+    traces[:, mask_sample] += _hamming_weight16(mask)
+    traces[:, masked_sample] += _hamming_weight16(masked)
+    if first_order_leak:
+        traces[:, 3 * num_samples // 4] += first_order_leak * _hamming_weight16(value)
+
+    return traces.astype(dtype, copy=False), iv
+
+
+def _hamming_weight16(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.astype('>u2').view(np.uint8).reshape(-1, 2), axis=1).sum(axis=1)
+
+
+def measure(run: callable, setup: callable = None, repeat: int = 3) -> dict:
+    """
+    Time a function and measure its peak memory allocation. The timed runs come first, then one extra run is traced
+    with tracemalloc, whose overhead would otherwise distort the timings.
+    :param run: The function to measure
+    :type run: callable
+    :param setup: A function called before every run and not measured, e.g. to remove the output of the previous run
+    :type setup: callable
+    :param repeat: The number of timed runs
+    :type repeat: int
+    :returns: The timings in seconds and the peak number of bytes allocated during the traced run
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": {"min": min(times), "median": statistics.median(times), "mean": statistics.fmean(times),
+                    "runs": times},
+        "peak_bytes": peak,
+    }
+
+
+def build_suite(config: dict, work_dir: str) -> list[dict]:
+    """
+    Build the benchmarks for a configuration. Every benchmark is a dict with a name, the function to run, an optional
+    setup function and the number of traces it processes.
+    :param config: The configuration, see `default_config()`
+    :type config: dict
+    :param work_dir: An empty directory the file format benchmarks write to
+    :type work_dir: str
+    :returns: The benchmarks
+    :rtype: list[dict]
+    """
+    n, s = config["traces"], config["samples"]
+    n2, s2 = config["second_order_traces"], config["second_order_samples"]
+    chunk = config["chunk_size"]
+
+    traces, iv = generate_masked_traces(n, s, config["snr"], config["seed"], first_order_leak=1.0)
+    traces_2, iv_2 = generate_masked_traces(n2, s2, config["snr"], config["seed"] + 1)
+    fixed, _ = generate_masked_traces(n, s, config["snr"], config["seed"] + 2, first_order_leak=1.0, fixed_value=0)
+
+    file_parent = FileParent("benchmark", work_dir + os.sep)
+    experiment = file_parent.add_experiment("benchmark")
+    experiment.add_dataset("fixed", fixed, fixed.dtype)
+    stored_random = experiment.add_dataset("random", traces, traces.dtype)
+    written = experiment.add_dataset("written", traces[:1], traces.dtype)
+    appended = experiment.add_dataset("appended", traces[:1], traces.dtype)
+    compressed = experiment.add_chunked_dataset("compressed", traces, traces.dtype, quantize="int16")
+
+    def reset_appended() -> None:
+        if os.path.exists(appended.get_file_path()):
+            os.remove(appended.get_file_path())
+
+    def run_t_test() -> None:
+        accumulator = TTestAccumulator()
+        for start in range(0, n, chunk):
+            accumulator.update(fixed[start:start + chunk], traces[start:start + chunk])
+        accumulator.t_value()
+
+    def run_append() -> None:
+        with appended.appender(traces.dtype) as appender:
+            for start in range(0, n, chunk):
+                appender.append(traces[start:start + chunk])
+
+    def run_read_chunks() -> None:
+        for data in stored_random.view().iter_chunks(chunk):
+            np.asarray(data).sum()
+
+    def run_read_random() -> None:
+        rng = np.random.default_rng(config["seed"])
+        for start in rng.integers(0, max(1, n - 100), 100):
+            stored_random.read_data(int(start), int(start) + 100)
+
+    def run_read_compressed() -> None:
+        for start in range(0, n, chunk):
+            compressed.read_data(start, start + chunk)
+
+    return [
+        {"name": "dpa_order1", "traces": n, "run": lambda: calculate_dpa(traces, iv)},
+        {"name": "dpa_order1_float32", "traces": n, "run": lambda: calculate_dpa(traces, iv, dtype=np.float32)},
+        {"name": "dpa_order2", "traces": n2,
+         "run": lambda: calculate_dpa(traces_2, iv_2, order=2, num_of_traces=n2 - 5)},
+        {"name": "second_order_mem_efficient", "traces": n2,
+         "run": lambda: calculate_second_order_dpa_mem_efficient(traces_2, iv_2, config["window_width"])},
+        {"name": "window_averages", "traces": n, "run": lambda: calculate_window_averages(traces)},
+        {"name": "leakage_model", "traces": n, "run": lambda: intermediate_values(iv)},
+        {"name": "t_test", "traces": 2 * n, "run": run_t_test},
+        {"name": "t_test_experiment", "traces": 2 * n,
+         "run": lambda: experiment.calculate_t_test("fixed", "random", chunk_size=chunk)},
+        {"name": "dataset_write", "traces": n, "run": lambda: written.add_data(traces, traces.dtype)},
+        {"name": "dataset_append", "traces": n, "run": run_append, "setup": reset_appended},
+        {"name": "dataset_read_all", "traces": n, "run": stored_random.read_all},
+        {"name": "dataset_read_chunks", "traces": n, "run": run_read_chunks},
+        {"name": "dataset_read_random", "traces": 100 * 100, "run": run_read_random},
+        {"name": "chunked_write", "traces": n,
+         "run": lambda: compressed.add_chunked_data(traces, traces.dtype, quantize="int16")},
+        {"name": "chunked_read", "traces": n, "run": run_read_compressed},
+    ]
+
+
+def default_config() -> dict:
+    """
+    Get the default benchmark configuration.
+    :returns: The configuration
+    :rtype: dict
+    """
+    return {
+        "traces": 20000,
+        "samples": 1000,
+        "second_order_traces": 5000,
+        "second_order_samples": 100,
+        "window_width": 10,
+        "snr": 0.5,
+        "seed": 0,
+        "chunk_size": 5000,
+        "repeat": 3,
+    }
+
+
+def run_benchmarks(config: dict = None, only: list[str] = None) -> dict:
+    """
+    Run the benchmark suite on synthetic data.
+    :param config: The configuration. Missing keys are taken from `default_config()`.
+    :type config: dict
+    :param only: The names of the benchmarks to run. None to run all of them.
+    :type only: list[str]
+    :returns: The configuration, a description of the environment and one result per benchmark, ready to be saved
+              as JSON
+    :rtype: dict
+    """
+    config = {**default_config(), **(config or {})}
+    work_dir = tempfile.mkdtemp(prefix="benchmark")
+    results = []
+    try:
+        for benchmark in build_suite(config, work_dir):
+            if only is not None and benchmark["name"] not in only:
+                continue
+            result = measure(benchmark["run"], benchmark.get("setup"), config["repeat"])
+            result["name"] = benchmark["name"]
+            result["traces_per_second"] = benchmark["traces"] / result["seconds"]["median"]
+            results.append(result)
+            print(f"{result['name']:<28} {result['seconds']['median']:9.4f} s {result['peak_bytes'] / 2 ** 20:10.1f} MiB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 1.25) -> list[str]:
+    """
+    Compare two benchmark reports and list the benchmarks that got slower or allocate more memory.
+    :param baseline: The report of the reference run
+    :type baseline: dict
+    :param current: The report of the new run
+    :type current: dict
+    :param tolerance: The ratio new / reference above which a benchmark counts as a regression
+    :type tolerance: float
+    :returns: A description of every regression. Empty if there is none.
+    :rtype: list[str]
+    """
+    reference = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = reference.get(result["name"])
+        if old is None:
+            continue
+        time_ratio = result["seconds"]["median"] / old["seconds"]["median"]
+        memory_ratio = result["peak_bytes"] / max(1, old["peak_bytes"])
+        if time_ratio > tolerance:
+            regressions.append(f"{result['name']}: {time_ratio:.2f}x slower")
+        if memory_ratio > tolerance:
+            regressions.append(f"{result['name']}: {memory_ratio:.2f}x more memory")
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    defaults = default_config()
+    parser = argparse.ArgumentParser(description="Benchmark the metrics and the file format on synthetic traces.")
+    for key, value in defaults.items():
+        parser.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+    parser.add_argument("--output", help="path of the JSON report")
+    parser.add_argument("--baseline", help="JSON report to compare against, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks({key: getattr(args, key) for key in defaults}, args.only)
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as json_file:
+            regressions = compare(json.load(json_file), report, args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,15 @@
 #The second order DPA code is inspired by https://github.com/ermin-sakic/second-order-dpa by Ermin Sakic
-import numpy as np
 import math
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from LeakageModels import intermediate_values
+from Metrics import SNRAccumulator, checkpoint_offsets, first_crossing
+from Profiling import get_profiler
 
 
 def intermediate_value(out):
@@ -9,41 +18,124 @@ def intermediate_value(out):
     return bin(a_ma ^ b_ma).count("1")
 
 
-def std_dev(x, x_bar):
-    return np.sqrt(np.sum((x - x_bar) ** 2, axis=0))
-
-
-def cov(x, x_bar, y, y_bar):
-    return np.sum((x - x_bar) * (y - y_bar), axis=0)
-
-
-def calculate_window_averages(traces, window_size=5, traces_max=0):
-    fma = []
-    i = 0
-    if traces_max == 0:
-        traces_max = traces.shape[0] - window_size
-
-    while i < traces_max:
-        window_average_increment = np.mean(traces[i:i + window_size], axis=0)
-        fma.append(window_average_increment)
-        i += 1
-    return fma
-
-
-def calculate_dpa(traces, iv, order=1, key_guess=0, window_size_fma=5, num_of_traces=0):
+def hypothesis_column(iv, hypothesis, num_trace):
+    # leakage hypothesis for the first num_trace traces as a (traces x 1) column
+    if hypothesis is None:
+        hypothesis = intermediate_values(iv[0:num_trace])
+    return np.asarray(hypothesis[0:num_trace]).reshape(-1, 1)
+
+
+def std_dev(x, x_bar, dtype=np.float64, block_size=4096):
+    # sqrt(sum((x - x_bar) ** 2)) computed block by block in one preallocated buffer of the given dtype
+    # the column sums are accumulated in float64 whatever the dtype
+    x_bar = np.asarray(x_bar, dtype=dtype)
+    buffer = np.empty((min(block_size, len(x)),) + np.shape(x)[1:], dtype=dtype)
+    total = np.zeros(np.shape(x)[1:])
+    for start in range(0, len(x), block_size):
+        block = buffer[:min(block_size, len(x) - start)]
+        block[:] = x[start:start + block_size]
+        block -= x_bar
+        block *= block
+        total += block.sum(axis=0, dtype=np.float64)
+    return np.sqrt(total)
+
+
+def cov(x, x_bar, y, y_bar, dtype=np.float64, block_size=4096):
+    # sum((x - x_bar) * (y - y_bar)) with the same blocked, in-place scheme as std_dev
+    x_bar = np.asarray(x_bar, dtype=dtype)
+    y_bar = np.asarray(y_bar, dtype=dtype)
+    row_shape = np.broadcast_shapes(np.shape(x)[1:], np.shape(y)[1:])
+    buffer = np.empty((min(block_size, len(x)),) + row_shape, dtype=dtype)
+    y_buffer = np.empty((min(block_size, len(y)),) + np.shape(y)[1:], dtype=dtype)
+    total = np.zeros(row_shape)
+    for start in range(0, len(x), block_size):
+        block = buffer[:min(block_size, len(x) - start)]
+        y_block = y_buffer[:len(block)]
+        block[:] = x[start:start + block_size]
+        block -= x_bar
+        y_block[:] = y[start:start + block_size]
+        y_block -= y_bar
+        block *= y_block
+        total += block.sum(axis=0, dtype=np.float64)
+    return total
+
+
+def calculate_window_averages(traces, window_size=5, traces_max=0, out=None, block_size=4096, dtype=None):
+    # moving average over window_size consecutive traces, out[i] = mean(traces[i:i + window_size])
+    # out may be a preallocated array or memmap of shape (traces_max, samples)
+    # dtype of a new output defaults to the trace dtype for float traces and float64 otherwise
+    # traces_max is clamped to traces - window_size, the number of windows computed by default
+    available = max(0, traces.shape[0] - window_size)
+    traces_max = available if traces_max == 0 else min(traces_max, available)
+    if out is None:
+        if dtype is None:
+            dtype = traces.dtype if traces.dtype.kind == 'f' else np.float64
+        out = np.empty((traces_max,) + traces.shape[1:], dtype=dtype)
+
+    # sum the window_size shifted slices block by block so each input block is read while it is cached
+    for start in range(0, traces_max, block_size):
+        end = min(start + block_size, traces_max)
+        window = out[start:end]
+        window[:] = traces[start:end]
+        for k in range(1, window_size):
+            window += traces[start + k:end + k]
+        window /= window_size
+    return out[:traces_max]
+
+
+def iterate_window_averages(chunks, window_size=5, traces_max=0):
+    # streaming calculate_window_averages over consecutive trace chunks, the window is carried across chunk
+    # boundaries and the concatenated output equals calculate_window_averages on all traces with the same traces_max
+    carry = None
+    remaining = traces_max
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        data = chunk if carry is None else np.concatenate((carry, chunk))
+        count = data.shape[0] - window_size
+        if traces_max != 0:
+            count = min(count, remaining)
+        if count > 0:
+            yield calculate_window_averages(data, window_size=window_size, traces_max=count)
+            data = data[count:]
+            remaining -= count
+            if traces_max != 0 and remaining == 0:
+                return
+        carry = np.array(data)
+
+
+def calculate_dpa(traces, iv, order=1, key_guess=0, window_size_fma=5, num_of_traces=0, hypothesis=None,
+                  dtype=np.float64, profiler=None, poi=None, poi_b=None, n_jobs=1):
+    # hypothesis: precomputed leakage per trace, e.g. LeakageModels.intermediate_values(iv). iv is ignored if given
+    # dtype: working precision of the per-trace arithmetic, np.float32 halves the buffers; sums are always float64
+    # the traces are never converted as a whole, so peak memory stays close to the size of the traces
+    # profiler: optional Profiling.Profiler recording the stages of the run
+    # poi, poi_b: order 2 only, restrict the sample pairs to points of interest, see calculate_second_order_dpa_poi
+    # the output then follows the pair order of second_order_pairs(poi, poi_b, samples)
+    # n_jobs: order 2 only, worker processes of the pair computation, see calculate_second_order_dpa_tiled
+    profiler = get_profiler(profiler)
+    with profiler.stage("calculate_dpa"):
+        return dpa_stages(traces, iv, order, key_guess, window_size_fma, num_of_traces, hypothesis, dtype, profiler,
+                          poi, poi_b, n_jobs)
+
+
+def dpa_stages(traces, iv, order, key_guess, window_size_fma, num_of_traces, hypothesis, dtype, profiler, poi=None,
+               poi_b=None, n_jobs=1):
     if order == 1:
         max_cpa = [0] * 1
 
         num_trace = len(traces)
 
-        t_bar = np.mean(traces, axis=0)
-        o_t = std_dev(traces, t_bar)
+        with profiler.stage("trace_moments"):
+            t_bar = np.mean(traces, axis=0, dtype=np.float64)
+            o_t = std_dev(traces, t_bar, dtype=dtype)
 
-        hws = np.array([[intermediate_value(textout) for textout in iv[0:num_trace]]]).transpose()
-        hws_bar = np.mean(hws, axis=0)
+        with profiler.stage("hypothesis"):
+            hws = hypothesis_column(iv, hypothesis, num_trace)
+            hws_bar = np.mean(hws, axis=0, dtype=np.float64)
+            o_hws = std_dev(hws, hws_bar, dtype=dtype)
 
-        o_hws = std_dev(hws, hws_bar)
-        correlation = cov(traces, t_bar, hws, hws_bar)
+        with profiler.stage("covariance"):
+            correlation = cov(traces, t_bar, hws, hws_bar, dtype=dtype)
         cpa_output = correlation / (o_t * o_hws)
 
         max_cpa[key_guess] = max(abs(cpa_output))
@@ -54,36 +146,28 @@ def calculate_dpa(traces, iv, order=1, key_guess=0, window_size_fma=5, num_of_tr
         return cpa_output, guess_corr, guess
 
     if order == 2:
-        if num_of_traces != 0:
-            fma = calculate_window_averages(traces, window_size=window_size_fma)
-            traces = np.array(fma[0:num_of_traces])
-        else:
-            fma = calculate_window_averages(traces, window_size=window_size_fma)
-            traces = np.array(fma)
-            num_of_traces = traces.shape[0]
-
-        length_vector = traces.shape[1]
-        P = np.zeros((num_of_traces, int((length_vector - 1) * length_vector / 2)))
+        columns = None
+        if poi is not None:
+            # the window averages are taken per sample, so only the selected samples need them
+            columns, poi, poi_b = poi_columns(poi, poi_b, traces.shape[1])
+            traces = poi_traces(traces, columns)
 
-        e = 0
-        s = 0
-        for i in range(length_vector):
-            e = s + length_vector - i - 1
-            P[:, s:e] = np.abs(np.subtract(traces[:, i + 1:], traces[:, i].reshape(-1, 1)))
-            s = e
+        with profiler.stage("window_averages"):
+            traces = calculate_window_averages(traces, window_size=window_size_fma, traces_max=num_of_traces,
+                                               dtype=None if np.dtype(dtype) == np.float64 else dtype)
+        num_of_traces = traces.shape[0]
 
-        dpa_trace = P
         max_cpa = [0] * 1
-        num_trace = len(dpa_trace)
-        t_bar = np.mean(dpa_trace, axis=0)
-        o_t = std_dev(dpa_trace, t_bar)
         k_guess = 0
 
-        hws = np.array([[intermediate_value(textout) for textout in iv[0:num_trace]]]).transpose()
-        hws_bar = np.mean(hws, axis=0)
-        o_hws = std_dev(hws, hws_bar)
-        correlation = cov(dpa_trace, t_bar, hws, hws_bar)
-        cpa_output = correlation / (o_t * o_hws)
+        with profiler.stage("hypothesis"):
+            hws = hypothesis_column(iv, hypothesis, num_of_traces)
+        if columns is None:
+            cpa_output = calculate_second_order_dpa_tiled(traces, hypothesis=hws[:, 0], n_jobs=n_jobs, dtype=dtype,
+                                                          profiler=profiler)
+        else:
+            cpa_output = second_order_selected(traces, poi, poi_b, hws[:, 0], "absdiff", 256, 2 ** 24, dtype,
+                                               profiler, n_jobs)[0]
         max_cpa[k_guess] = max(abs(cpa_output))
         guess = np.argmax(max_cpa)
         guess_corr = max(max_cpa)
@@ -91,115 +175,580 @@ def calculate_dpa(traces, iv, order=1, key_guess=0, window_size_fma=5, num_of_tr
         return cpa_output, guess_corr, guess
 
 
-def calculate_second_order_dpa_mem_efficient(traces, IV, window_width):
-    num_of_samples = traces.shape[1]
+class CPAAccumulator:
+    # running sums for the correlation between traces x and hypotheses h, memory is O(samples) per hypothesis
+    # dtype is the working precision of each chunk, the running sums are float64
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.n = 0
+        self.sum_x = None
+        self.sum_x2 = None
+        self.sum_h = None
+        self.sum_h2 = None
+        self.sum_xh = None
+        # the sums are taken around the first chunk's means so they stay well conditioned
+        self.x_shift = None
+        self.h_shift = None
+
+    def update(self, traces, hws):
+        # one working copy of the chunk, shifted and squared in place
+        x = np.array(traces, dtype=self.dtype)
+        h = np.array(hws, dtype=self.dtype).reshape(x.shape[0], -1)
+
+        if self.n == 0:
+            self.x_shift = x.mean(axis=0, dtype=np.float64).astype(self.dtype)
+            self.h_shift = h.mean(axis=0, dtype=np.float64).astype(self.dtype)
+            self.sum_x = np.zeros(x.shape[1])
+            self.sum_x2 = np.zeros(x.shape[1])
+            self.sum_h = np.zeros(h.shape[1])
+            self.sum_h2 = np.zeros(h.shape[1])
+            self.sum_xh = np.zeros((h.shape[1], x.shape[1]))
+
+        x -= self.x_shift
+        h -= self.h_shift
+
+        self.n += x.shape[0]
+        self.sum_xh += h.T @ x
+        self.sum_x += x.sum(axis=0, dtype=np.float64)
+        self.sum_h += h.sum(axis=0, dtype=np.float64)
+        x *= x
+        h *= h
+        self.sum_x2 += x.sum(axis=0, dtype=np.float64)
+        self.sum_h2 += h.sum(axis=0, dtype=np.float64)
+
+    def correlation(self):
+        o_t = np.sqrt(self.n * self.sum_x2 - self.sum_x ** 2)
+        o_hws = np.sqrt(self.n * self.sum_h2 - self.sum_h ** 2)
+        correlation = self.n * self.sum_xh - np.outer(self.sum_h, self.sum_x)
+        return correlation / np.outer(o_hws, o_t)
+
+
+def iterate_chunks(traces, iv, chunk_size=10000):
+    # works on arrays, memory maps and FileFormat datasets or dataset views
+    if hasattr(traces, "read_data"):
+        traces = traces.view()
+    if hasattr(iv, "read_data"):
+        iv = iv.view()
+
+    num_trace = min(len(traces), len(iv))
+    for start in range(0, num_trace, chunk_size):
+        end = min(start + chunk_size, num_trace)
+        yield np.asarray(traces[start:end]), np.asarray(iv[start:end])
+
+
+def calculate_dpa_streaming(chunks, leakage_model=intermediate_values, dtype=np.float64, profiler=None):
+    # first order CPA over an iterable of (traces, iv) chunks, e.g. iterate_chunks(traces, iv)
+    # with leakage_model=None the chunks hold precomputed hypotheses instead of iv bytes
+    profiler = get_profiler(profiler)
+    with profiler.stage("calculate_dpa_streaming"):
+        accumulator = CPAAccumulator(dtype)
+        for trace_chunk, iv_chunk in profiler.iterate("read", chunks):
+            with profiler.stage("hypothesis"):
+                hws = iv_chunk if leakage_model is None else leakage_model(iv_chunk)
+            with profiler.stage("update"):
+                accumulator.update(trace_chunk, hws)
+
+        # one row per hypothesis column, a single hypothesis gives a 1D output like calculate_dpa
+        with profiler.stage("correlation"):
+            cpa_output = accumulator.correlation()
+
+    max_cpa = np.max(np.abs(cpa_output), axis=1)
+    if cpa_output.shape[0] == 1:
+        cpa_output = cpa_output[0]
+
+    guess = np.argmax(max_cpa)
+    guess_corr = max(max_cpa)
+
+    return cpa_output, guess_corr, guess
+
+
+def calculate_dpa_convergence(chunks, checkpoints, leakage_model=intermediate_values, threshold=None,
+                              dtype=np.float64, profiler=None):
+    # max |rho| against the number of traces for every hypothesis, from a single streaming pass over (traces, iv)
+    # chunks instead of rerunning calculate_dpa on traces[0:N] for every N
+    # checkpoints: the trace counts to evaluate, or a step to evaluate every multiple of it; the last trace always is
+    # threshold: |rho| to cross, None for 4.5 / sqrt(N), the 4.5 sigma bound of an uncorrelated hypothesis
+    # returns the checkpoint trace counts, max |rho| per checkpoint (checkpoints x H) and per hypothesis the first
+    # trace count at which the threshold was crossed, -1 if it never was
+    profiler = get_profiler(profiler)
+    with profiler.stage("calculate_dpa_convergence"):
+        accumulator = CPAAccumulator(dtype)
+        counts = []
+        max_corr = []
+
+        def evaluate():
+            with profiler.stage("correlation"):
+                counts.append(accumulator.n)
+                max_corr.append(np.max(np.abs(accumulator.correlation()), axis=1))
+
+        for trace_chunk, iv_chunk in profiler.iterate("read", chunks):
+            with profiler.stage("hypothesis"):
+                hws = iv_chunk if leakage_model is None else leakage_model(iv_chunk)
+                hws = np.asarray(hws).reshape(len(trace_chunk), -1)
+
+            # the chunk is split so that every checkpoint is evaluated at its exact trace count
+            start = 0
+            for stop in checkpoint_offsets(accumulator.n, len(trace_chunk), checkpoints):
+                with profiler.stage("update"):
+                    accumulator.update(trace_chunk[start:stop], hws[start:stop])
+                start = stop
+                evaluate()
+            if start < len(trace_chunk):
+                with profiler.stage("update"):
+                    accumulator.update(trace_chunk[start:], hws[start:])
+
+        if not counts or counts[-1] != accumulator.n:
+            evaluate()
+
+    counts = np.array(counts)
+    max_corr = np.array(max_corr)
+    if threshold is None:
+        threshold = 4.5 / np.sqrt(counts)
+    return counts, max_corr, first_crossing(counts, max_corr, threshold)
+
+
+def calculate_dpa_multi(traces, hypotheses, correct_hypothesis=None, dtype=np.float64, block_size=4096, profiler=None):
+    # first order CPA for all hypothesis columns at once, hypotheses is (traces x H), e.g. one column per key guess
+    profiler = get_profiler(profiler)
+    with profiler.stage("calculate_dpa_multi"):
+        num_trace = len(traces)
+
+        # trace moments are computed once for all hypotheses
+        with profiler.stage("trace_moments"):
+            t_bar = np.mean(traces, axis=0, dtype=np.float64)
+            o_t = std_dev(traces, t_bar, dtype=dtype, block_size=block_size)
+
+        with profiler.stage("hypothesis"):
+            hws = np.asarray(hypotheses[0:num_trace], dtype=np.float64).reshape(num_trace, -1)
+            hws_centered = hws - np.mean(hws, axis=0)
+            o_hws = np.sqrt(np.einsum('ij,ij->j', hws_centered, hws_centered))
+
+        # the covariance of every hypothesis is a matrix multiply, done block by block in the working dtype so the
+        # traces are never converted as a whole; the blocks are centered first, as in cov, because the products of
+        # uncentered traces cancel badly in float32
+        with profiler.stage("covariance"):
+            hws_working = hws_centered.astype(dtype, copy=False)
+            t_bar_working = t_bar.astype(dtype)
+            buffer = np.empty((min(block_size, num_trace),) + np.shape(traces)[1:], dtype=dtype)
+            correlation = np.zeros((hws.shape[1],) + np.shape(traces)[1:])
+            for start in range(0, num_trace, block_size):
+                block = buffer[:min(block_size, num_trace - start)]
+                block[:] = traces[start:start + block_size]
+                block -= t_bar_working
+                correlation += hws_working[start:start + block_size].T @ block
+        cpa_output = correlation / np.outer(o_hws, o_t)
+
+    max_cpa = np.max(np.abs(cpa_output), axis=1)
+    ranking = np.argsort(-max_cpa, kind="stable")
+
+    ge = None
+    if correct_hypothesis is not None:
+        ge = guessing_entropy(ranking, correct_hypothesis)
+
+    return cpa_output, max_cpa, ranking, ge
+
+
+def guessing_entropy(rankings, correct_hypothesis):
+    # average rank (0 = best) of the correct hypothesis over one or more rankings, one ranking per row
+    rankings = np.atleast_2d(rankings)
+    found = rankings == correct_hypothesis
+    # argmax of a row without the hypothesis would report it as the best guess
+    if not np.all(np.any(found, axis=1)):
+        raise ValueError(f"Hypothesis {correct_hypothesis} is missing from a ranking")
+    ranks = np.argmax(found, axis=1)
+    return np.mean(ranks)
+
+
+def calculate_second_order_dpa_tiled(traces, iv=None, hypothesis=None, combine="absdiff", block_size=256,
+                                     tile_size=2 ** 24, n_jobs=1, dtype=np.float64, profiler=None):
+    # second order CPA over every sample pair (i, j > i), in the same pair order as calculate_dpa(order=2)
+    # combine: "absdiff" for |x_i - x_j| or "product" for the centered product (x_i - mean_i) * (x_j - mean_j)
+    # the pair triangle is processed in (block_size x block_size) tiles and the traces in chunks so that the combined
+    # values held at once never exceed tile_size elements (per worker when n_jobs > 1)
+    # dtype is the working precision of the combined values, the sums over traces are float64
+    profiler = get_profiler(profiler)
+    num_of_traces, num_of_samples = traces.shape
+    with profiler.stage("second_order_setup"):
+        hws_centered, o_hws, t_bar = second_order_setup(traces, iv, hypothesis, combine)
+
+    with profiler.stage("second_order_pairs"):
+        if n_jobs == 1:
+            cpaoutput = np.zeros((hws_centered.shape[1], (num_of_samples - 1) * num_of_samples // 2))
+            second_order_rows(traces, hws_centered, o_hws, t_bar, combine, 0, num_of_samples, block_size, tile_size,
+                              cpaoutput, dtype)
+        else:
+            cpaoutput = second_order_parallel(traces, hws_centered, o_hws, t_bar, combine, block_size, tile_size,
+                                              n_jobs, dtype)
+
+    if hypothesis is None or np.ndim(hypothesis) == 1:
+        return cpaoutput[0]
+    return cpaoutput
+
+
+def second_order_setup(traces, iv, hypothesis, combine):
+    if combine not in ("absdiff", "product"):
+        raise ValueError("combine must be 'absdiff' or 'product'")
+
     num_of_traces = traces.shape[0]
-    P_normal_width = int((num_of_samples - 1) * num_of_samples / 2)
-
-    num_of_iterations = math.floor(P_normal_width / num_of_samples)
-
-    #predefine
-    cpaoutput = np.zeros(P_normal_width)
-    P = np.zeros((num_of_traces, window_width))
-
-    current_P_index = 0
-    current_partition_index = 0
-    for i in range(num_of_iterations):
-        current_num_in_P = 0
-
-        while current_num_in_P < window_width:
-            if current_partition_index == 0:
-                sub_array = np.abs(
-                    np.subtract(traces[:, current_P_index + 1:], traces[:, current_P_index].reshape(-1, 1)))
-                length_sub_array = sub_array.shape[1]
-
-                if length_sub_array + current_num_in_P <= window_width:
-                    P[:, current_num_in_P: current_num_in_P + length_sub_array] = sub_array
-                    current_num_in_P = current_num_in_P + length_sub_array
-                    current_P_index = current_P_index + 1
-                else:
-                    number_to_add = window_width - current_num_in_P
-                    P[:, current_num_in_P: window_width] = sub_array[:, 0:number_to_add]
-                    current_num_in_P = window_width
-                    current_partition_index = number_to_add
-            else:
-                sub_array = np.abs(
-                    np.subtract(traces[:, current_P_index + 1:], traces[:, current_P_index].reshape(-1, 1)))
-                length_sub_array = sub_array.shape[1]
-                num_left_to_add = length_sub_array - current_partition_index
-
-                if num_left_to_add <= window_width:
-                    P[:, current_num_in_P: num_left_to_add] = sub_array[:, current_partition_index:]
-                    current_num_in_P = current_num_in_P + num_left_to_add
-                    current_P_index = current_P_index + 1
-                    current_partition_index = 0
-
-                else:
-                    P[:] = sub_array[:, current_partition_index:current_partition_index + window_width]
-                    current_num_in_P = window_width
-                    current_partition_index = current_partition_index + window_width
-
-        #solve for cpa output
-        dpa_trace = P
-
-        t_bar = np.mean(dpa_trace)
-        o_t = std_dev(dpa_trace, t_bar)
-        hws = np.array([[intermediate_value(textout) for textout in IV[0:num_of_traces]]]).transpose()
-        hws_bar = np.mean(hws)
-        # hws_bar = mean(out[:,5])
-        o_hws = std_dev(hws, hws_bar)
-        correlation = cov(dpa_trace, t_bar, hws, hws_bar)
-        cpaoutput[i * window_width: (i * window_width) + window_width] = correlation / (o_t * o_hws)
-
-    #final run through
-    start_index = window_width * num_of_iterations
-    num_to_add = P_normal_width - start_index
-    current_num_in_P = 0
-    P = np.zeros((num_of_traces, num_to_add))
-
-    if num_to_add > 0:
-        while current_num_in_P < num_to_add:
-
-            if current_partition_index == 0:
-                sub_array = np.abs(
-                    np.subtract(traces[:, current_P_index + 1:], traces[:, current_P_index].reshape(-1, 1)))
-                length_sub_array = sub_array.shape[1]
-
-                if length_sub_array + current_num_in_P <= num_to_add:
-                    P[:, current_num_in_P: current_num_in_P + length_sub_array] = sub_array
-                    current_num_in_P = current_num_in_P + length_sub_array
-                    current_P_index = current_P_index + 1
-                else:
-                    number_to_add = num_to_add - current_num_in_P
-                    P[:, current_num_in_P: num_to_add] = sub_array[:, 0:number_to_add]
-                    current_num_in_P = num_to_add
-                    current_partition_index = number_to_add
-            else:
-                sub_array = np.abs(
-                    np.subtract(traces[:, current_P_index + 1:], traces[:, current_P_index].reshape(-1, 1)))
-                length_sub_array = sub_array.shape[1]
-                num_left_to_add = length_sub_array - current_partition_index
-
-                if num_left_to_add <= num_to_add:
-                    P[:, current_num_in_P: num_left_to_add] = sub_array[:, current_partition_index:]
-                    current_num_in_P = current_num_in_P + num_left_to_add
-                    current_P_index = current_P_index + 1
-                    current_partition_index = 0
-
-                else:
-                    P[:] = sub_array[:, current_partition_index:current_partition_index + num_to_add]
-                    current_num_in_P = num_to_add
-                    current_partition_index = current_partition_index + num_to_add
-
-        dpa_trace = P
-
-        t_bar = np.mean(dpa_trace)
-        o_t = std_dev(dpa_trace, t_bar)
-        hws = np.array([[intermediate_value(textout) for textout in IV[0:num_of_traces]]]).transpose()
-        hws_bar = np.mean(hws)
-        # hws_bar = mean(out[:,5])
-        o_hws = std_dev(hws, hws_bar)
-        correlation = cov(dpa_trace, t_bar, hws, hws_bar)
-        cpaoutput[start_index:] = correlation / (o_t * o_hws)
+    if hypothesis is None:
+        hypothesis = intermediate_values(iv[0:num_of_traces])
+    hws = np.asarray(hypothesis[0:num_of_traces], dtype=np.float64).reshape(num_of_traces, -1)
+    hws_centered = hws - np.mean(hws, axis=0)
+    o_hws = np.sqrt(np.einsum('ij,ij->j', hws_centered, hws_centered))
+
+    t_bar = np.mean(traces, axis=0, dtype=np.float64) if combine == "product" else None
+    return hws_centered, o_hws, t_bar
+
+
+def pair_offset(i, num_of_samples):
+    # index of pair (i, i + 1) in the flattened pair triangle
+    return i * num_of_samples - i * (i + 1) // 2
+
 
+def second_order_rows(traces, hws_centered, o_hws, t_bar, combine, i_start, i_stop, block_size, tile_size, cpaoutput,
+                      dtype=np.float64):
+    # fill the pairs (i, j > i) for i_start <= i < i_stop into cpaoutput
+    num_of_samples = traces.shape[1]
+
+    for i0 in range(i_start, i_stop, block_size):
+        i1 = min(i0 + block_size, i_stop)
+        for j0 in range(i0, num_of_samples, block_size):
+            j1 = min(j0 + block_size, num_of_samples)
+            corr = second_order_tile(traces, hws_centered, o_hws, t_bar, combine, slice(i0, i1), slice(j0, j1),
+                                     tile_size, dtype)
+
+            for i in range(i0, i1):
+                j_first = max(j0, i + 1)
+                if j_first >= j1:
+                    continue
+                s = pair_offset(i, num_of_samples) + j_first - i - 1
+                cpaoutput[:, s:s + j1 - j_first] = corr[:, i - i0, j_first - j0:]
+
+
+def second_order_parallel(traces, hws_centered, o_hws, t_bar, combine, block_size, tile_size, n_jobs,
+                          dtype=np.float64, cross=None):
+    # split the pair triangle into row ranges with about the same number of pairs and fill them on a process pool
+    # cross: the positions (poi, poi_b) of two column sets, their cross pairs are computed instead of the triangle
+    # the traces and the output live in shared memory, so workers neither receive nor return large arrays
+    # the output is returned in place in its shared memory, which is released when the array is freed
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if cross is None:
+        num_of_rows = traces.shape[1]
+        pairs_done = np.cumsum(np.arange(num_of_rows - 1, -1, -1))
+    else:
+        num_of_rows = len(cross[0])
+        pairs_done = np.cumsum(np.count_nonzero(cross_pairs(*cross), axis=1))
+    num_of_pairs = int(pairs_done[-1]) if num_of_rows else 0
+    output_shape = (hws_centered.shape[1], num_of_pairs)
+
+    num_of_tasks = min(num_of_rows, 4 * n_jobs)
+    bounds = np.searchsorted(pairs_done, np.arange(1, num_of_tasks) * num_of_pairs / num_of_tasks) + 1
+    bounds = np.unique(np.concatenate(([0], bounds, [num_of_rows])))
+
+    traces_shm = shared_memory.SharedMemory(create=True, size=max(1, traces.nbytes))
+    output_shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(output_shape)) * 8))
+    shared_traces = cpaoutput = None
+    try:
+        shared_traces = np.ndarray(traces.shape, dtype=traces.dtype, buffer=traces_shm.buf)
+        shared_traces[:] = traces
+        cpaoutput = np.ndarray(output_shape, dtype=np.float64, buffer=output_shm.buf)
+
+        init_args = (traces_shm.name, traces.shape, traces.dtype.str, output_shm.name, output_shape, hws_centered,
+                     o_hws, t_bar, combine, block_size, tile_size, np.dtype(dtype).str, cross)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=second_order_worker_init,
+                                 initargs=init_args) as pool:
+            list(pool.map(second_order_worker, bounds[:-1], bounds[1:]))
+    except BaseException:
+        # the arrays export the shared buffers, which cannot be closed while they exist
+        cpaoutput = None
+        output_shm.close()
+        raise
+    finally:
+        shared_traces = None
+        traces_shm.close()
+        traces_shm.unlink()
+        # the name is no longer needed once the workers are done, the mapping stays valid until it is closed
+        output_shm.unlink()
+
+    weakref.finalize(cpaoutput, output_shm.close)
     return cpaoutput
+
+
+second_order_worker_state = {}
+
+
+def second_order_worker_init(traces_name, traces_shape, traces_dtype, output_name, output_shape, hws_centered, o_hws,
+                             t_bar, combine, block_size, tile_size, dtype, cross=None):
+    traces_shm = shared_memory.SharedMemory(name=traces_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    if cross is not None:
+        keep = cross_pairs(*cross)
+        cross = cross + (keep, cross_output_index(keep))
+    second_order_worker_state.update(
+        shm=(traces_shm, output_shm),
+        traces=np.ndarray(traces_shape, dtype=traces_dtype, buffer=traces_shm.buf),
+        cpaoutput=np.ndarray(output_shape, dtype=np.float64, buffer=output_shm.buf),
+        args=(hws_centered, o_hws, t_bar, combine),
+        block_size=block_size,
+        tile_size=tile_size,
+        dtype=np.dtype(dtype),
+        cross=cross,
+    )
+
+
+def second_order_worker(i_start, i_stop):
+    state = second_order_worker_state
+    hws_centered, o_hws, t_bar, combine = state["args"]
+    if state["cross"] is None:
+        second_order_rows(state["traces"], hws_centered, o_hws, t_bar, combine, int(i_start), int(i_stop),
+                          state["block_size"], state["tile_size"], state["cpaoutput"], state["dtype"])
+    else:
+        second_order_cross_rows(state["traces"], hws_centered, o_hws, t_bar, combine, *state["cross"], int(i_start),
+                                int(i_stop), state["block_size"], state["tile_size"], state["cpaoutput"],
+                                state["dtype"])
+
+
+def second_order_tile(traces, hws_centered, o_hws, t_bar, combine, cols_a, cols_b, tile_size, dtype=np.float64):
+    # correlation of every combined pair (a, b) of the tile with each hypothesis, accumulated over trace chunks
+    num_of_traces = traces.shape[0]
+    width_a = len(range(traces.shape[1])[cols_a]) if isinstance(cols_a, slice) else len(cols_a)
+    width_b = len(range(traces.shape[1])[cols_b]) if isinstance(cols_b, slice) else len(cols_b)
+    chunk = max(1, tile_size // (width_a * width_b))
+
+    sum_p = np.zeros((width_a, width_b))
+    sum_p2 = np.zeros((width_a, width_b))
+    sum_ph = np.zeros((hws_centered.shape[1], width_a, width_b))
+    shift = None
+    hws_working = hws_centered.astype(dtype, copy=False)
+
+    for start in range(0, num_of_traces, chunk):
+        end = min(start + chunk, num_of_traces)
+        x = traces[start:end]
+        x_a = np.array(x[:, cols_a], dtype=dtype)
+        x_b = np.array(x[:, cols_b], dtype=dtype)
+
+        if combine == "product":
+            x_a -= t_bar[cols_a].astype(dtype)
+            x_b -= t_bar[cols_b].astype(dtype)
+            P = x_a[:, :, np.newaxis] * x_b[:, np.newaxis, :]
+        else:
+            P = np.subtract(x_a[:, :, np.newaxis], x_b[:, np.newaxis, :])
+            np.abs(P, out=P)
+
+        # shifting by the first chunk's mean keeps the raw sums well conditioned
+        if shift is None:
+            shift = P.mean(axis=0, dtype=np.float64).astype(dtype)
+        P -= shift
+
+        sum_p += P.sum(axis=0, dtype=np.float64)
+        sum_ph += np.tensordot(hws_working[start:end].T, P, axes=1)
+        P *= P
+        sum_p2 += P.sum(axis=0, dtype=np.float64)
+
+    # the hypotheses are centered, so sum(P * h) is already the covariance
+    # pairs of a sample with itself on diagonal tiles have no variance and are discarded by the caller
+    o_t = np.sqrt(sum_p2 - sum_p ** 2 / num_of_traces)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sum_ph / (o_hws[:, np.newaxis, np.newaxis] * o_t)
+
+
+def calculate_second_order_dpa_mem_efficient(traces, IV, window_width, hypothesis=None, n_jobs=1, dtype=np.float64,
+                                             profiler=None, poi=None, poi_b=None):
+    # the combined values held at once are bounded by the same (traces x window_width) buffer as before
+    # poi, poi_b: restrict the sample pairs to points of interest, the output then follows the pair order of
+    # second_order_pairs(poi, poi_b, samples)
+    profiler = get_profiler(profiler)
+    tile_size = traces.shape[0] * window_width
+    block_size = tile_block_size(tile_size, traces.shape[0])
+    with profiler.stage("calculate_second_order_dpa_mem_efficient"):
+        if poi is not None:
+            return calculate_second_order_dpa_poi(traces, IV, hypothesis=hypothesis, poi=poi, poi_b=poi_b,
+                                                  block_size=block_size, tile_size=tile_size, n_jobs=n_jobs,
+                                                  dtype=dtype, profiler=profiler)[0]
+        return calculate_second_order_dpa_tiled(traces, IV, hypothesis=hypothesis, block_size=block_size,
+                                                tile_size=tile_size, n_jobs=n_jobs, dtype=dtype, profiler=profiler)
+
+
+def tile_block_size(tile_size, num_of_traces, min_chunk=1024, max_block=256):
+    # the largest tile side (up to max_block) whose chunks still hold min_chunk traces, or all traces if fewer, within
+    # tile_size combined values; a fixed side would shrink the chunks to single traces for small budgets
+    chunk = max(1, min(num_of_traces, min_chunk))
+    return int(max(1, min(max_block, math.isqrt(max(1, tile_size // chunk)))))
+
+
+def calculate_second_order_dpa_poi(traces, iv=None, hypothesis=None, poi=None, poi_b=None, combine="absdiff",
+                                   block_size=256, tile_size=2 ** 24, n_jobs=1, dtype=np.float64, profiler=None):
+    # second order CPA restricted to points of interest instead of every sample pair of the trace
+    # poi: the samples to combine, as a window slice(start, stop), range or (start, stop) tuple, an array or list of
+    # sample indices, or a list of windows; see select_poi to pick them from the traces
+    # poi_b: a second set for cross pairs, the pairs (a in poi, b in poi_b, a != b) are computed; a pair of two
+    # samples in both sets is computed once, as (a, b) with a < b
+    # without poi_b every pair (i, j > i) within poi is computed
+    # n_jobs: worker processes of the pair computation, see calculate_second_order_dpa_tiled
+    # returns the correlation per pair (H x pairs, 1D for a single hypothesis) and the original sample indices of the
+    # two samples of every pair
+    profiler = get_profiler(profiler)
+    with profiler.stage("calculate_second_order_dpa_poi"):
+        columns, poi, poi_b = poi_columns(poi, poi_b, traces.shape[1])
+        with profiler.stage("read"):
+            selected = poi_traces(traces, columns)
+            profiler.add_bytes_read(selected.nbytes)
+
+        if hypothesis is None:
+            hypothesis = intermediate_values(iv[0:traces.shape[0]])
+        cpaoutput, pairs_a, pairs_b = second_order_selected(selected, poi, poi_b, hypothesis, combine, block_size,
+                                                            tile_size, dtype, profiler, n_jobs)
+
+    return cpaoutput, columns[pairs_a], columns[pairs_b]
+
+
+def poi_indices(poi, num_of_samples):
+    # sorted unique sample indices of a window, an index list or a list of windows
+    # only a slice or a (start, stop) pair is a window, any other tuple is a list of indices
+    if is_window(poi):
+        window = poi if isinstance(poi, slice) else slice(*poi)
+        if num_of_samples is None:
+            return np.arange(window.start or 0, window.stop, window.step or 1)
+        return np.arange(num_of_samples)[window]
+    if isinstance(poi, list) and poi and all(is_window(window) or isinstance(window, range) for window in poi):
+        return np.unique(np.concatenate([poi_indices(window, num_of_samples) for window in poi]))
+
+    poi = np.asarray(poi)
+    if poi.dtype == bool:
+        return np.flatnonzero(poi)
+    if num_of_samples is not None:
+        poi = np.where(poi < 0, poi + num_of_samples, poi)
+    return np.unique(poi)
+
+
+def is_window(poi):
+    return isinstance(poi, slice) or (isinstance(poi, tuple) and len(poi) == 2)
+
+
+def poi_columns(poi, poi_b, num_of_samples):
+    # the columns to extract and the positions of poi and poi_b among them
+    poi = poi_indices(poi, num_of_samples)
+    if poi_b is None:
+        return poi, np.arange(len(poi)), None
+    poi_b = poi_indices(poi_b, num_of_samples)
+    columns = np.union1d(poi, poi_b)
+    return columns, np.searchsorted(columns, poi), np.searchsorted(columns, poi_b)
+
+
+def poi_traces(traces, columns, block_size=4096):
+    # copy the selected columns in row blocks, so a memory map is read once and never held as a whole
+    selected = np.empty((traces.shape[0], len(columns)), dtype=traces.dtype)
+    for start in range(0, traces.shape[0], block_size):
+        selected[start:start + block_size] = traces[start:start + block_size][:, columns]
+    return selected
+
+
+def second_order_pairs(poi, poi_b=None, num_of_samples=None):
+    # original sample indices (a, b) of the pairs computed for poi and poi_b, in output order
+    # num_of_samples is only needed for windows without an end or negative indices
+    columns, poi, poi_b = poi_columns(poi, poi_b, num_of_samples)
+    pairs_a, pairs_b = selected_pairs(poi, poi_b)
+    return columns[pairs_a], columns[pairs_b]
+
+
+def selected_pairs(poi, poi_b):
+    # positions of the pairs among the extracted columns
+    if poi_b is None:
+        return np.triu_indices(len(poi), 1)
+    rows, cols = np.nonzero(cross_pairs(poi, poi_b))
+    return poi[rows], poi_b[cols]
+
+
+def cross_pairs(poi, poi_b):
+    # (len(poi) x len(poi_b)) mask of the cross pairs to compute; both combinations are symmetric, so a pair of two
+    # samples that are in both sets is only kept once, in the order a < b
+    # the positions are sorted like the sample indices, so they can be compared directly
+    shared = np.isin(poi, poi_b)[:, np.newaxis] & np.isin(poi_b, poi)[np.newaxis, :]
+    return (poi[:, np.newaxis] < poi_b[np.newaxis, :]) | ((poi[:, np.newaxis] > poi_b[np.newaxis, :]) & ~shared)
+
+
+def second_order_selected(selected, poi, poi_b, hypothesis, combine, block_size, tile_size, dtype, profiler,
+                          n_jobs=1):
+    # second order CPA over the extracted columns, returns the output and the pair positions among the columns
+    if poi_b is None:
+        # all pairs within one set are the full pair triangle of the extracted columns, in the same order
+        cpaoutput = calculate_second_order_dpa_tiled(selected, hypothesis=hypothesis, combine=combine,
+                                                     block_size=block_size, tile_size=tile_size, n_jobs=n_jobs,
+                                                     dtype=dtype, profiler=profiler)
+        pairs_a, pairs_b = selected_pairs(poi, None)
+        return cpaoutput, pairs_a, pairs_b
+
+    with profiler.stage("second_order_setup"):
+        hws_centered, o_hws, t_bar = second_order_setup(selected, None, hypothesis, combine)
+
+    with profiler.stage("second_order_pairs"):
+        if n_jobs == 1:
+            keep = cross_pairs(poi, poi_b)
+            cpaoutput = np.empty((hws_centered.shape[1], np.count_nonzero(keep)))
+            second_order_cross_rows(selected, hws_centered, o_hws, t_bar, combine, poi, poi_b, keep,
+                                    cross_output_index(keep), 0, len(poi), block_size, tile_size, cpaoutput, dtype)
+        else:
+            cpaoutput = second_order_parallel(selected, hws_centered, o_hws, t_bar, combine, block_size, tile_size,
+                                              n_jobs, dtype, cross=(poi, poi_b))
+
+    pairs_a, pairs_b = selected_pairs(poi, poi_b)
+    if np.ndim(hypothesis) == 1:
+        return cpaoutput[0], pairs_a, pairs_b
+    return cpaoutput, pairs_a, pairs_b
+
+
+def cross_output_index(keep):
+    # position of every kept cross pair in the output, in row major order like selected_pairs, -1 for the others
+    output_index = np.full(keep.shape, -1, dtype=np.int64)
+    output_index[keep] = np.arange(np.count_nonzero(keep))
+    return output_index
+
+
+def second_order_cross_rows(traces, hws_centered, o_hws, t_bar, combine, poi, poi_b, keep, output_index, i_start,
+                            i_stop, block_size, tile_size, cpaoutput, dtype=np.float64):
+    # fill the kept cross pairs of the poi positions i_start <= i < i_stop into cpaoutput
+    for i0 in range(i_start, i_stop, block_size):
+        i1 = min(i0 + block_size, i_stop)
+        for j0 in range(0, len(poi_b), block_size):
+            tile_keep = keep[i0:i1, j0:j0 + block_size]
+            rows, cols = tile_keep.any(axis=1), tile_keep.any(axis=0)
+            if not rows.any():
+                continue
+            # only the samples of the tile that are part of a kept pair are combined
+            tile_keep = tile_keep[rows][:, cols]
+            tile = second_order_tile(traces, hws_centered, o_hws, t_bar, combine, poi[i0:i1][rows],
+                                     poi_b[j0:j0 + block_size][cols], tile_size, dtype)
+            cpaoutput[:, output_index[i0:i1, j0:j0 + block_size][rows][:, cols][tile_keep]] = tile[:, tile_keep]
+
+
+def select_poi(traces, labels=None, num_poi=20, min_distance=0, block_size=4096):
+    # points of interest ranked by first order SNR of the labels, e.g. the Hamming weight of a share, or by the
+    # variance of the traces when no labels are given
+    # min_distance: samples closer than this to an already selected sample are skipped, so one wide peak does not
+    # take every slot
+    # returns the selected sample indices in increasing order and the score of every sample
+    num_of_traces = traces.shape[0]
+    if labels is None:
+        t_bar = np.mean(traces, axis=0, dtype=np.float64)
+        score = std_dev(traces, t_bar, block_size=block_size) ** 2 / num_of_traces
+    else:
+        score = sample_snr(traces, labels, block_size)
+
+    selected = []
+    for sample in np.argsort(-np.nan_to_num(score, nan=-np.inf), kind="stable"):
+        if len(selected) == num_poi:
+            break
+        if all(abs(int(sample) - other) >= min_distance for other in selected):
+            selected.append(int(sample))
+    return np.sort(np.array(selected, dtype=np.int64)), score
+
+
+def sample_snr(traces, labels, block_size=4096):
+    # var(class means) / mean(class variances) per sample, the labels may be any values
+    num_of_traces = traces.shape[0]
+    _, label_index = np.unique(np.asarray(labels).ravel()[0:num_of_traces], return_inverse=True)
+    accumulator = SNRAccumulator()
+    for start in range(0, num_of_traces, block_size):
+        accumulator.update(traces[start:start + block_size], label_index[start:start + block_size])
+    return accumulator.snr()
@@ -1,14 +1,25 @@
 from __future__ import annotations
 
+import bisect
+import functools
+import itertools
 import json
 import os
 import re
 import shutil
+import struct
+from collections.abc import Iterable, Iterator, MutableMapping
+from contextlib import contextmanager
 from datetime import date
 
 import numpy as np
 
-# from Metrics import *
+from Alignment import AlignedView, Aligner, apply_shifts
+from Metrics import (PearsonAccumulator, SNRAccumulator, TTestAccumulator, checkpoint_offsets, plot_correlation,
+                     plot_snr, plot_t_test)
+from Pipeline import prefetch
+from Profiling import Profiler, get_profiler
+from TraceContainer import ChunkedTraceFile, quantization_parameters
 
 """
 File: FileFormat.py
@@ -19,7 +30,7 @@ Description: File Format API for side-channel analysis experiments.
 
 
 class FileParent:
-    def __init__(self, name: str, path: str, existing: bool = False):
+    def __init__(self, name: str, path: str, existing: bool = False, compact_json: bool = False, lazy: bool = False):
         """
         Initialize FileFormatParent class. Creates the basic file structure including JSON metadata holder. If the file
         already exists it simply returns a reference to that file. To create a file named "ExampleFile" in your downloads
@@ -31,8 +42,18 @@ class FileParent:
         :type path: str
         :param existing: whether the file already exists
         :type existing: bool
+        :param compact_json: Whether to write the JSON metadata without indentation, which is faster on large files
+        :type compact_json: bool
+        :param lazy: Whether to open an existing file lazily. Experiments and datasets are then only created on first
+                     access and the file system is not checked for them. Call `FileParent.verify()` to remove entries
+                     whose files are missing.
+        :type lazy: bool
         :returns: None
         """
+        self.compact_json = compact_json
+        self._batch_depth = 0
+        self._json_dirty = False
+
         if not existing:
             self.name = name
             if path[-1:] == "\\":
@@ -67,10 +88,10 @@ class FileParent:
                 "experiments": []
             }
 
-            with open(f"{self.path}\\metadataHolder.json", 'w') as json_file:
-                json.dump(self.json_data, json_file, indent=4)
+            self.update_json()
 
-            self.experiments = {}
+            self.experiments = LazyRegistry(self._load_experiment)
+            self.experiment_index = MetadataIndex()
             self.metadata = self.json_data['metadata']
 
         else:
@@ -92,25 +113,120 @@ class FileParent:
                 self.path = path_from_json
 
             self.experiments_path = f"{self.path}\\Experiments"
-            self.experiments = {}
+            self.experiments = LazyRegistry(self._load_experiment)
+            self.experiment_index = MetadataIndex()
             self.metadata = self.json_data["metadata"]
 
             for experiment in self.json_data["experiments"]:
-                if os.path.exists(self.path + experiment["path"]):
-                    self.add_experiment_internal(exp_name=experiment.get('name'), existing=True,
-                                                 index=experiment.get('index'),
-                                                 experiment=experiment)
-                else:
-                    for experiment_json in self.json_data["experiments"]:
-                        if experiment_json["name"] == experiment["name"]:
-                            self.json_data["experiments"].remove(experiment_json)
+                self.experiments.add_pending(sanitize_input(experiment["name"]), experiment)
+                self.experiment_index.register(sanitize_input(experiment["name"]))
+                self.experiment_index.add_all(sanitize_input(experiment["name"]), experiment["metadata"])
+
+            if not lazy:
+                self.verify()
+                for experiment in self.experiments.values():
+                    list(experiment.dataset.values())
+
+    def _load_experiment(self, experiment_name: str, experiment: dict) -> 'Experiment':
+        return Experiment(experiment_name, f'\\Experiments\\{experiment_name}', self, existing=True,
+                          index=experiment.get('index'), experiment=experiment)
+
+    def verify(self) -> list[str]:
+        """
+        Check that the directory of every experiment and the file of every dataset exist. Entries whose files are
+        missing are removed from the metadata, which is written once. Each directory is only listed once.
+        :returns: The names of the removed experiments and datasets, datasets as "experiment/dataset"
+        :rtype: list[str]
+        """
+        listings = {}
 
-                    with open(f"{self.path}\\metadataHolder.json", 'w') as json_file:
-                        json.dump(self.json_data, json_file, indent=4)
+        def exists(file_path: str) -> bool:
+            directory, base = os.path.split(file_path)
+            if directory not in listings:
+                try:
+                    listings[directory] = set(os.listdir(directory or "."))
+                except OSError:
+                    listings[directory] = set()
+            return base in listings[directory]
+
+        removed = []
+        kept_experiments = []
+        for experiment_json in self.json_data["experiments"]:
+            experiment_name = sanitize_input(experiment_json["name"])
+            if not exists(self.path + experiment_json["path"]):
+                removed.append(experiment_name)
+                self.experiments.pop(experiment_name, None)
+                self.experiment_index.remove(experiment_name)
+                continue
+
+            kept_experiments.append(experiment_json)
+            kept_datasets = []
+            experiment = self.experiments.get_loaded(experiment_name)
+            for dataset_json in experiment_json["datasets"]:
+                if exists(self.path + experiment_json["path"] + dataset_json["path"]):
+                    kept_datasets.append(dataset_json)
+                else:
+                    removed.append(f"{experiment_name}/{dataset_json['name']}")
+                    if experiment is not None:
+                        experiment.dataset.pop(sanitize_input(dataset_json["name"]), None)
+                        experiment.dataset_index.remove(sanitize_input(dataset_json["name"]))
+
+            if len(kept_datasets) != len(experiment_json["datasets"]):
+                experiment_json["datasets"] = kept_datasets
+                for index, dataset_json in enumerate(kept_datasets):
+                    dataset_json["index"] = index
+                    if experiment is not None:
+                        dataset = experiment.dataset.get_loaded(sanitize_input(dataset_json["name"]))
+                        if dataset is not None:
+                            dataset.index = index
+
+        if len(kept_experiments) != len(self.json_data["experiments"]):
+            self.json_data["experiments"] = kept_experiments
+            for index, experiment_json in enumerate(kept_experiments):
+                experiment_json["index"] = index
+                experiment = self.experiments.get_loaded(sanitize_input(experiment_json["name"]))
+                if experiment is not None:
+                    experiment.experimentIndex = index
+
+        if removed:
+            self.update_json()
+        return removed
 
     def update_json(self) -> None:
-        with open(f"{self.path}\\metadataHolder.json", 'w') as json_file:
-            json.dump(self.json_data, json_file, indent=4)
+        """
+        Write the JSON metadata to disk. Inside of a `FileParent.batch()` block the write is deferred until the block
+        exits. The metadata is written to a temporary file first and then atomically renamed, so an interrupted write
+        never leaves a truncated metadata file behind.
+        :returns: None
+        """
+        if self._batch_depth > 0:
+            self._json_dirty = True
+            return
+
+        json_path = f"{self.path}\\metadataHolder.json"
+        with open(json_path + ".tmp", 'w') as json_file:
+            if self.compact_json:
+                json.dump(self.json_data, json_file, separators=(',', ':'))
+            else:
+                json.dump(self.json_data, json_file, indent=4)
+        os.replace(json_path + ".tmp", json_path)
+        self._json_dirty = False
+
+    @contextmanager
+    def batch(self) -> Iterator['FileParent']:
+        """
+        Context manager deferring all metadata writes made inside of it to a single write when it exits. Blocks may be
+        nested, the metadata is written when the outermost block exits.
+        :returns: An iterator yielding the FileParent object
+        :rtype: Iterator[FileParent]
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._json_dirty:
+                self.update_json()
 
     def update_metadata(self, key: str, value: any) -> None:
         """
@@ -184,6 +300,7 @@ class FileParent:
             idx = len(self.json_data["experiments"]) - 1
             self.json_data["experiments"][idx]["index"] = idx
             self.experiments[exp_name] = Experiment(exp_name, exp_path, self, existing=False, index=idx)
+            self.experiment_index.register(exp_name)
             self.update_json()
 
         else:
@@ -234,40 +351,42 @@ class FileParent:
 
             shutil.rmtree(self.path + self.experiments[experiment_name].path)
             self.experiments.pop(experiment_name)
+            self.experiment_index.remove(experiment_name)
             for experiment_json in self.json_data["experiments"]:
                 if experiment_json["name"] == experiment_name:
                     self.json_data["experiments"].remove(experiment_json)
 
-            with open(f"{self.path}\\metadataHolder.json", 'w') as json_file:
-                json.dump(self.json_data, json_file, indent=4)
+            self.update_json()
         else:
             print("Deletion of experiment {} cancelled.".format(experiment_name))
 
     def query_experiments_with_metadata(self, key: str, value: any, regex: bool = False) -> list['Experiment']:
         """
         Query all experiments in the FileParent object based on exact metadata key-value pair or using regular expressions.
+        The query is answered from an index of the metadata set with `Experiment.update_metadata()`.
         :param key: The key to be queried
         :type key: str
         :param value: The value to be queried. Supply a regular expression if the `regex` parameter is set to true. Supplying
                         a value of "*" will return all experiments with the `key` specified in the key parameter.
         :type value: any
-        :returns: A list of queried experiments
+        :returns: A list of queried experiments in the order they were added
         :rtype: list['Experiment']
         """
-        experiments = []
+        return [self.experiments[name] for name in self.experiment_index.query(key, value, regex)]
 
-        for exp in self.experiments.values():
-            try:
-                res = exp.metadata[key]
-                if not regex:
-                    if value == res or value == "*":
-                        experiments.append(exp)
-                else:
-                    if bool(re.match(value, res)):
-                        experiments.append(exp)
-            except KeyError:
-                continue
-        return experiments
+    def query_experiments_in_range(self, key: str, low: float = None, high: float = None) -> list['Experiment']:
+        """
+        Query all experiments in the FileParent object whose numeric metadata value for a key lies in a range.
+        :param key: The key to be queried
+        :type key: str
+        :param low: The inclusive lower bound. None for no lower bound.
+        :type low: float
+        :param high: The inclusive upper bound. None for no upper bound.
+        :type high: float
+        :returns: A list of queried experiments ordered by the metadata value
+        :rtype: list['Experiment']
+        """
+        return [self.experiments[name] for name in self.experiment_index.query_range(key, low, high)]
 
 
 class Experiment:
@@ -286,7 +405,8 @@ class Experiment:
         if not existing:
             self.name = name
             self.path = path
-            self.dataset = {}
+            self.dataset = LazyRegistry(self._load_dataset)
+            self.dataset_index = MetadataIndex()
             self.metadata = {}
             self.fileFormatParent = file_format_parent
             self.experimentIndex = index
@@ -294,27 +414,20 @@ class Experiment:
         else:
             self.name = name
             self.path = path
-            self.dataset = {}
+            self.dataset = LazyRegistry(self._load_dataset)
+            self.dataset_index = MetadataIndex()
             self.metadata = experiment["metadata"]
             self.fileFormatParent = file_format_parent
             self.experimentIndex = index
 
             for dataset in experiment["datasets"]:
-                if os.path.exists(self.fileFormatParent.path + self.path + dataset["path"]):
-                    self.add_dataset_internal(dataset["name"], existing=True, dataset=dataset)
-                else:
-                    for experiment_json in self.fileFormatParent.json_data["experiments"]:
-                        if experiment_json["name"] == self.name:
-
-                            for _dataset in experiment_json["datasets"]:
-                                if dataset["name"] == _dataset["name"]:
-                                    try:
-                                        experiment_json["datasets"].remove(dataset)
-                                    except ValueError:
-                                        continue
+                self.dataset.add_pending(sanitize_input(dataset["name"]), dataset)
+                self.dataset_index.register(sanitize_input(dataset["name"]))
+                self.dataset_index.add_all(sanitize_input(dataset["name"]), dataset["metadata"])
 
-                    with open(f"{self.fileFormatParent.path}\\metadataHolder.json", 'w') as json_file:
-                        json.dump(self.fileFormatParent.json_data, json_file, indent=4)
+    def _load_dataset(self, dataset_name: str, dataset: dict) -> 'Dataset':
+        return Dataset(dataset_name, dataset["path"], self.fileFormatParent, self, dataset["index"], existing=True,
+                       dataset=dataset)
 
     def update_metadata(self, key: str, value: any) -> None:
         """
@@ -328,11 +441,13 @@ class Experiment:
         key = sanitize_input(key)
         self.metadata[key] = value
         self.fileFormatParent.json_data["experiments"][self.experimentIndex]["metadata"][key] = value
+        self.fileFormatParent.experiment_index.add(self.name, key, value)
         self.fileFormatParent.update_json()
 
     def read_metadata(self) -> dict:
         """
-        Reads experiment metadata
+        Reads experiment metadata. The dictionary is the experiment's own, change it with `update_metadata()` only:
+        changes made to it directly are neither saved nor seen by `FileParent.query_experiments_with_metadata()`.
         :returns: The experiment's metadata dictionary
         :rtype: dict
         """
@@ -350,10 +465,40 @@ class Experiment:
         :returns: The newly created Dataset object
         :rtype: Dataset
         """
-        dataset = self.add_dataset_internal(name, existing=False, dataset=None)
+        with self.fileFormatParent.batch():
+            dataset = self.add_dataset_internal(name, existing=False, dataset=None)
         dataset.add_data(data_to_add, datatype)
         return dataset
 
+    def add_chunked_dataset(self, name: str, data_to_add: np.ndarray, datatype: any, codec: str = "zlib",
+                            chunk_rows: int = 1024, quantize: any = None, scale: float = None,
+                            offset: float = None) -> 'Dataset':
+        """
+        Adds a new Dataset stored in compressed chunks to a given Experiment. See `Dataset.add_chunked_data()`.
+        :param name: The desired name of the new dataset
+        :type name: str
+        :param data_to_add: The NumPy array of data to be added to the new dataset
+        :type data_to_add: np.ndarray
+        :param datatype: The datatype of the dataset
+        :type datatype: any
+        :param codec: The compression codec, one of "zlib", "bz2", "lzma" or "none"
+        :type codec: str
+        :param chunk_rows: The number of rows per compressed chunk
+        :type chunk_rows: int
+        :param quantize: The integer datatype the data is stored as, e.g. "int16". None to store it losslessly.
+        :type quantize: any
+        :param scale: The quantization step. Chosen from the range of the data if not given.
+        :type scale: float
+        :param offset: The value stored as zero. Chosen from the range of the data if not given.
+        :type offset: float
+        :returns: The newly created Dataset object
+        :rtype: Dataset
+        """
+        with self.fileFormatParent.batch():
+            dataset = self.add_dataset_internal(name, existing=False, dataset=None)
+            dataset.add_chunked_data(data_to_add, datatype, codec, chunk_rows, quantize, scale, offset)
+        return dataset
+
     def add_dataset_internal(self, name: str, existing: bool = False, dataset: dict = None) -> 'Dataset':
         """
         Internal Function for adding experiments used when getting a reference to an existing file. Call add_experiment
@@ -388,6 +533,7 @@ class Experiment:
             self.fileFormatParent.update_json()
 
             self.dataset[name] = Dataset(name, path, self.fileFormatParent, self, index, existing=False)
+            self.dataset_index.register(name)
 
         if existing:
             self.dataset[name] = Dataset(name, path, self.fileFormatParent, self, dataset["index"], existing=True,
@@ -419,8 +565,11 @@ class Experiment:
                                                                                                   self.name)))
         if res == "y" or res == "yes":
             print("Deleting dataset {}".format(dataset_name))
-            os.remove(self.fileFormatParent.path + self.path + "\\" + dataset_name + ".npy")
+            # an open memory map or container keeps the file locked on Windows
+            self.dataset[dataset_name]._close_handles()
+            os.remove(self.dataset[dataset_name].get_file_path())
             self.dataset.pop(dataset_name)
+            self.dataset_index.remove(dataset_name)
 
             for experiment_json in self.fileFormatParent.json_data["experiments"]:
                 if experiment_json["name"] == self.name:
@@ -428,8 +577,7 @@ class Experiment:
                         if dataset["name"] == dataset_name:
                             experiment_json["datasets"].remove(dataset)
 
-            with open(f"{self.fileFormatParent.path}\\metadataHolder.json", 'w') as json_file:
-                json.dump(self.fileFormatParent.json_data, json_file, indent=4)
+            self.fileFormatParent.update_json()
 
         else:
             print("Deletion of experiment {} cancelled.".format(dataset_name))
@@ -437,27 +585,100 @@ class Experiment:
     def query_datasets_with_metadata(self, key: str, value: any, regex: bool = False) -> list['Dataset']:
         """
         Query all datasets in the Experiment object based on exact metadata key-value pair or using regular expressions.
+        The query is answered from an index of the metadata set with `Dataset.update_metadata()`.
         :param key: The key to be queried
         :type key: str
         :param value: The value to be queried. Supply a regular expression if the `regex` parameter is set to true. Supplying
                         a value of "*" will return all experiments with the `key` specified in the key parameter.
         :type value: any
-        :returns: A list of queried datasets
+        :returns: A list of queried datasets in the order they were added
         :rtype: list['Dataset']
         """
-        datasets = []
-        for dset in self.dataset.values():
-            try:
-                res = dset.metadata[key]
-                if not regex:
-                    if res == value or value == "*":
-                        datasets.append(dset)
+        return [self.dataset[name] for name in self.dataset_index.query(key, value, regex)]
+
+    def query_datasets_in_range(self, key: str, low: float = None, high: float = None) -> list['Dataset']:
+        """
+        Query all datasets in the Experiment object whose numeric metadata value for a key lies in a range.
+        :param key: The key to be queried
+        :type key: str
+        :param low: The inclusive lower bound. None for no lower bound.
+        :type low: float
+        :param high: The inclusive upper bound. None for no upper bound.
+        :type high: float
+        :returns: A list of queried datasets ordered by the metadata value
+        :rtype: list['Dataset']
+        """
+        return [self.dataset[name] for name in self.dataset_index.query_range(key, low, high)]
+
+    def segmented_view(self, dataset_name: str, samples_per_trace: int = None,
+                       groups: list[str] = None) -> 'SegmentedView':
+        """
+        Get the interleaved trace groups of a dataset captured in segmented fashion. See `Dataset.segmented_view()`.
+        :param dataset_name: The name of the dataset holding the segmented capture
+        :type dataset_name: str
+        :param samples_per_trace: The number of samples in each trace. Read from the metadata if not given.
+        :type samples_per_trace: int
+        :param groups: The names of the interleaved trace groups in capture order. Read from the metadata if not given.
+        :type groups: list[str]
+        :returns: The segmented view of the dataset
+        :rtype: SegmentedView
+        """
+        return self.get_dataset(dataset_name).segmented_view(samples_per_trace, groups)
+
+    def concat_view(self, pattern: str, group: str = None, samples_per_trace: int = None) -> 'ConcatenatedView':
+        """
+        Present several partition datasets, e.g. `random_traces_p0` to `random_traces_pN`, as one logical array without
+        reading or copying them. Datasets are ordered by the numbers in their names, so `p10` follows `p9`.
+        :param pattern: A regular expression the full dataset name has to match, e.g. r"random_traces_p\\d+"
+        :type pattern: str
+        :param group: For segmented captures, the trace group to use from every dataset, e.g. "random". See
+                      `Dataset.segmented_view()`.
+        :type group: str
+        :param samples_per_trace: The number of samples per trace of segmented captures. Read from the metadata if not
+                                  given.
+        :type samples_per_trace: int
+        :returns: The concatenated view of all matching datasets
+        :rtype: ConcatenatedView
+        """
+        compiled = _compile_pattern(pattern)
+        names = sorted((name for name in self.dataset if compiled.fullmatch(name)), key=_natural_key)
+        if group is None:
+            parts = [self.dataset[name].view() for name in names]
+        else:
+            parts = [self.dataset[name].segmented_view(samples_per_trace).group(group) for name in names]
+        return ConcatenatedView(parts)
+
+    def iter_datasets(self, datasets: list[str] | str, chunk_size: int = None, depth: int = 2,
+                      max_bytes: int = None) -> Iterator[tuple[str, np.ndarray]]:
+        """
+        Iterate over the data of several datasets while the next dataset or chunk is read on a background thread.
+        :param datasets: The names of the datasets in order, or a regular expression the full dataset names have to
+                         match. Matching datasets are ordered by the numbers in their names.
+        :type datasets: list[str] | str
+        :param chunk_size: The number of rows read at once. None to read each dataset at once.
+        :type chunk_size: int
+        :param depth: The maximum number of datasets or chunks read ahead
+        :type depth: int
+        :param max_bytes: The maximum number of bytes held by data read ahead and the data being processed. None for no
+                          cap.
+        :type max_bytes: int
+        :returns: An iterator over (dataset name, data) pairs, one per dataset or chunk
+        :rtype: Iterator[tuple[str, np.ndarray]]
+        """
+        if isinstance(datasets, str):
+            compiled = _compile_pattern(datasets)
+            datasets = sorted((name for name in self.dataset if compiled.fullmatch(name)), key=_natural_key)
+
+        def load() -> Iterator[tuple[str, np.ndarray]]:
+            for name in datasets:
+                dataset = self.get_dataset(name)
+                if chunk_size is None:
+                    yield dataset.name, dataset.read_all()
                 else:
-                    if bool(re.match(value, res)):
-                        datasets.append(dset)
-            except KeyError:
-                continue
-        return datasets
+                    for chunk in dataset.view().iter_chunks(chunk_size):
+                        yield dataset.name, np.array(chunk)
+
+        return prefetch(load(), depth=depth, max_bytes=max_bytes)
 
     def get_visualization_path(self) -> str:
         """
@@ -467,12 +688,41 @@ class Experiment:
         """
         return self.fileFormatParent.path + self.path + "\\" + "visualization" + "\\"
 
-    def calculate_snr(self, traces_dataset: str, intermediate_fcn: Callable, *args: any,  visualize: bool = False, save_data: bool = False, save_graph: bool = False) -> np.ndarray:
+    def save_profile(self, profiler: Profiler, name: str, to_metadata: bool = True,
+                     to_visualization: bool = False) -> None:
         """
-        Integrated signal-to-noise ratio metric.
+        Save the per-stage summary of a profiled run, e.g. of `calculate_t_test(..., profiler=profiler)`.
+        :param profiler: The profiler holding the records of the run
+        :type profiler: Profiler
+        :param name: The name of the run. The summary is saved as the metadata key "profile_<name>" and the full report
+                     as "profile_<name>.json" in the visualization folder.
+        :type name: str
+        :param to_metadata: Whether to save the summary in the experiment metadata
+        :type to_metadata: bool
+        :param to_visualization: Whether to save the summary and all records to the visualization folder
+        :type to_visualization: bool
+        :returns: None
+        """
+        name = sanitize_input(name)
+        if to_metadata:
+            self.update_metadata(f"profile_{name}", profiler.summary())
+        if to_visualization:
+            profiler.save(self.get_visualization_path() + f"profile_{name}.json")
+
+    def _profiled_chunks(self, chunks: Iterable, prefetch_depth: int, profiler: Profiler) -> Iterator:
+        # the chunks are read on a background thread, the "read" stage is the time spent waiting for the next one
+        return profiler.iterate("read", prefetch(chunks, depth=prefetch_depth))
+
+    def calculate_snr(self, traces_dataset: str, intermediate_fcn: Callable, *args: any,  visualize: bool = False, save_data: bool = False, save_graph: bool = False, chunk_size: int = 10000, prefetch_depth: int = 2, dtype: any = np.float64, profiler: Profiler = None) -> np.ndarray:
+        """
+        Integrated signal-to-noise ratio metric. The datasets are read in chunks and accumulated with an
+        `SNRAccumulator`, so only the per-class statistics are held in memory.
         :param traces_dataset: The name of the traces dataset
         :type traces_dataset: str
         :param intermediate_fcn: A callback function that determines how the intermediate values for SNR labels are calculated.
+                                 It is called once per chunk with the rows of the additional datasets of that chunk and
+                                 returns one non-negative integer label per trace, e.g.
+                                 `lambda key, pt: sbox[key[:, 0] ^ pt[:, 0]]`.
         :type intermediate_fcn: Callable
         :param *args: Additonal datasets needed for the parameters of the intermediate_fnc.
         :type *args: any
@@ -482,15 +732,33 @@ class Experiment:
         :type save_data: bool
         :param save_graph: Whether to save the visualization to the experiments visualization folder or not
         :type save_graph: bool
+        :param chunk_size: The number of traces read per chunk
+        :type chunk_size: int
+        :param prefetch_depth: The number of chunks read ahead on a background thread
+        :type prefetch_depth: int
+        :param dtype: The working precision of each chunk, e.g. np.float32. The statistics are accumulated in float64.
+        :type dtype: any
+        :param profiler: A profiler recording the stages of the calculation. None to not profile it.
+        :type profiler: Profiler
         :returns: The SNR metric result
         :rtype: np.ndarray
         """
-
+        profiler = get_profiler(profiler)
+        with profiler.stage("calculate_snr"):
+            return self._calculate_snr(traces_dataset, intermediate_fcn, args, visualize, save_data, save_graph,
+                                       chunk_size, prefetch_depth, dtype, profiler)
+
+    def _calculate_snr(self, traces_dataset: str, intermediate_fcn: Callable, args: tuple, visualize: bool,
+                       save_data: bool, save_graph: bool, chunk_size: int, prefetch_depth: int, dtype: any,
+                       profiler: Profiler) -> np.ndarray:
         traces_dataset = sanitize_input(traces_dataset)
-        args = tuple(self.dataset[sanitize_input(x)].read_all() for x in args)
-
-        traces = self.dataset[traces_dataset].read_all()
-        labels = organize_snr_label(traces, intermediate_fcn, *args)
+        with profiler.stage("open"):
+            traces = self.dataset[traces_dataset].view()
+            arg_names = [sanitize_input(x) for x in args]
+            args = tuple(self.dataset[name].view() for name in arg_names)
+        for name, arg in zip(arg_names, args):
+            if len(arg) != len(traces):
+                raise ValueError(f"{traces_dataset} has {len(traces)} rows but {name} has {len(arg)}")
 
         if save_graph:
             path_created = False
@@ -510,16 +778,30 @@ class Experiment:
         else:
             path = None
 
-        snr = signal_to_noise_ratio(labels, visualize=visualize, visualization_path=path)
+        accumulator = SNRAccumulator(dtype=dtype)
+        chunks = zip(traces.iter_chunks(chunk_size), *(arg.iter_chunks(chunk_size) for arg in args))
+        for trace_chunk, *arg_chunks in self._profiled_chunks(chunks, prefetch_depth, profiler):
+            with profiler.stage("labels"):
+                labels = intermediate_fcn(*arg_chunks)
+            with profiler.stage("snr"):
+                accumulator.update(trace_chunk, labels)
+
+        with profiler.stage("snr"):
+            snr = accumulator.snr()
+
+        if visualize or path is not None:
+            with profiler.stage("plot"):
+                plot_snr(snr, visualize=visualize, visualization_path=path)
 
         if save_data:
-            self.add_dataset("{}_snr".format(traces_dataset), snr, "float32")
+            with profiler.stage("save_data"):
+                self.add_dataset("{}_snr".format(traces_dataset), snr, "float32")
 
         return snr
 
-    def calculate_t_test(self, fixed_dataset: str, random_dataset: str, visualize: bool = False, save_data: bool = False, save_graph: bool = False) -> (np.ndarray, np.ndarray):
+    def calculate_t_test(self, fixed_dataset: str, random_dataset: str, visualize: bool = False, save_data: bool = False, save_graph: bool = False, chunk_size: int = 10000, prefetch_depth: int = 2, dtype: any = np.float64, profiler: Profiler = None, checkpoints: int | list[int] = None) -> (np.ndarray, np.ndarray):
         """
-        Integrated t-test metric.
+        Integrated t-test metric. The datasets are read in chunks and accumulated with a `TTestAccumulator`.
         :param fixed_dataset: The name of the dataset containing the fixed trace set
         :type fixed_dataset: str
         :param random_dataset: The name of the dataset containing the random trace set
@@ -530,12 +812,32 @@ class Experiment:
         :type save_data: bool
         :param save_graph: Whether to save the visualization to the experiments visualization folder or not
         :type save_graph: bool
-        :returns: The t-test metric result
-        :rtype: np.ndarray
+        :param chunk_size: The number of traces of each group read per chunk
+        :type chunk_size: int
+        :param prefetch_depth: The number of chunks read ahead on a background thread
+        :type prefetch_depth: int
+        :param dtype: The working precision of each chunk, e.g. np.float32. The statistics are accumulated in float64.
+        :type dtype: any
+        :param profiler: A profiler recording the stages of the calculation. None to not profile it.
+        :type profiler: Profiler
+        :param checkpoints: The trace counts per group at which the maximum absolute t-value is recorded, or a step to
+                            record it at every multiple of it, e.g. to see how many traces it takes for leakage to show.
+                            The end of the data is always recorded. None to record it after every chunk.
+        :type checkpoints: int | list[int]
+        :returns: The t-test metric result and the maximum absolute t-value at each checkpoint
+        :rtype: (np.ndarray, np.ndarray)
         """
-
-        rand = self.dataset[sanitize_input(random_dataset)].read_all()
-        fixed = self.dataset[sanitize_input(fixed_dataset)].read_all()
+        profiler = get_profiler(profiler)
+        with profiler.stage("calculate_t_test"):
+            return self._calculate_t_test(fixed_dataset, random_dataset, visualize, save_data, save_graph, chunk_size,
+                                          prefetch_depth, dtype, profiler, checkpoints)
+
+    def _calculate_t_test(self, fixed_dataset: str, random_dataset: str, visualize: bool, save_data: bool,
+                          save_graph: bool, chunk_size: int, prefetch_depth: int, dtype: any, profiler: Profiler,
+                          checkpoints: int | list[int]) -> (np.ndarray, np.ndarray):
+        with profiler.stage("open"):
+            rand = self.dataset[sanitize_input(random_dataset)].view()
+            fixed = self.dataset[sanitize_input(fixed_dataset)].view()
 
         if save_graph:
             path_created_t = False
@@ -571,18 +873,46 @@ class Experiment:
         else:
             path = None
 
-        t, t_max = t_test_tvla(fixed, rand, visualize=visualize, visualization_paths=path)
+        accumulator = TTestAccumulator(dtype)
+        t_max = []
+        chunks = itertools.zip_longest(fixed.iter_chunks(chunk_size), rand.iter_chunks(chunk_size))
+        position = 0
+        for fixed_chunk, rand_chunk in self._profiled_chunks(chunks, prefetch_depth, profiler):
+            length = max(len(chunk) for chunk in (fixed_chunk, rand_chunk) if chunk is not None)
+            offsets = [length] if checkpoints is None else checkpoint_offsets(position, length, checkpoints)
+            start = 0
+            for stop in offsets + ([length] if offsets[-1:] != [length] else []):
+                with profiler.stage("moments"):
+                    accumulator.update(None if fixed_chunk is None else fixed_chunk[start:stop],
+                                       None if rand_chunk is None else rand_chunk[start:stop])
+                position += stop - start
+                start = stop
+                if stop in offsets:
+                    with profiler.stage("t_value"):
+                        t_max.append(np.max(np.abs(accumulator.t_value())))
+
+        t = accumulator.t_value()
+        if checkpoints is not None and position not in checkpoint_offsets(0, position, checkpoints):
+            t_max.append(np.max(np.abs(t)))
+        t_max = np.array(t_max)
+
+        if visualize or path is not None:
+            with profiler.stage("plot"):
+                plot_t_test(t, t_max, visualize=visualize, visualization_paths=path)
 
         if save_data:
-            self.add_dataset(f"t_test_{random_dataset}_{fixed_dataset}", t, datatype="float32")
-            self.add_dataset(f"t_max_{random_dataset}_{fixed_dataset}", t_max, datatype="float32")
+            with profiler.stage("save_data"):
+                self.add_dataset(f"t_test_{random_dataset}_{fixed_dataset}", t, datatype="float32")
+                self.add_dataset(f"t_max_{random_dataset}_{fixed_dataset}", t_max, datatype="float32")
 
         return t, t_max
 
-    def calculate_correlation(self, predicted_dataset_name: str, observed_dataset_name: str, visualize: bool = False, save_data: bool = False, save_graph: bool = False) -> np.ndarray:
+    def calculate_correlation(self, predicted_dataset_name: str, observed_dataset_name: str, visualize: bool = False, save_data: bool = False, save_graph: bool = False, chunk_size: int = 10000, prefetch_depth: int = 2, dtype: any = np.float64, profiler: Profiler = None) -> np.ndarray:
         """
-        Integrated correlation metric.
-        :param predicted_dataset_name: The name of the dataset containing the predicted leakage
+        Integrated correlation metric. Aligned rows of both datasets are read in chunks and accumulated with a
+        `PearsonAccumulator`, so neither dataset is loaded as a whole.
+        :param predicted_dataset_name: The name of the dataset containing the predicted leakage. A dataset of one value
+                                       per trace is correlated with every sample of the observed leakage.
         :type predicted_dataset_name: str
         :param observed_dataset_name: The name of the dataset containing the observed leakage
         :type observed_dataset_name: str
@@ -592,12 +922,31 @@ class Experiment:
         :type save_data: bool
         :param save_graph: Whether to save the visualization to the experiments visualization folder or not
         :type save_graph: bool
+        :param chunk_size: The number of rows read per chunk
+        :type chunk_size: int
+        :param prefetch_depth: The number of chunks read ahead on a background thread
+        :type prefetch_depth: int
+        :param dtype: The working precision of each chunk, e.g. np.float32. The statistics are accumulated in float64.
+        :type dtype: any
+        :param profiler: A profiler recording the stages of the calculation. None to not profile it.
+        :type profiler: Profiler
         :returns: The correlation metric result
         :rtype: np.ndarray
         """
-
-        predicted = self.get_dataset(predicted_dataset_name).read_all()
-        observed = self.get_dataset(observed_dataset_name).read_all()
+        profiler = get_profiler(profiler)
+        with profiler.stage("calculate_correlation"):
+            return self._calculate_correlation(predicted_dataset_name, observed_dataset_name, visualize, save_data,
+                                               save_graph, chunk_size, prefetch_depth, dtype, profiler)
+
+    def _calculate_correlation(self, predicted_dataset_name: str, observed_dataset_name: str, visualize: bool,
+                               save_data: bool, save_graph: bool, chunk_size: int, prefetch_depth: int, dtype: any,
+                               profiler: Profiler) -> np.ndarray:
+        with profiler.stage("open"):
+            predicted = self.get_dataset(predicted_dataset_name).view()
+            observed = self.get_dataset(observed_dataset_name).view()
+        if len(predicted) != len(observed):
+            raise ValueError(f"{predicted_dataset_name} has {len(predicted)} rows but {observed_dataset_name} has "
+                             f"{len(observed)}")
 
         if save_graph:
             path_created = False
@@ -617,13 +966,103 @@ class Experiment:
         else:
             path = None
 
-        corr = pearson_correlation(predicted, observed, visualize=visualize, visualization_path=path)
+        accumulator = PearsonAccumulator(dtype)
+        chunks = zip(predicted.iter_chunks(chunk_size), observed.iter_chunks(chunk_size))
+        for predicted_chunk, observed_chunk in self._profiled_chunks(chunks, prefetch_depth, profiler):
+            with profiler.stage("correlation"):
+                accumulator.update(predicted_chunk, observed_chunk)
+
+        with profiler.stage("correlation"):
+            corr = accumulator.correlation()
+
+        if visualize or path is not None:
+            with profiler.stage("plot"):
+                plot_correlation(corr, visualize=visualize, visualization_path=path)
 
         if save_data:
-            self.add_dataset(f"corr_{predicted_dataset_name}_{observed_dataset_name}", corr, datatype="float32")
+            with profiler.stage("save_data"):
+                self.add_dataset(f"corr_{predicted_dataset_name}_{observed_dataset_name}", corr, datatype="float32")
 
         return corr
 
+    def align_traces(self, traces_dataset: str, reference: np.ndarray | int = None, max_shift: int = None,
+                     window: tuple[int, int] = None, aligned_dataset: str = None, lazy: bool = False,
+                     chunk_size: int = 1000, prefetch_depth: int = 2, dtype: any = np.float32,
+                     profiler: Profiler = None) -> 'Dataset' | AlignedView:
+        """
+        Resynchronize traces that drift in time, e.g. over a temperature sweep. Every trace is cross-correlated with a
+        window of the reference over a bounded range of shifts and moved by the best shift, see `Alignment.Aligner`.
+        :param traces_dataset: The name of the traces dataset
+        :type traces_dataset: str
+        :param reference: The reference trace, or the row of the dataset to use as the reference. None for the mean of
+                          the first chunk of traces.
+        :type reference: np.ndarray | int
+        :param max_shift: The largest shift searched in either direction. None for a tenth of the trace length.
+        :type max_shift: int
+        :param window: The (start, stop) samples of the reference that are matched. It needs max_shift samples of
+                       margin on both sides. None for the whole trace minus that margin.
+        :type window: tuple[int, int]
+        :param aligned_dataset: The name of the dataset the aligned traces are written to. None for
+                                "<traces_dataset>_aligned". The shifts are saved as "<aligned_dataset>_shifts".
+        :type aligned_dataset: str
+        :param lazy: Whether to return a lazy view that aligns the traces when they are read instead of writing them
+        :type lazy: bool
+        :param chunk_size: The number of traces aligned at once
+        :type chunk_size: int
+        :param prefetch_depth: The number of chunks read ahead on a background thread
+        :type prefetch_depth: int
+        :param dtype: The working precision of the cross-correlation. The aligned traces keep the dataset's datatype.
+        :type dtype: any
+        :param profiler: A profiler recording the stages of the alignment. None to not profile it.
+        :type profiler: Profiler
+        :returns: The dataset of the aligned traces, or the lazy aligned view
+        :rtype: Dataset | AlignedView
+        """
+        profiler = get_profiler(profiler)
+        with profiler.stage("align_traces"):
+            return self._align_traces(traces_dataset, reference, max_shift, window, aligned_dataset, lazy, chunk_size,
+                                      prefetch_depth, dtype, profiler)
+
+    def _align_traces(self, traces_dataset: str, reference: np.ndarray | int, max_shift: int, window: tuple[int, int],
+                      aligned_dataset: str, lazy: bool, chunk_size: int, prefetch_depth: int, dtype: any,
+                      profiler: Profiler) -> 'Dataset' | AlignedView:
+        traces_dataset = sanitize_input(traces_dataset)
+        traces = self.dataset[traces_dataset].view()
+
+        with profiler.stage("reference"):
+            if reference is None:
+                reference = np.mean(traces[0:chunk_size].read(mmap=True), axis=0, dtype=np.float64)
+            elif isinstance(reference, (int, np.integer)):
+                reference = traces[int(reference)]
+            aligner = Aligner(reference, max_shift, window, dtype)
+
+        if lazy:
+            return AlignedView(traces, aligner)
+
+        if aligned_dataset is None:
+            aligned_dataset = f"{traces_dataset}_aligned"
+        with self.fileFormatParent.batch():
+            dataset = self.add_dataset_internal(aligned_dataset, existing=False, dataset=None)
+
+        shifts = []
+        with dataset.appender(traces.dtype) as appender:
+            for chunk in self._profiled_chunks(traces.iter_chunks(chunk_size), prefetch_depth, profiler):
+                with profiler.stage("shifts"):
+                    chunk_shifts = aligner.estimate(chunk)[0]
+                with profiler.stage("apply"):
+                    aligned = apply_shifts(chunk, chunk_shifts)
+                with profiler.stage("write"):
+                    appender.append(aligned)
+                shifts.append(chunk_shifts)
+
+        with profiler.stage("save_data"):
+            dataset.update_metadata("aligned_from", traces_dataset)
+            dataset.update_metadata("alignment_window", list(aligner.window))
+            dataset.update_metadata("alignment_max_shift", aligner.max_shift)
+            self.add_dataset(f"{dataset.name}_shifts", np.concatenate(shifts) if shifts else np.zeros(0), "int32")
+
+        return dataset
+
 
 class Dataset:
     def __init__(self, name: str, path: str, file_format_parent: FileParent, experiment_parent: Experiment, index: int,
@@ -636,6 +1075,9 @@ class Dataset:
             dataset = {}
 
         name = sanitize_input(name)
+        self._memmap = None
+        self._container = None
+        self.storage = dataset.get("storage", "npy")
         if not existing:
             self.name = name
             self.path = path
@@ -655,28 +1097,125 @@ class Dataset:
             self.experimentParent = experiment_parent
             self.metadata = dataset["metadata"]
 
-    def read_data(self, start: int, end: int) -> np.ndarray:
+    def read_data(self, start: int, end: int, mmap: bool = False) -> np.ndarray:
         """
-        Read data from the dataset a specific start and end index.
+        Read data from the dataset a specific start and end index. Only the requested rows are read from disk.
         :param start: the start index of the data
         :type start: int
         :param end: the end index of the data
         :type end: int
+        :param mmap: Whether to return a read-only view backed by the file instead of an in-memory copy. Chunked
+                     datasets are always decompressed into memory.
+        :type mmap: bool
         :returns: An NumPy array containing the requested data over the specified interval
         :rtype: np.ndarray
         """
-        data = np.load(self.fileFormatParent.path + self.experimentParent.path + self.path)
-        return data[start:end]
+        if self.storage == "chunked":
+            # only the chunks overlapping [start, end) are decompressed
+            return self.get_array()[start:end]
 
-    def read_all(self) -> np.ndarray:
+        if mmap:
+            return self.get_memmap()[start:end]
+        return self._copy_rows(slice(start, end))
+
+    def read_all(self, mmap: bool = False) -> np.ndarray:
         """
         Read all data from the dataset
+        :param mmap: Whether to return a read-only view backed by the file instead of an in-memory copy. Chunked
+                     datasets are always decompressed into memory.
+        :type mmap: bool
         :returns: All data contained in the dataset
         :rtype: np.ndarray
         """
+        if self.storage == "chunked":
+            return np.array(self.get_array())
+        if mmap:
+            return self.get_memmap()[:]
+        return self._copy_rows(slice(None))
 
-        data = np.load(self.fileFormatParent.path + self.experimentParent.path + self.path)
-        return data[:]
+    def view(self) -> 'DatasetView':
+        """
+        Get a lazy handle to the dataset. Slicing the handle does not read any data, rows are only paged in from the
+        file when the result is indexed by column or converted to a NumPy array.
+        :returns: A lazy view over all rows of the dataset
+        :rtype: DatasetView
+        """
+        return DatasetView(self)
+
+    def segmented_view(self, samples_per_trace: int = None, groups: list[str] = None) -> 'SegmentedView':
+        """
+        Get the interleaved trace groups of a dataset captured in segmented fashion, e.g. alternating fixed and random
+        traces. The layout is read from the "samples_per_trace" and "segment_groups" metadata of the dataset or, if
+        not set there, of its experiment. The groups are strided views over the memory-mapped dataset, nothing is copied.
+        :param samples_per_trace: The number of samples in each trace. Overrides the metadata.
+        :type samples_per_trace: int
+        :param groups: The names of the interleaved trace groups in capture order. Overrides the metadata. Defaults to
+                       ["fixed", "random"].
+        :type groups: list[str]
+        :returns: The segmented view of the dataset
+        :rtype: SegmentedView
+        """
+        layout = {**self.experimentParent.metadata, **self.metadata}
+        if samples_per_trace is None:
+            samples_per_trace = layout.get("samples_per_trace")
+        if samples_per_trace is None:
+            raise ValueError(f"The number of samples per trace of dataset {self.name} is not set. Set the "
+                             f"\"samples_per_trace\" metadata or pass samples_per_trace.")
+        if groups is None:
+            groups = layout.get("segment_groups", ["fixed", "random"])
+
+        data = self.get_memmap() if self.storage == "npy" else self.read_all()
+        return SegmentedView(data, int(samples_per_trace), groups)
+
+    def get_memmap(self) -> np.ndarray:
+        """
+        Get the read-only memory map of the dataset file. The map is opened once and reused by every subsequent read.
+        :returns: The memory-mapped dataset
+        :rtype: np.ndarray
+        """
+        if self.storage == "chunked":
+            raise ValueError(f"Dataset {self.name} is stored in compressed chunks and cannot be memory-mapped")
+        if self._memmap is None:
+            self._memmap = np.load(self.get_file_path(), mmap_mode='r')
+        return self._memmap
+
+    def _copy_rows(self, rows: slice) -> np.ndarray:
+        # copies use the cached map if there is one, but do not open one that would stay open after the read
+        if self._memmap is not None:
+            return np.array(self._memmap[rows])
+        data = np.load(self.get_file_path(), mmap_mode='r')
+        try:
+            return np.array(data[rows])
+        finally:
+            del data
+
+    def _close_handles(self) -> None:
+        # drop the cached memory map and close the container before the file is removed or replaced
+        self._memmap = None
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+
+    def get_array(self) -> np.ndarray | ChunkedTraceFile:
+        """
+        Get an array-like handle to the dataset that reads rows on demand: the memory map for plain datasets and the
+        chunked trace file, which decompresses the chunks an index touches, for chunked datasets.
+        :returns: The handle to the dataset
+        :rtype: np.ndarray | ChunkedTraceFile
+        """
+        if self.storage == "npy":
+            return self.get_memmap()
+        if self._container is None:
+            self._container = ChunkedTraceFile(self.get_file_path())
+        return self._container
+
+    def get_file_path(self) -> str:
+        """
+        Get the path to the file holding the dataset.
+        :returns: The path of the dataset file
+        :rtype: str
+        """
+        return self.fileFormatParent.path + self.experimentParent.path + self.path
 
     def add_data(self, data_to_add: np.ndarray, datatype: any) -> None:
         """
@@ -688,7 +1227,98 @@ class Dataset:
         :returns: None
         """
         data_to_add = np.array(data_to_add, dtype=datatype)
-        np.save(self.fileFormatParent.path + self.experimentParent.path + self.path, data_to_add)
+        self._set_storage("npy")
+        np.save(self.get_file_path(), data_to_add)
+
+    def add_chunked_data(self, data_to_add: np.ndarray, datatype: any, codec: str = "zlib", chunk_rows: int = 1024,
+                         quantize: any = None, scale: float = None, offset: float = None) -> None:
+        """
+        Replace the data of the dataset with data stored in compressed chunks. Each chunk of rows is compressed on its
+        own, so reading a range of rows only decompresses the chunks holding them. With `quantize` the data is stored
+        as integers, value = stored * scale + offset, which is lossless for data captured by an ADC if the scale and
+        offset of the scope are given. The scale and offset are recorded in the dataset metadata.
+        :param data_to_add: The data to be added to the dataset as a NumPy array
+        :type data_to_add: np.ndarray
+        :param datatype: The datatype the data is read back as
+        :type datatype: any
+        :param codec: The compression codec, one of "zlib", "bz2", "lzma" or "none"
+        :type codec: str
+        :param chunk_rows: The number of rows per compressed chunk
+        :type chunk_rows: int
+        :param quantize: The integer datatype the data is stored as, e.g. "int16". None to store it losslessly.
+        :type quantize: any
+        :param scale: The quantization step. Chosen from the range of the data if not given.
+        :type scale: float
+        :param offset: The value stored as zero. Chosen from the range of the data if not given.
+        :type offset: float
+        :returns: None
+        """
+        data_to_add = np.asarray(data_to_add, dtype=datatype)
+        if quantize is not None and (scale is None or offset is None):
+            default_scale, default_offset = quantization_parameters(data_to_add, quantize)
+            scale = default_scale if scale is None else scale
+            offset = default_offset if offset is None else offset
+
+        self._set_storage("chunked")
+        container = ChunkedTraceFile.create(self.get_file_path(), data_to_add.shape[1:], data_to_add.dtype, codec,
+                                            chunk_rows, quantize, scale, offset)
+        try:
+            container.append(data_to_add)
+        finally:
+            container.close()
+
+        if quantize is not None:
+            with self.fileFormatParent.batch():
+                self.update_metadata("quantization_scale", float(scale))
+                self.update_metadata("quantization_offset", float(offset))
+
+    def _set_storage(self, storage: str) -> None:
+        # switch the dataset between a .npy file and a chunked .trc file, removing the file of the other format
+        self._close_handles()
+        if storage == self.storage:
+            return
+
+        if os.path.exists(self.get_file_path()):
+            os.remove(self.get_file_path())
+        self.storage = storage
+        self.path = f'\\{self.name}.{"npy" if storage == "npy" else "trc"}'
+
+        entry = self.fileFormatParent.json_data["experiments"][self.experimentParent.experimentIndex]["datasets"][
+            self.index]
+        entry["path"] = self.path
+        if storage == "npy":
+            entry.pop("storage", None)
+            # the quantization of the chunks does not apply to the .npy file
+            for key in ("quantization_scale", "quantization_offset"):
+                self.metadata.pop(key, None)
+                self.experimentParent.dataset_index.discard(self.name, key)
+        else:
+            entry["storage"] = storage
+        self.fileFormatParent.update_json()
+
+    def append(self, data_to_add: np.ndarray, datatype: any = None) -> None:
+        """
+        Append rows to the dataset on disk without rewriting the existing data. Creates the dataset file if it does
+        not exist yet. Use `Dataset.appender()` when appending many batches in a row.
+        :param data_to_add: The rows to be appended as a NumPy array
+        :type data_to_add: np.ndarray
+        :param datatype: The datatype of the dataset. Only needed when the dataset file does not exist yet.
+        :type datatype: any
+        :returns: None
+        """
+        with self.appender(datatype) as appender:
+            appender.append(data_to_add)
+
+    def appender(self, datatype: any = None) -> 'DatasetAppender':
+        """
+        Get a writer that appends batches of rows to the dataset in place. Use it as a context manager, the trace count
+        in the dataset metadata is updated once when the writer is closed.
+        :param datatype: The datatype of the dataset. Only needed when the dataset file does not exist yet.
+        :type datatype: any
+        :returns: The writer for the dataset
+        :rtype: DatasetAppender
+        """
+        return DatasetAppender(self, datatype)
 
     def update_metadata(self, key: str, value: any) -> None:
         """
@@ -701,9 +1331,526 @@ class Dataset:
         """
         key = sanitize_input(key)
         self.metadata[key] = value
+        self.experimentParent.dataset_index.add(self.name, key, value)
         self.fileFormatParent.update_json()
 
 
+class MetadataIndex:
+    def __init__(self):
+        """
+        Inverted index from metadata key-value pairs to the names of experiments or datasets. Do not call this
+        constructor. It is maintained by `update_metadata()` and used by the metadata queries.
+        """
+        # key -> value -> names, names are kept in dicts to preserve insertion order
+        self._names_by_value = {}
+        # key -> name -> value
+        self._values_by_name = {}
+        # key -> sorted (value, name) pairs of the numeric values, None when it needs to be rebuilt
+        self._sorted = {}
+        # name -> registration number, the queries return the names in the order the objects were added
+        self._order = {}
+        self._counter = itertools.count()
+
+    def register(self, name: str) -> None:
+        if name not in self._order:
+            self._order[name] = next(self._counter)
+
+    def add(self, name: str, key: str, value: any) -> None:
+        self.register(name)
+        self._discard(name, key)
+        self._values_by_name.setdefault(key, {})[name] = value
+        if _is_hashable(value):
+            self._names_by_value.setdefault(key, {}).setdefault(value, {})[name] = None
+        self._sorted.pop(key, None)
+
+    def add_all(self, name: str, metadata: dict) -> None:
+        for key, value in metadata.items():
+            self.add(name, key, value)
+
+    def remove(self, name: str) -> None:
+        for key in list(self._values_by_name):
+            self._discard(name, key)
+        self._order.pop(name, None)
+
+    def discard(self, name: str, key: str) -> None:
+        self._discard(name, key)
+
+    def query(self, key: str, value: any, regex: bool = False) -> list[str]:
+        values = self._values_by_name.get(key, {})
+        if not regex:
+            if value == "*":
+                return self._in_order(values)
+            if _is_hashable(value):
+                return self._in_order(self._names_by_value.get(key, {}).get(value, {}))
+            return self._in_order(name for name, res in values.items() if res == value)
+
+        # match each distinct value once instead of each object
+        pattern = _compile_pattern(value)
+        names = []
+        for res, res_names in self._names_by_value.get(key, {}).items():
+            if isinstance(res, str) and pattern.match(res):
+                names.extend(res_names)
+        return self._in_order(names)
+
+    def query_range(self, key: str, low: float = None, high: float = None) -> list[str]:
+        if self._sorted.get(key) is None:
+            self._sorted[key] = sorted((value, name) for name, value in self._values_by_name.get(key, {}).items()
+                                       if isinstance(value, (int, float)) and not isinstance(value, bool))
+        entries = self._sorted[key]
+        start = 0 if low is None else bisect.bisect_left(entries, (low,))
+        stop = len(entries) if high is None else bisect.bisect_right(entries, (high, chr(0x10FFFF)))
+        return [name for _, name in entries[start:stop]]
+
+    def _in_order(self, names: Iterable[str]) -> list[str]:
+        return sorted(names, key=self._order.__getitem__)
+
+    def _discard(self, name: str, key: str) -> None:
+        values = self._values_by_name.get(key)
+        if values is None or name not in values:
+            return
+        old_value = values.pop(name)
+        if _is_hashable(old_value):
+            names = self._names_by_value[key][old_value]
+            names.pop(name, None)
+            if not names:
+                del self._names_by_value[key][old_value]
+        self._sorted.pop(key, None)
+
+
+def _is_hashable(value: any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+class LazyRegistry(MutableMapping):
+    def __init__(self, loader: Callable[[str, dict], any]):
+        """
+        Mapping from names to experiments or datasets that creates each object from its JSON entry on first access.
+        Do not call this constructor. It is used for `FileParent.experiments` and `Experiment.dataset`.
+        """
+        self._loader = loader
+        self._items = {}
+
+    def add_pending(self, name: str, entry: dict) -> None:
+        self._items[name] = _PendingEntry(entry)
+
+    def get_loaded(self, name: str) -> any:
+        """
+        Get an object only if it has already been created.
+        :param name: The name of the object
+        :type name: str
+        :returns: The object. None if it does not exist or has not been created yet.
+        :rtype: any
+        """
+        item = self._items.get(name)
+        return None if isinstance(item, _PendingEntry) else item
+
+    def __getitem__(self, name: str) -> any:
+        item = self._items[name]
+        if isinstance(item, _PendingEntry):
+            item = self._loader(name, item.entry)
+            self._items[name] = item
+        return item
+
+    def __setitem__(self, name: str, value: any) -> None:
+        self._items[name] = value
+
+    def __delitem__(self, name: str) -> None:
+        del self._items[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._items))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __repr__(self) -> str:
+        return repr({name: ("<not loaded>" if isinstance(item, _PendingEntry) else item)
+                     for name, item in self._items.items()})
+
+
+class _PendingEntry:
+    def __init__(self, entry: dict):
+        self.entry = entry
+
+
+class DatasetAppender:
+    def __init__(self, dataset: Dataset, datatype: any = None):
+        """
+        Creates a writer appending rows to a Dataset. Do not call this constructor. Please use `Dataset.appender()` to
+        create a new DatasetAppender object.
+        """
+        self.dataset = dataset
+        self.path = dataset.get_file_path()
+        self.dtype = None if datatype is None else np.dtype(datatype)
+        self.shape = None
+        self.data_offset = 0
+        self.version = (1, 0)
+        self.file = None
+        self.container = None
+
+        if dataset.storage == "chunked":
+            self.container = ChunkedTraceFile(self.path, writable=True)
+            if self.dtype is not None and self.dtype != self.container.dtype:
+                self.container.close()
+                raise ValueError(f"Cannot append {self.dtype} data to dataset {dataset.name} of type "
+                                 f"{self.container.dtype}")
+            self.dtype = self.container.dtype
+            self.shape = self.container.shape
+        elif os.path.exists(self.path):
+            self.file = open(self.path, 'r+b')
+            self.version = np.lib.format.read_magic(self.file)
+            if self.version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(self.file)
+
+            if fortran_order or len(shape) == 0:
+                self.file.close()
+                raise ValueError("Only C-ordered datasets with at least one dimension can be appended to")
+            if self.dtype is not None and self.dtype != dtype:
+                self.file.close()
+                raise ValueError(f"Cannot append {self.dtype} data to dataset {dataset.name} of type {dtype}")
+
+            self.dtype = dtype
+            self.shape = shape
+            self.data_offset = self.file.tell()
+
+    def __enter__(self) -> 'DatasetAppender':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def append(self, data_to_add: np.ndarray) -> None:
+        """
+        Append a batch of rows to the end of the dataset. Only the new rows and the array header are written.
+        :param data_to_add: The rows to be appended. A single row may be passed without the leading dimension.
+        :type data_to_add: np.ndarray
+        :returns: None
+        """
+        data_to_add = np.ascontiguousarray(data_to_add, dtype=self.dtype)
+        if self.shape is not None and data_to_add.ndim == len(self.shape) - 1:
+            data_to_add = data_to_add[np.newaxis]
+
+        if self.container is not None:
+            self.container.append(data_to_add)
+            self.shape = self.container.shape
+            return
+
+        if self.file is None:
+            self._create(data_to_add.dtype, data_to_add.shape[1:])
+        elif data_to_add.shape[1:] != self.shape[1:]:
+            raise ValueError(f"Cannot append rows of shape {data_to_add.shape[1:]} to dataset {self.dataset.name} "
+                             f"with rows of shape {self.shape[1:]}")
+
+        row_bytes = self.dtype.itemsize * int(np.prod(self.shape[1:]))
+        self.file.seek(self.data_offset + self.shape[0] * row_bytes)
+        self.file.write(memoryview(data_to_add).cast('B'))
+
+        new_shape = (self.shape[0] + data_to_add.shape[0],) + self.shape[1:]
+        if not _write_npy_header(self.file, self.dtype, new_shape, self.data_offset, self.version):
+            self._grow_header(new_shape)
+        self.shape = new_shape
+
+    def close(self) -> None:
+        """
+        Close the writer and record the number of rows in the dataset metadata.
+        :returns: None
+        """
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+        elif self.file is not None:
+            self.file.close()
+            self.file = None
+        else:
+            return
+        # drop the read handles of the dataset, they do not know about the new rows
+        self.dataset._set_storage(self.dataset.storage)
+        self.dataset.update_metadata("num_traces", self.shape[0])
+
+    def _create(self, dtype: np.dtype, row_shape: tuple) -> None:
+        self.dtype = dtype
+        self.shape = (0,) + row_shape
+        self.data_offset = _npy_data_offset(dtype, self.shape)
+        self.file = open(self.path, 'w+b')
+        _write_npy_header(self.file, self.dtype, self.shape, self.data_offset, self.version)
+
+    def _grow_header(self, shape: tuple) -> None:
+        # the header ran out of padding, copy the data once behind a header with room to grow
+        old_offset = self.data_offset
+        self.version = (1, 0)
+        self.data_offset = _npy_data_offset(self.dtype, shape)
+        self.dataset._close_handles()
+
+        with open(self.path + ".tmp", 'w+b') as new_file:
+            _write_npy_header(new_file, self.dtype, shape, self.data_offset, self.version)
+            self.file.seek(old_offset)
+            shutil.copyfileobj(self.file, new_file)
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+        self.file = open(self.path, 'r+b')
+
+
+def _npy_header(dtype: np.dtype, shape: tuple) -> str:
+    return "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.lib.format.dtype_to_descr(dtype),
+                                                                            tuple(shape))
+
+
+def _npy_data_offset(dtype: np.dtype, shape: tuple) -> int:
+    # reserve enough padding in the header for the row count to grow to 20 digits
+    header_len = len(_npy_header(dtype, (10 ** 20,) + tuple(shape[1:]))) + 1
+    return -(-(10 + header_len) // 64) * 64
+
+
+def _write_npy_header(file: any, dtype: np.dtype, shape: tuple, data_offset: int, version: tuple) -> bool:
+    length_format = '<H' if version == (1, 0) else '<I'
+    prefix = np.lib.format.magic(*version)
+    header_len = data_offset - len(prefix) - struct.calcsize(length_format)
+    header = _npy_header(dtype, shape)
+
+    if len(header) + 1 > header_len:
+        return False
+
+    header = header.ljust(header_len - 1) + '\n'
+    file.seek(0)
+    file.write(prefix + struct.pack(length_format, header_len) + header.encode('utf8' if version >= (3, 0) else 'latin1'))
+    return True
+
+
+class SegmentedView:
+    def __init__(self, data: np.ndarray, samples_per_trace: int, groups: list[str]):
+        """
+        Creates a view over a segmented capture. Do not call this constructor. Please use `Dataset.segmented_view()` to
+        create a new SegmentedView object.
+        """
+        if data.size % samples_per_trace != 0:
+            raise ValueError(f"A dataset of {data.size} values cannot be split into traces of {samples_per_trace} samples")
+
+        self.traces = data.reshape(-1, samples_per_trace)
+        self.groups = [sanitize_input(group) for group in groups]
+
+    def group(self, name: str) -> np.ndarray:
+        """
+        Get all traces of one group as a strided view.
+        :param name: The name of the group
+        :type name: str
+        :returns: The traces of the group
+        :rtype: np.ndarray
+        """
+        return self.traces[self.groups.index(sanitize_input(name))::len(self.groups)]
+
+    @property
+    def fixed(self) -> np.ndarray:
+        return self.group("fixed")
+
+    @property
+    def random(self) -> np.ndarray:
+        return self.group("random")
+
+
+class DatasetView:
+    def __init__(self, dataset: Dataset, rows: range = None):
+        """
+        Creates a lazy view over the rows of a Dataset. Do not call this constructor. Please use `Dataset.view()` to
+        create a new DatasetView object.
+        """
+        self.dataset = dataset
+        if rows is None:
+            rows = range(dataset.get_array().shape[0])
+        self.rows = rows
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.rows),) + self.dataset.get_array().shape[1:]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.dataset.get_array().dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, key: any) -> DatasetView | np.ndarray:
+        """
+        Index the view. Slicing rows only returns a new lazy view, e.g. `view[1000:2000]` or `view[1::2]`. Any other
+        index returns a NumPy array, which is a view backed by the file for integer, slice and column indices.
+        """
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+
+        if isinstance(key, slice):
+            rows = self.rows[key]
+            if not rest:
+                return DatasetView(self.dataset, rows)
+            return self.dataset.get_array()[_range_to_slice(rows)][(slice(None),) + rest]
+
+        if isinstance(key, (int, np.integer)):
+            return self.dataset.get_array()[self.rows[key]][rest]
+
+        # fancy row selection, only the selected rows are read
+        # mapping through the rows bounds checks the key against the view rather than the dataset
+        rows = np.arange(self.rows.start, self.rows.stop, self.rows.step)[np.asarray(key)]
+        return self.dataset.get_array()[rows][(slice(None),) + rest]
+
+    def __array__(self, dtype: any = None, copy: bool = None) -> np.ndarray:
+        return np.asarray(self.read(mmap=True), dtype=dtype)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        Iterate over the rows selected by the view in chunks. Each chunk is a read-only view backed by the file.
+        :param chunk_size: The number of rows per chunk
+        :type chunk_size: int
+        :returns: An iterator over the chunks
+        :rtype: Iterator[np.ndarray]
+        """
+        for start in range(0, len(self.rows), chunk_size):
+            yield self[start:start + chunk_size].read(mmap=True)
+
+    def read(self, mmap: bool = False) -> np.ndarray:
+        """
+        Read the rows selected by the view.
+        :param mmap: Whether to return a read-only view backed by the file instead of an in-memory copy
+        :type mmap: bool
+        :returns: The selected rows
+        :rtype: np.ndarray
+        """
+        data = self.dataset.get_array()[_range_to_slice(self.rows)]
+        if mmap:
+            return data
+        return np.array(data)
+
+
+class ConcatenatedView:
+    def __init__(self, parts: list[any]):
+        """
+        A logical array made of the rows of several arrays, memory maps or dataset views. Indexing only reads the rows
+        requested and nothing is concatenated up front. Use `Experiment.concat_view()` to create one over partitioned
+        datasets.
+        :param parts: The parts in order. All parts need the same row shape.
+        :type parts: list[any]
+        """
+        self.parts = list(parts)
+        lengths = [len(part) for part in self.parts]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+    @property
+    def shape(self) -> tuple:
+        row_shape = tuple(self.parts[0].shape[1:]) if self.parts else ()
+        return (int(self.offsets[-1]),) + row_shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.parts[0].dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key: any) -> np.ndarray:
+        """
+        Index the view with global row indices. Only the requested rows are read. A range of rows inside of a single
+        part is returned without copying.
+        """
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+
+        if isinstance(key, (int, np.integer)):
+            row = range(len(self))[key]
+            part = bisect.bisect_right(self.offsets, row) - 1
+            return np.asarray(self.parts[part][row - self.offsets[part]])[rest]
+
+        if isinstance(key, slice):
+            rows = range(len(self))[key]
+            if rows.step < 0:
+                return self[rows[::-1]][::-1][(slice(None),) + rest]
+            pieces = []
+            for part_index, part in enumerate(self.parts):
+                start, stop = self.offsets[part_index], self.offsets[part_index + 1]
+                local = rows[bisect.bisect_left(rows, start):bisect.bisect_left(rows, stop)]
+                if len(local) > 0:
+                    local_slice = slice(local.start - start, local.stop - start, local.step)
+                    pieces.append(np.asarray(part[local_slice])[(slice(None),) + rest])
+        else:
+            key = np.asarray(key)
+            if key.dtype == bool:
+                key = np.flatnonzero(key)
+            key = np.where(key < 0, key + len(self), key)
+            part_of_row = np.searchsorted(self.offsets, key, side="right") - 1
+            pieces = []
+            for part_index in np.unique(part_of_row):
+                local = key[part_of_row == part_index] - self.offsets[part_index]
+                pieces.append(np.asarray(self.parts[part_index][local])[(slice(None),) + rest])
+            if len(np.unique(part_of_row)) > 1:
+                # restore the requested row order
+                order = np.argsort(np.argsort(part_of_row, kind="stable"), kind="stable")
+                return np.concatenate(pieces)[order]
+
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+        return np.concatenate(pieces)
+
+    def __array__(self, dtype: any = None, copy: bool = None) -> np.ndarray:
+        return np.asarray(self.read(), dtype=dtype)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        Iterate over all rows in chunks. Chunks do not span two parts, so every chunk is a view of its part.
+        :param chunk_size: The maximum number of rows per chunk
+        :type chunk_size: int
+        :returns: An iterator over the chunks
+        :rtype: Iterator[np.ndarray]
+        """
+        for part in self.parts:
+            for start in range(0, len(part), chunk_size):
+                yield np.asarray(part[start:start + chunk_size])
+
+    def read(self) -> np.ndarray:
+        """
+        Read all rows into a single in-memory array, allocated once.
+        :returns: All rows of the view
+        :rtype: np.ndarray
+        """
+        out = np.empty(self.shape, dtype=self.dtype)
+        for part_index, part in enumerate(self.parts):
+            out[self.offsets[part_index]:self.offsets[part_index + 1]] = np.asarray(part)
+        return out
+
+
+def _natural_key(name: str) -> list:
+    return [int(token) if token.isdigit() else token for token in re.split(r'(\d+)', name)]
+
+
+def _range_to_slice(rows: range) -> slice:
+    stop = rows.stop
+    if rows.step < 0 and stop < 0:
+        stop = None
+    return slice(rows.start, stop, rows.step)
+
+
 def sanitize_input(input_string: str) -> str:
     if type(input_string) is not str:
         raise ValueError("The input to this function must be of type string")
@@ -0,0 +1,74 @@
+#Vectorized leakage models working on whole (traces x bytes) intermediate value arrays at once
+import numpy as np
+
+# byte positions of the two output shares used by DPA.intermediate_value, most significant byte first
+SHARE_OUT0 = (14, 15)
+SHARE_OUT1 = (12, 13)
+
+HW_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def as_bytes(iv):
+    iv = np.asarray(iv)
+    if iv.dtype != np.uint8:
+        iv = iv.astype(np.uint8)
+    return iv
+
+
+def popcount(values):
+    values = np.asarray(values)
+    if values.dtype == np.uint8:
+        return HW_TABLE[values]
+
+    # look up every byte of the (unsigned) words and add the counts up
+    values = np.ascontiguousarray(values.astype(np.dtype("u%d" % values.dtype.itemsize)))
+    byte_view = values.view(np.uint8).reshape(values.shape + (values.dtype.itemsize,))
+    return HW_TABLE[byte_view].sum(axis=-1, dtype=np.uint8)
+
+
+def word(iv, positions):
+    # combine the bytes at the given positions into one word, the first position is the most significant byte
+    iv = as_bytes(iv)
+    positions = np.atleast_1d(positions)
+    if len(positions) == 1:
+        return iv[..., positions[0]]
+
+    out = np.zeros(iv.shape[:-1], dtype=np.uint64)
+    for position in positions:
+        out <<= np.uint64(8)
+        out |= iv[..., position]
+    return out
+
+
+def identity(iv, positions=SHARE_OUT0):
+    return word(iv, positions)
+
+
+def hamming_weight(iv, positions=SHARE_OUT0):
+    return popcount(word(iv, positions))
+
+
+def hamming_distance(iv, positions_a=SHARE_OUT0, positions_b=SHARE_OUT1):
+    if len(np.atleast_1d(positions_a)) != len(np.atleast_1d(positions_b)):
+        raise ValueError("Both words of a Hamming distance need the same number of bytes")
+    # HD of the words is the sum of the byte-wise HDs, so the lookup can stay on uint8
+    iv = as_bytes(iv)
+    return HW_TABLE[iv[..., list(np.atleast_1d(positions_a))] ^ iv[..., list(np.atleast_1d(positions_b))]].sum(
+        axis=-1, dtype=np.uint8)
+
+
+def bit(iv, index, positions=SHARE_OUT0):
+    # single bit of the word, bit 0 is the least significant bit
+    return ((word(iv, positions) >> np.uint64(index)) & np.uint64(1)).astype(np.uint8)
+
+
+def bits(iv, positions=SHARE_OUT0):
+    # every bit of the word as a (traces x bits) hypothesis matrix, least significant bit first
+    iv = as_bytes(iv)
+    positions = list(np.atleast_1d(positions))[::-1]
+    return np.unpackbits(iv[..., positions], axis=-1, bitorder="little")
+
+
+def intermediate_values(iv):
+    # vectorized DPA.intermediate_value: HD between out0 = (out[14], out[15]) and out1 = (out[12], out[13])
+    return hamming_distance(iv, SHARE_OUT0, SHARE_OUT1)
@@ -0,0 +1,589 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from math import comb
+
+import numpy as np
+
+"""
+File: Metrics.py
+Description: Streaming side-channel metrics. Statistics are accumulated batch by batch so that datasets larger than
+memory can be evaluated partition by partition.
+"""
+
+
+class TTestAccumulator:
+    def __init__(self, dtype: any = np.float64):
+        """
+        Welch's t-test between a fixed and a random trace group, accumulated over batches of traces. The mean and the
+        sum of squared deviations of each group are merged batch by batch using the pairwise update of Chan et al.
+        :param dtype: The working precision of each batch, e.g. np.float32 to halve the batch buffer. The per-sample
+                      sums and the merged statistics are always kept in float64.
+        :type dtype: any
+        :returns: None
+        """
+        self.dtype = np.dtype(dtype)
+        self.n_fixed = 0
+        self.mean_fixed = None
+        self.m2_fixed = None
+
+        self.n_random = 0
+        self.mean_random = None
+        self.m2_random = None
+
+    def update(self, fixed_batch: np.ndarray | None, random_batch: np.ndarray | None) -> None:
+        """
+        Add a batch of fixed and random traces. The two batches do not need to have the same number of traces.
+        :param fixed_batch: The fixed traces as a (traces x samples) array. A single trace may be passed as a 1D array.
+                            None if there are no fixed traces in this batch.
+        :type fixed_batch: np.ndarray | None
+        :param random_batch: The random traces as a (traces x samples) array. A single trace may be passed as a 1D
+                             array. None if there are no random traces in this batch.
+        :type random_batch: np.ndarray | None
+        :returns: None
+        """
+        if fixed_batch is not None and len(fixed_batch) > 0:
+            self.n_fixed, self.mean_fixed, self.m2_fixed = _merge_moments(self.n_fixed, self.mean_fixed,
+                                                                          self.m2_fixed, fixed_batch, self.dtype)
+        if random_batch is not None and len(random_batch) > 0:
+            self.n_random, self.mean_random, self.m2_random = _merge_moments(self.n_random, self.mean_random,
+                                                                             self.m2_random, random_batch, self.dtype)
+
+    def t_value(self) -> np.ndarray:
+        """
+        Compute Welch's t-statistic from the traces accumulated so far.
+        :returns: The t-statistic for every sample. All zeros until both groups hold at least two traces.
+        :rtype: np.ndarray
+        """
+        if self.n_fixed < 2 or self.n_random < 2:
+            shape = self.mean_fixed.shape if self.mean_fixed is not None else np.shape(self.mean_random)
+            return np.zeros(shape)
+
+        var_fixed = self.m2_fixed / (self.n_fixed - 1)
+        var_random = self.m2_random / (self.n_random - 1)
+        return (self.mean_fixed - self.mean_random) / np.sqrt(var_fixed / self.n_fixed + var_random / self.n_random)
+
+
+class HigherOrderTTestAccumulator:
+    def __init__(self, order: int = 3):
+        """
+        Univariate Welch's t-test of order 1 up to `order` between a fixed and a random trace group, computed from a
+        single pass over the traces. Central moment sums up to 2 * order are kept for both groups and merged batch by
+        batch with the pairwise formulas of Pébay. The higher-order statistics follow Schneider and Moradi, "Leakage
+        Assessment Methodology", CHES 2015.
+        :param order: The highest t-test order
+        :type order: int
+        :returns: None
+        """
+        if order < 1:
+            raise ValueError("The t-test order must be at least 1")
+        self.order = order
+        self.fixed = _CentralMoments(2 * order)
+        self.random = _CentralMoments(2 * order)
+
+    def update(self, fixed_batch: np.ndarray | None, random_batch: np.ndarray | None) -> None:
+        """
+        Add a batch of fixed and random traces. The two batches do not need to have the same number of traces.
+        :param fixed_batch: The fixed traces as a (traces x samples) array. None if there are no fixed traces in this
+                            batch.
+        :type fixed_batch: np.ndarray | None
+        :param random_batch: The random traces as a (traces x samples) array. None if there are no random traces in
+                             this batch.
+        :type random_batch: np.ndarray | None
+        :returns: None
+        """
+        if fixed_batch is not None and len(fixed_batch) > 0:
+            self.fixed.update(fixed_batch)
+        if random_batch is not None and len(random_batch) > 0:
+            self.random.update(random_batch)
+
+    def t_value(self, order: int = 1) -> np.ndarray:
+        """
+        Compute the t-statistic of the given order from the traces accumulated so far. The first order statistic is
+        the same as `TTestAccumulator.t_value()`.
+        :param order: The order of the t-test, between 1 and the order of the accumulator
+        :type order: int
+        :returns: The t-statistic for every sample. All zeros until both groups hold at least two traces.
+        :rtype: np.ndarray
+        """
+        if not 1 <= order <= self.order:
+            raise ValueError(f"The order must be between 1 and {self.order}")
+        if self.fixed.n < 2 or self.random.n < 2:
+            shape = self.fixed.mean.shape if self.fixed.mean is not None else np.shape(self.random.mean)
+            return np.zeros(shape)
+
+        mean_fixed, var_fixed = self.fixed.order_statistics(order)
+        mean_random, var_random = self.random.order_statistics(order)
+        return (mean_fixed - mean_random) / np.sqrt(var_fixed / self.fixed.n + var_random / self.random.n)
+
+    def t_values(self) -> np.ndarray:
+        """
+        Compute the t-statistics of every order from the traces accumulated so far.
+        :returns: An (order x samples) array holding the t-statistic of order k + 1 in row k
+        :rtype: np.ndarray
+        """
+        return np.array([self.t_value(order) for order in range(1, self.order + 1)])
+
+
+class _CentralMoments:
+    def __init__(self, max_power: int):
+        self.max_power = max_power
+        self.n = 0
+        self.mean = None
+        # m[p] is the sum of (x - mean) ** p, m[0] and m[1] are unused
+        self.m = [None] * (max_power + 1)
+
+    def update(self, batch: np.ndarray) -> None:
+        batch = np.asarray(batch, dtype=np.float64)
+        if batch.ndim == 1:
+            batch = batch[np.newaxis]
+
+        n_b = batch.shape[0]
+        mean_b = batch.mean(axis=0)
+        deviation = batch - mean_b
+        power = deviation.copy()
+        m_b = [None, None]
+        for _ in range(2, self.max_power + 1):
+            power *= deviation
+            m_b.append(power.sum(axis=0))
+
+        if self.n == 0:
+            self.n, self.mean, self.m = n_b, mean_b, m_b
+            return
+
+        n_a, m_a = self.n, self.m
+        n = n_a + n_b
+        delta = mean_b - self.mean
+
+        m = [None, None]
+        for p in range(2, self.max_power + 1):
+            merged = m_a[p] + m_b[p]
+            for k in range(1, p - 1):
+                merged += comb(p, k) * delta ** k * ((-n_b / n) ** k * m_a[p - k] + (n_a / n) ** k * m_b[p - k])
+            merged += (n_a * n_b / n * delta) ** p * (1 / n_b ** (p - 1) - (-1 / n_a) ** (p - 1))
+            m.append(merged)
+
+        self.n = n
+        self.mean = self.mean + delta * (n_b / n)
+        self.m = m
+
+    def order_statistics(self, order: int) -> (np.ndarray, np.ndarray):
+        # mean and variance of the order-d preprocessed traces, without preprocessing them
+        if order == 1:
+            return self.mean, self.m[2] / (self.n - 1)
+
+        cm = [None, None] + [m / self.n for m in self.m[2:]]
+        if order == 2:
+            return cm[2], cm[4] - cm[2] ** 2
+        return cm[order] / cm[2] ** (order / 2), (cm[2 * order] - cm[order] ** 2) / cm[2] ** order
+
+
+class SNRAccumulator:
+    def __init__(self, num_classes: int = 0, dtype: any = np.float64):
+        """
+        Per-sample signal-to-noise ratio var(class means) / mean(class variances), accumulated over batches of labeled
+        traces. Only the count, mean and sum of squared deviations of each class are kept, so the memory does not
+        grow with the number of traces. Each batch is grouped by label and merged per class with the update of Chan
+        et al.
+        :param num_classes: The number of classes to allocate up front, e.g. 256 for byte labels. More are added when
+                            larger labels are seen.
+        :type num_classes: int
+        :param dtype: The working precision of each batch. The per-class statistics are always kept in float64.
+        :type dtype: any
+        :returns: None
+        """
+        self.dtype = np.dtype(dtype)
+        self.num_classes = num_classes
+        self.counts = np.zeros(num_classes, dtype=np.int64)
+        self.means = None
+        self.m2 = None
+
+    def update(self, batch: np.ndarray, labels: np.ndarray) -> None:
+        """
+        Add a batch of traces with their labels.
+        :param batch: The traces as a (traces x samples) array. A single trace may be passed as a 1D array.
+        :type batch: np.ndarray
+        :param labels: One non-negative integer label per trace, e.g. the intermediate value of each trace
+        :type labels: np.ndarray
+        :returns: None
+        """
+        labels = np.asarray(labels).reshape(-1)
+        if len(labels) == 0:
+            return
+        if not np.issubdtype(labels.dtype, np.integer):
+            raise ValueError("SNR labels must be integers")
+        if labels.min() < 0:
+            raise ValueError("SNR labels must not be negative")
+        batch = np.asarray(batch)
+        if batch.ndim == 1:
+            batch = batch[np.newaxis]
+        if batch.shape[0] != len(labels):
+            raise ValueError(f"{batch.shape[0]} traces but {len(labels)} labels")
+
+        self._grow(int(labels.max()) + 1, batch.shape[1:])
+
+        # the traces are grouped by label, so every class of the batch is one contiguous block
+        order = np.argsort(labels, kind="stable")
+        labels = labels[order]
+        deviation = np.take(batch, order, axis=0).astype(self.dtype, copy=False)
+        classes, starts, n_batch = np.unique(labels, return_index=True, return_counts=True)
+
+        mean_batch = np.add.reduceat(deviation, starts, axis=0, dtype=np.float64) / n_batch[:, np.newaxis]
+        deviation -= np.repeat(mean_batch.astype(self.dtype), n_batch, axis=0)
+        residual = np.add.reduceat(deviation, starts, axis=0, dtype=np.float64)
+        deviation *= deviation
+        m2_batch = (np.add.reduceat(deviation, starts, axis=0, dtype=np.float64)
+                    - residual ** 2 / n_batch[:, np.newaxis])
+
+        n = self.counts[classes][:, np.newaxis]
+        n_total = n + n_batch[:, np.newaxis]
+        delta = mean_batch - self.means[classes]
+        self.means[classes] += delta * (n_batch[:, np.newaxis] / n_total)
+        self.m2[classes] += m2_batch + delta ** 2 * (n * n_batch[:, np.newaxis] / n_total)
+        self.counts[classes] += n_batch
+
+    def class_statistics(self) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        Get the statistics of the classes seen so far.
+        :returns: The labels of the classes, and per class its mean and its (population) variance of every sample
+        :rtype: (np.ndarray, np.ndarray, np.ndarray)
+        """
+        seen = np.flatnonzero(self.counts)
+        return seen, self.means[seen], self.m2[seen] / self.counts[seen][:, np.newaxis]
+
+    def snr(self) -> np.ndarray:
+        """
+        Compute the signal-to-noise ratio from the traces accumulated so far.
+        :returns: The SNR of every sample
+        :rtype: np.ndarray
+        """
+        if self.means is None:
+            raise ValueError("No traces have been accumulated")
+        _, means, variances = self.class_statistics()
+        return np.var(means, axis=0) / np.mean(variances, axis=0)
+
+    def _grow(self, num_classes: int, sample_shape: tuple) -> None:
+        if self.means is None:
+            self.num_classes = max(self.num_classes, num_classes)
+            self.counts = np.zeros(self.num_classes, dtype=np.int64)
+            self.means = np.zeros((self.num_classes,) + sample_shape)
+            self.m2 = np.zeros((self.num_classes,) + sample_shape)
+        elif num_classes > self.num_classes:
+            extra = num_classes - self.num_classes
+            self.counts = np.concatenate((self.counts, np.zeros(extra, dtype=np.int64)))
+            self.means = np.concatenate((self.means, np.zeros((extra,) + self.means.shape[1:])))
+            self.m2 = np.concatenate((self.m2, np.zeros((extra,) + self.m2.shape[1:])))
+            self.num_classes = num_classes
+
+
+class PearsonAccumulator:
+    def __init__(self, dtype: any = np.float64):
+        """
+        Pearson correlation between predicted and observed leakage, accumulated over aligned batches of rows. The means,
+        the sums of squared deviations and the co-moment are merged batch by batch with the update of Chan et al., so
+        the memory does not grow with the number of traces.
+        :param dtype: The working precision of each batch. The merged statistics are always kept in float64.
+        :type dtype: any
+        :returns: None
+        """
+        self.dtype = np.dtype(dtype)
+        self.n = 0
+        self.mean_predicted = None
+        self.mean_observed = None
+        self.m2_predicted = None
+        self.m2_observed = None
+        self.co_moment = None
+
+    def update(self, predicted_batch: np.ndarray, observed_batch: np.ndarray) -> None:
+        """
+        Add aligned batches of predicted and observed leakage.
+        :param predicted_batch: The predicted leakage as a (traces x samples) array, or a (traces x 1) array or a 1D
+                                array of one value per trace that is correlated with every sample
+        :type predicted_batch: np.ndarray
+        :param observed_batch: The observed leakage as a (traces x samples) array or a 1D array of one value per trace
+        :type observed_batch: np.ndarray
+        :returns: None
+        """
+        predicted = _columns(predicted_batch, self.dtype)
+        observed = _columns(observed_batch, self.dtype)
+        if predicted.shape[0] != observed.shape[0]:
+            raise ValueError(f"{predicted.shape[0]} predicted rows but {observed.shape[0]} observed rows")
+        if predicted.shape[0] == 0:
+            return
+        np.broadcast_shapes(predicted.shape, observed.shape)
+
+        n_batch = predicted.shape[0]
+        mean_p = predicted.mean(axis=0, dtype=np.float64)
+        mean_o = observed.mean(axis=0, dtype=np.float64)
+        predicted -= mean_p.astype(self.dtype)
+        observed -= mean_o.astype(self.dtype)
+        residual_p = predicted.sum(axis=0, dtype=np.float64)
+        residual_o = observed.sum(axis=0, dtype=np.float64)
+        co_moment = (np.multiply(predicted, observed).sum(axis=0, dtype=np.float64)
+                     - residual_p * residual_o / n_batch)
+        predicted *= predicted
+        observed *= observed
+        m2_p = predicted.sum(axis=0, dtype=np.float64) - residual_p ** 2 / n_batch
+        m2_o = observed.sum(axis=0, dtype=np.float64) - residual_o ** 2 / n_batch
+
+        if self.n == 0:
+            self.n = n_batch
+            self.mean_predicted, self.mean_observed = mean_p, mean_o
+            self.m2_predicted, self.m2_observed, self.co_moment = m2_p, m2_o, co_moment
+            return
+
+        n_total = self.n + n_batch
+        delta_p = mean_p - self.mean_predicted
+        delta_o = mean_o - self.mean_observed
+        weight = self.n * n_batch / n_total
+        self.co_moment = self.co_moment + co_moment + delta_p * delta_o * weight
+        self.m2_predicted = self.m2_predicted + m2_p + delta_p ** 2 * weight
+        self.m2_observed = self.m2_observed + m2_o + delta_o ** 2 * weight
+        self.mean_predicted = self.mean_predicted + delta_p * (n_batch / n_total)
+        self.mean_observed = self.mean_observed + delta_o * (n_batch / n_total)
+        self.n = n_total
+
+    def correlation(self) -> np.ndarray:
+        """
+        Compute the correlation from the rows accumulated so far.
+        :returns: The correlation of every sample
+        :rtype: np.ndarray
+        """
+        if self.n == 0:
+            raise ValueError("No rows have been accumulated")
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.co_moment / np.sqrt(self.m2_predicted * self.m2_observed)
+
+
+def pearson_correlation(predicted_leakage: np.ndarray, observed_leakage: np.ndarray, visualize: bool = False,
+                        visualization_path: str = None) -> np.ndarray:
+    """
+    Pearson correlation between predicted and observed leakage held in memory. This is a `PearsonAccumulator` over a
+    single batch, so it gives the same result as accumulating the rows in one chunk.
+    :param predicted_leakage: The predicted leakage as a (traces x samples) array, or one value per trace
+    :type predicted_leakage: np.ndarray
+    :param observed_leakage: The observed leakage as a (traces x samples) array, or one value per trace
+    :type observed_leakage: np.ndarray
+    :param visualize: Whether to show the plot or not
+    :type visualize: bool
+    :param visualization_path: The path the plot is saved to. None if it is not saved.
+    :type visualization_path: str
+    :returns: The correlation of every sample
+    :rtype: np.ndarray
+    """
+    accumulator = PearsonAccumulator()
+    accumulator.update(predicted_leakage, observed_leakage)
+    corr = accumulator.correlation()
+    if visualize or visualization_path is not None:
+        plot_correlation(corr, visualize=visualize, visualization_path=visualization_path)
+    return corr
+
+
+def checkpoint_offsets(position: int, length: int, checkpoints: int | list[int]) -> list[int]:
+    """
+    Find the checkpoints reached within a batch of traces.
+    :param position: The number of traces before the batch
+    :type position: int
+    :param length: The number of traces in the batch
+    :type length: int
+    :param checkpoints: The trace counts to stop at, or a step to stop at every multiple of it
+    :type checkpoints: int | list[int]
+    :returns: The offsets within the batch after which a checkpoint is reached, in increasing order
+    :rtype: list[int]
+    """
+    if isinstance(checkpoints, (int, np.integer)):
+        if checkpoints < 1:
+            raise ValueError(f"The checkpoint step must be at least 1, got {checkpoints}")
+        first = (position // checkpoints + 1) * checkpoints
+        return list(range(first - position, length + 1, checkpoints))
+    return sorted({int(c) - position for c in checkpoints if position < c <= position + length})
+
+
+def first_crossing(counts: np.ndarray, values: np.ndarray, threshold: float | np.ndarray) -> np.ndarray:
+    """
+    Find the first trace count at which a statistic reaches a threshold.
+    :param counts: The trace count of every checkpoint
+    :type counts: np.ndarray
+    :param values: The statistic at every checkpoint, one row per checkpoint and optionally one column per curve
+    :type values: np.ndarray
+    :param threshold: The threshold, either one value or one value per checkpoint
+    :type threshold: float | np.ndarray
+    :returns: The first trace count of every curve at which it reached the threshold, -1 if it never did
+    :rtype: np.ndarray
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    if threshold.ndim == 1:
+        threshold = threshold.reshape((-1,) + (1,) * (values.ndim - 1))
+    crossed = values >= threshold
+    return np.where(crossed.any(axis=0), np.asarray(counts)[np.argmax(crossed, axis=0)], -1)
+
+
+def t_test_convergence(batches: Iterable, checkpoints: int | list[int], threshold: float = 4.5, order: int = 1,
+                       dtype: any = np.float64) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Compute max |t| against the number of traces in a single pass, instead of rerunning the t-test on growing
+    prefixes. Batches are split at the checkpoints so that every checkpoint is evaluated at its exact trace count.
+    :param batches: The (fixed, random) batches, e.g. zip_longest over the chunks of both groups. Either may be None.
+    :type batches: Iterable
+    :param checkpoints: The trace counts per group to evaluate, or a step to evaluate every multiple of it. The count
+                        is the position in the batch stream, i.e. the number of traces taken from each group so far.
+                        The end of the data is always evaluated as well.
+    :type checkpoints: int | list[int]
+    :param threshold: The |t| threshold of the first crossing
+    :type threshold: float
+    :param order: The highest t-test order. Orders above 1 use a `HigherOrderTTestAccumulator`.
+    :type order: int
+    :param dtype: The working precision of the first order accumulator
+    :type dtype: any
+    :returns: The trace counts of the checkpoints, max |t| at every checkpoint and the first trace count at which
+              max |t| reached the threshold (-1 if it never did). With order > 1, max |t| has one column per order and
+              there is one first crossing per order.
+    :rtype: (np.ndarray, np.ndarray, np.ndarray)
+    """
+    accumulator = TTestAccumulator(dtype) if order == 1 else HigherOrderTTestAccumulator(order)
+    counts = []
+    max_t = []
+    position = 0
+
+    def evaluate() -> None:
+        t = accumulator.t_value() if order == 1 else accumulator.t_values()
+        counts.append(position)
+        max_t.append(np.max(np.abs(t), axis=-1))
+
+    for fixed_batch, random_batch in batches:
+        length = max(len(fixed_batch) if fixed_batch is not None else 0,
+                     len(random_batch) if random_batch is not None else 0)
+        start = 0
+        for stop in checkpoint_offsets(position, length, checkpoints):
+            accumulator.update(None if fixed_batch is None else fixed_batch[start:stop],
+                               None if random_batch is None else random_batch[start:stop])
+            position += stop - start
+            start = stop
+            evaluate()
+        if start < length:
+            accumulator.update(None if fixed_batch is None else fixed_batch[start:],
+                               None if random_batch is None else random_batch[start:])
+            position += length - start
+
+    if not counts or counts[-1] != position:
+        evaluate()
+
+    counts = np.array(counts)
+    max_t = np.array(max_t)
+    return counts, max_t, first_crossing(counts, max_t, threshold)
+
+
+def _columns(batch: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    # a working copy of the batch with one row per trace
+    batch = np.array(batch, dtype=dtype)
+    return batch[:, np.newaxis] if batch.ndim == 1 else batch.reshape(batch.shape[0], -1)
+
+
+def _merge_moments(n: int, mean: np.ndarray | None, m2: np.ndarray | None, batch: np.ndarray,
+                   dtype: np.dtype = np.float64) -> (int, np.ndarray, np.ndarray):
+    # a single working copy of the batch is centered and squared in place, the column sums are float64
+    deviation = np.array(batch, dtype=dtype)
+    if deviation.ndim == 1:
+        deviation = deviation[np.newaxis]
+
+    n_batch = deviation.shape[0]
+    mean_batch = deviation.mean(axis=0, dtype=np.float64)
+    deviation -= mean_batch.astype(dtype)
+    # the batch is centered by its mean rounded to the working dtype, so the deviations do not sum to exactly zero.
+    # With that residual sum r, sum((x - mean) ** 2) = sum(d ** 2) - r ** 2 / n for the deviations d, and likewise
+    # sum((x - mean_x) * (y - mean_y)) = sum(d_x * d_y) - r_x * r_y / n. SNRAccumulator and PearsonAccumulator apply
+    # the same correction.
+    residual = deviation.sum(axis=0, dtype=np.float64)
+    deviation *= deviation
+    m2_batch = deviation.sum(axis=0, dtype=np.float64) - residual ** 2 / n_batch
+
+    if n == 0:
+        return n_batch, mean_batch, m2_batch
+
+    n_total = n + n_batch
+    delta = mean_batch - mean
+    mean = mean + delta * (n_batch / n_total)
+    m2 = m2 + m2_batch + delta ** 2 * (n * n_batch / n_total)
+    return n_total, mean, m2
+
+
+def plot_t_test(t: np.ndarray, t_max: np.ndarray, visualize: bool = False,
+                visualization_paths: tuple[str, str] = None) -> None:
+    """
+    Plot the t-statistic per sample and the maximum absolute t-statistic against the number of traces.
+    :param t: The t-statistic per sample
+    :type t: np.ndarray
+    :param t_max: The maximum absolute t-statistic at each checkpoint
+    :type t_max: np.ndarray
+    :param visualize: Whether to show the plots or not
+    :type visualize: bool
+    :param visualization_paths: The paths the t-test and the t-max plots are saved to. None if they are not saved.
+    :type visualization_paths: tuple[str, str]
+    :returns: None
+    """
+    import matplotlib.pyplot as plt
+
+    for idx, (data, x_label, y_label) in enumerate(((t, "Sample", "t-value"), (t_max, "Checkpoint", "max |t|"))):
+        plt.figure()
+        plt.plot(data)
+        plt.axhline(4.5, color="r", linestyle="--")
+        if idx == 0:
+            plt.axhline(-4.5, color="r", linestyle="--")
+        plt.xlabel(x_label)
+        plt.ylabel(y_label)
+
+        if visualization_paths is not None:
+            plt.savefig(visualization_paths[idx])
+        if visualize:
+            plt.show()
+        plt.close()
+
+
+def plot_snr(snr: np.ndarray, visualize: bool = False, visualization_path: str = None) -> None:
+    """
+    Plot the signal-to-noise ratio per sample.
+    :param snr: The SNR per sample
+    :type snr: np.ndarray
+    :param visualize: Whether to show the plot or not
+    :type visualize: bool
+    :param visualization_path: The path the plot is saved to. None if it is not saved.
+    :type visualization_path: str
+    :returns: None
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    plt.plot(snr)
+    plt.xlabel("Sample")
+    plt.ylabel("SNR")
+
+    if visualization_path is not None:
+        plt.savefig(visualization_path)
+    if visualize:
+        plt.show()
+    plt.close()
+
+
+def plot_correlation(corr: np.ndarray, visualize: bool = False, visualization_path: str = None) -> None:
+    """
+    Plot the correlation per sample.
+    :param corr: The correlation per sample
+    :type corr: np.ndarray
+    :param visualize: Whether to show the plot or not
+    :type visualize: bool
+    :param visualization_path: The path the plot is saved to. None if it is not saved.
+    :type visualization_path: str
+    :returns: None
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    plt.plot(corr)
+    plt.xlabel("Sample")
+    plt.ylabel("Correlation")
+
+    if visualization_path is not None:
+        plt.savefig(visualization_path)
+    if visualize:
+        plt.show()
+    plt.close()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import mmap
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+
+"""
+File: Pipeline.py
+Description: Background prefetching for partition-by-partition and chunk-by-chunk analysis.
+"""
+
+
+def prefetch(items: Iterable, depth: int = 2, max_bytes: int = None, materialize: bool = True) -> Iterator:
+    """
+    Iterate over `items` while the following items are produced on a background thread. Pass a generator that loads
+    the data, e.g. `prefetch(dataset.read_all() for dataset in datasets)`, so the disk is read while the current item
+    is processed.
+    :param items: The items to iterate over. They are produced on the background thread.
+    :type items: Iterable
+    :param depth: The maximum number of items loaded ahead of the one being processed
+    :type depth: int
+    :param max_bytes: The maximum number of bytes held by loaded items, including the one being processed. The next
+                      item is only loaded while less is held, so at most one item goes beyond the cap. None for no cap.
+    :type max_bytes: int
+    :param materialize: Whether to read arrays backed by a memory map into memory on the background thread. Without it
+                        a memory-mapped chunk would only be read when it is first used.
+    :type materialize: bool
+    :returns: An iterator over the items
+    :rtype: Iterator
+    """
+    loaded = queue.Queue(maxsize=max(1, depth))
+    condition = threading.Condition()
+    state = {"held_bytes": 0, "stop": False}
+    done = object()
+
+    def producer() -> None:
+        try:
+            for item in items:
+                with condition:
+                    while max_bytes is not None and state["held_bytes"] >= max_bytes and not state["stop"]:
+                        condition.wait()
+                    if state["stop"]:
+                        return
+                if materialize:
+                    item = _materialize(item)
+                size = item_nbytes(item)
+                with condition:
+                    state["held_bytes"] += size
+                _put(loaded, (item, size, None), state)
+        except BaseException as error:
+            _put(loaded, (None, 0, error), state)
+            return
+        _put(loaded, (done, 0, None), state)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    current_size = 0
+    try:
+        while True:
+            item, size, error = loaded.get()
+            with condition:
+                state["held_bytes"] -= current_size
+                condition.notify_all()
+            current_size = size
+
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        with condition:
+            state["stop"] = True
+            condition.notify_all()
+        # unblock the producer if it waits on a full queue
+        while thread.is_alive():
+            try:
+                loaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _put(loaded: queue.Queue, entry: tuple, state: dict) -> None:
+    while not state["stop"]:
+        try:
+            loaded.put(entry, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _materialize(item: any) -> any:
+    if isinstance(item, tuple):
+        return tuple(_materialize(x) for x in item)
+    if isinstance(item, list):
+        return [_materialize(x) for x in item]
+    if isinstance(item, np.ndarray) and _is_file_backed(item):
+        return np.array(item)
+    return item
+
+
+def _is_file_backed(array: np.ndarray) -> bool:
+    base = array
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return True
+        base = getattr(base, "base", None)
+    return False
+
+
+def item_nbytes(item: any) -> int:
+    """
+    Estimate the size of a prefetched item.
+    :param item: An array, or a tuple or list of arrays and other values
+    :type item: any
+    :returns: The total number of bytes of the arrays in the item
+    :rtype: int
+    """
+    if isinstance(item, (tuple, list)):
+        return sum(item_nbytes(x) for x in item)
+    return getattr(item, "nbytes", 0)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+
+from Pipeline import item_nbytes
+
+"""
+File: Profiling.py
+Description: Opt-in, stage-level instrumentation of the metric and DPA code. A `Profiler` records the wall time, the
+bytes read and the peak allocation of each named stage of a run and hands every record to an optional callback.
+Functions that accept a profiler use `NULL_PROFILER`, which records nothing, when none is given.
+"""
+
+
+class Profiler:
+    def __init__(self, callback: Callable[[dict], None] = None, trace_memory: bool = True):
+        """
+        Collects per-stage records. Stages may be nested, the record of a nested stage is named by the path of the
+        stages it runs in, e.g. "calculate_t_test/read".
+        :param callback: A function called with every record as soon as its stage ends
+        :type callback: Callable[[dict], None]
+        :param trace_memory: Whether to measure the peak allocation of each stage with tracemalloc. Tracing slows
+                             allocation heavy code down, so wall times are more accurate without it.
+        :type trace_memory: bool
+        :returns: None
+        """
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """
+        Measure a stage. Use it as a context manager, `with profiler.stage("moments"): ...`.
+        :param name: The name of the stage
+        :type name: str
+        :returns: The record of the stage. Bytes read during the stage may be added to its "bytes_read" entry.
+        :rtype: Iterator[dict]
+        """
+        record = {
+            "stage": "/".join([entry["record"]["name"] for entry in self._stack] + [name]),
+            "name": name,
+            "seconds": 0.0,
+            "bytes_read": 0,
+            "peak_bytes": None,
+        }
+        entry = {"record": record, "base": 0, "peak": 0}
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._fold_peak()
+            entry["base"] = tracemalloc.get_traced_memory()[0]
+            entry["peak"] = entry["base"]
+            tracemalloc.reset_peak()
+
+        self._stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if self.trace_memory:
+                # the peak of a stage includes the peaks of the stages nested in it
+                self._fold_peak()
+                record["peak_bytes"] = entry["peak"] - entry["base"]
+            self._stack.pop()
+
+            if self._stack:
+                self._stack[-1]["record"]["bytes_read"] += record["bytes_read"]
+            elif self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+            self.records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def add_bytes_read(self, num_bytes: int) -> None:
+        """
+        Add bytes read from disk to the innermost running stage.
+        :param num_bytes: The number of bytes
+        :type num_bytes: int
+        :returns: None
+        """
+        if self._stack:
+            self._stack[-1]["record"]["bytes_read"] += int(num_bytes)
+
+    def iterate(self, name: str, items: Iterable) -> Iterator:
+        """
+        Iterate over `items` and measure the time spent waiting for each item as the stage `name`. The bytes of the
+        arrays in each item are counted as read, which suits iterators over dataset chunks.
+        :param name: The name of the stage
+        :type name: str
+        :param items: The items
+        :type items: Iterable
+        :returns: An iterator over the items
+        :rtype: Iterator
+        """
+        iterator = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.add_bytes_read(item_nbytes(item))
+            yield item
+
+    def summary(self) -> dict:
+        """
+        Combine the records of every stage path.
+        :returns: Per stage path the number of calls, the total seconds, the total bytes read and the largest peak
+                  allocation in bytes, in the order the stages first ended
+        :rtype: dict
+        """
+        summary = {}
+        for record in self.records:
+            stage = summary.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "bytes_read": 0,
+                                                         "peak_bytes": None})
+            stage["calls"] += 1
+            stage["seconds"] += record["seconds"]
+            stage["bytes_read"] += record["bytes_read"]
+            if record["peak_bytes"] is not None:
+                stage["peak_bytes"] = max(stage["peak_bytes"] or 0, record["peak_bytes"])
+        return summary
+
+    def save(self, path: str) -> None:
+        """
+        Save the summary and the individual records as JSON.
+        :param path: The path of the report
+        :type path: str
+        :returns: None
+        """
+        with open(path, 'w') as json_file:
+            json.dump({"summary": self.summary(), "records": self.records}, json_file, indent=4)
+
+    def clear(self) -> None:
+        self.records = []
+
+    def _fold_peak(self) -> None:
+        # tracemalloc has a single peak, so it is folded into every running stage before it is reset
+        if not self._stack:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self._stack:
+            entry["peak"] = max(entry["peak"], peak)
+        tracemalloc.reset_peak()
+
+
+class _NullProfiler:
+    # the default profiler, every stage is a no-op
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        yield {"bytes_read": 0}
+
+    def add_bytes_read(self, num_bytes: int) -> None:
+        pass
+
+    def iterate(self, name: str, items: Iterable) -> Iterable:
+        return items
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def get_profiler(profiler: Profiler | None) -> Profiler | _NullProfiler:
+    """
+    Get the profiler to use for an optional profiler argument.
+    :param profiler: The profiler passed by the caller
+    :type profiler: Profiler | None
+    :returns: The profiler, or `NULL_PROFILER` if None was given
+    :rtype: Profiler | _NullProfiler
+    """
+    return NULL_PROFILER if profiler is None else profiler
+
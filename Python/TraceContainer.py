@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import bisect
+import bz2
+import json
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+"""
+File: TraceContainer.py
+Description: Chunked, compressed trace container with random chunk access. Rows are stored in chunks that are each
+compressed on their own with a standard library codec, optionally after quantizing them to a small integer type with a
+per-dataset scale and offset. A chunk index at the end of the file lets reads decompress only the chunks they touch.
+"""
+
+MAGIC = b"SCATRC01"
+FOOTER = struct.Struct("<Q8s")
+
+CODECS = {
+    "none": (lambda data: data, lambda data: data),
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "bz2": (lambda data: bz2.compress(data, 9), bz2.decompress),
+    "lzma": (lambda data: lzma.compress(data), lzma.decompress),
+}
+
+
+class ChunkedTraceFile:
+    def __init__(self, path: str, writable: bool = False):
+        """
+        Open an existing chunked trace file. Use `ChunkedTraceFile.create()` to create a new one.
+        :param path: The path of the file
+        :type path: str
+        :param writable: Whether rows will be appended to the file
+        :type writable: bool
+        :returns: None
+        """
+        self.path = path
+        self.writable = writable
+        self.file = open(path, 'r+b' if writable else 'rb')
+        try:
+            self.index_offset, self.end, self.index = _find_index(self.file)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path} is not a chunked trace file")
+
+        self.stored_dtype = np.dtype(self.index["stored_dtype"])
+        self._ends = list(np.cumsum([rows for _, _, rows in self.index["chunks"]], dtype=np.int64))
+        self._cache = (None, None)
+
+    @classmethod
+    def create(cls, path: str, row_shape: tuple, dtype: any, codec: str = "zlib", chunk_rows: int = 1024,
+               quantize: any = None, scale: float = None, offset: float = None,
+               shuffle: bool = True) -> 'ChunkedTraceFile':
+        """
+        Create an empty chunked trace file.
+        :param path: The path of the file
+        :type path: str
+        :param row_shape: The shape of one row, e.g. (samples,) for traces
+        :type row_shape: tuple
+        :param dtype: The datatype rows are returned in
+        :type dtype: any
+        :param codec: The compression codec of every chunk, one of "zlib", "bz2", "lzma" or "none"
+        :type codec: str
+        :param chunk_rows: The number of rows per chunk
+        :type chunk_rows: int
+        :param quantize: The integer datatype rows are stored as, e.g. "int16". None to store them as `dtype`.
+        :type quantize: any
+        :param scale: The quantization step, stored = round((value - offset) / scale). Required with `quantize`.
+        :type scale: float
+        :param offset: The value stored as zero. Required with `quantize`.
+        :type offset: float
+        :param shuffle: Whether to group the bytes of equal significance before compressing, which usually helps
+        :type shuffle: bool
+        :returns: The opened file, ready for appending
+        :rtype: ChunkedTraceFile
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}, use one of {list(CODECS)}")
+        if quantize is not None and (scale is None or offset is None):
+            raise ValueError("Quantized storage needs a scale and an offset")
+
+        index = {
+            "row_shape": [int(x) for x in row_shape],
+            "dtype": np.dtype(dtype).str,
+            "stored_dtype": np.dtype(dtype if quantize is None else quantize).str,
+            "codec": codec,
+            "chunk_rows": int(chunk_rows),
+            "scale": None if quantize is None else float(scale),
+            "offset": None if quantize is None else float(offset),
+            "shuffle": bool(shuffle),
+            "chunks": [],
+        }
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+            _write_index(file, index, len(MAGIC))
+        return cls(path, writable=True)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self),) + tuple(self.index["row_shape"])
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.index["dtype"])
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return int(self._ends[-1]) if self._ends else 0
+
+    def __getitem__(self, key: any) -> np.ndarray:
+        rest = ()
+        if isinstance(key, tuple):
+            key, rest = key[0], key[1:]
+
+        if isinstance(key, (int, np.integer)):
+            row = range(len(self))[key]
+            return self.read(row, row + 1)[0][rest]
+
+        if isinstance(key, slice):
+            rows = range(len(self))[key]
+            if len(rows) == 0:
+                return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+            low, high = min(rows[0], rows[-1]), max(rows[0], rows[-1]) + 1
+            local = slice(rows.start - low, None if rows.stop - low < 0 else rows.stop - low, rows.step)
+            return self.read(low, high)[local][(slice(None),) + rest]
+
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        key = np.where(key < 0, key + len(self), key)
+        out = np.empty((len(key),) + self.shape[1:], dtype=self.dtype)
+        chunk_of_row = np.searchsorted(self._ends, key, side="right")
+        for chunk in np.unique(chunk_of_row):
+            selected = chunk_of_row == chunk
+            out[selected] = self._read_chunk(int(chunk))[key[selected] - self._chunk_start(int(chunk))]
+        return out[(slice(None),) + rest]
+
+    def __array__(self, dtype: any = None, copy: bool = None) -> np.ndarray:
+        return np.asarray(self.read(0, len(self)), dtype=dtype)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """
+        Read rows, decompressing only the chunks that hold them.
+        :param start: The first row
+        :type start: int
+        :param end: The row after the last row
+        :type end: int
+        :returns: The rows
+        :rtype: np.ndarray
+        """
+        start, end, _ = slice(start, end).indices(len(self))
+        out = np.empty((max(0, end - start),) + self.shape[1:], dtype=self.dtype)
+        if end <= start:
+            return out
+
+        chunk = bisect.bisect_right(self._ends, start)
+        position = start
+        while position < end:
+            chunk_start = self._chunk_start(chunk)
+            chunk_end = int(self._ends[chunk])
+            data = self._read_chunk(chunk)
+            stop = min(end, chunk_end)
+            out[position - start:stop - start] = data[position - chunk_start:stop - chunk_start]
+            position = stop
+            chunk += 1
+        return out
+
+    def append(self, data_to_add: np.ndarray) -> None:
+        """
+        Append rows. The chunks and a new index are written behind the current index, which stays valid until the new
+        footer is written, so an interrupted append loses only the rows it was appending. A trailing partial chunk is
+        stored as its own, smaller chunk.
+        :param data_to_add: The rows to be appended. A single row may be passed without the leading dimension.
+        :type data_to_add: np.ndarray
+        :returns: None
+        """
+        data_to_add = np.asarray(data_to_add)
+        if data_to_add.ndim == len(self.index["row_shape"]):
+            data_to_add = data_to_add[np.newaxis]
+        if list(data_to_add.shape[1:]) != self.index["row_shape"]:
+            raise ValueError(f"Cannot append rows of shape {data_to_add.shape[1:]} to rows of shape "
+                             f"{tuple(self.index['row_shape'])}")
+
+        compress = CODECS[self.index["codec"]][0]
+        position = self.end
+        self.file.seek(position)
+        chunk_rows = self.index["chunk_rows"]
+        for start in range(0, data_to_add.shape[0], chunk_rows):
+            rows = data_to_add[start:start + chunk_rows]
+            payload = compress(self._encode(rows))
+            self.file.write(payload)
+            self.index["chunks"].append([position, len(payload), int(rows.shape[0])])
+            self._ends.append((self._ends[-1] if self._ends else 0) + int(rows.shape[0]))
+            position += len(payload)
+
+        self.end = _write_index(self.file, self.index, position)
+        self.index_offset = position
+        self.file.truncate()
+        self.file.flush()
+
+    def close(self) -> None:
+        """
+        Close the file. A file that was appended to is rewritten without the indexes replaced by later appends once
+        they take up more than an eighth of it.
+        """
+        self.file.close()
+        if not self.writable:
+            return
+        live = len(MAGIC) + sum(size for _, size, _ in self.index["chunks"]) + (self.end - self.index_offset)
+        if self.end - live > self.end // 8:
+            _compact(self.path, self.index)
+
+    def _chunk_start(self, chunk: int) -> int:
+        return int(self._ends[chunk - 1]) if chunk > 0 else 0
+
+    def _read_chunk(self, chunk: int) -> np.ndarray:
+        # the last decompressed chunk is kept for consecutive small reads
+        if self._cache[0] == chunk:
+            return self._cache[1]
+
+        position, size, rows = self.index["chunks"][chunk]
+        self.file.seek(position)
+        raw = CODECS[self.index["codec"]][1](self.file.read(size))
+        data = self._decode(raw, rows)
+        self._cache = (chunk, data)
+        return data
+
+    def _encode(self, rows: np.ndarray) -> bytes:
+        if self.index["scale"] is not None:
+            info = np.iinfo(self.stored_dtype)
+            rows = np.rint((rows - self.index["offset"]) / self.index["scale"])
+            rows = np.clip(rows, info.min, info.max)
+        rows = np.ascontiguousarray(rows, dtype=self.stored_dtype)
+
+        if self.index["shuffle"] and self.stored_dtype.itemsize > 1:
+            return rows.view(np.uint8).reshape(-1, self.stored_dtype.itemsize).T.tobytes()
+        return rows.tobytes()
+
+    def _decode(self, raw: bytes, rows: int) -> np.ndarray:
+        shape = (rows,) + tuple(self.index["row_shape"])
+        data = np.frombuffer(raw, dtype=np.uint8)
+        if self.index["shuffle"] and self.stored_dtype.itemsize > 1:
+            data = np.ascontiguousarray(data.reshape(self.stored_dtype.itemsize, -1).T)
+        data = data.view(self.stored_dtype).reshape(shape)
+
+        if self.index["scale"] is not None:
+            return (data * self.index["scale"] + self.index["offset"]).astype(self.dtype)
+        return data.astype(self.dtype, copy=False)
+
+
+def quantization_parameters(data: np.ndarray, quantize: any) -> (float, float):
+    """
+    Choose a scale and offset that map the range of `data` onto the full range of the integer type `quantize`.
+    :param data: The data to be quantized
+    :type data: np.ndarray
+    :param quantize: The integer datatype
+    :type quantize: any
+    :returns: The scale and the offset
+    :rtype: (float, float)
+    """
+    info = np.iinfo(np.dtype(quantize))
+    low, high = float(np.min(data)), float(np.max(data))
+    scale = (high - low) / (int(info.max) - int(info.min)) or 1.0
+    return scale, low - int(info.min) * scale
+
+
+def _write_index(file: any, index: dict, position: int) -> int:
+    # the footer is written last, a file is valid up to the last complete footer
+    payload = json.dumps(index, separators=(',', ':')).encode('utf8')
+    file.seek(position)
+    file.write(payload)
+    file.write(FOOTER.pack(position, MAGIC))
+    return position + len(payload) + FOOTER.size
+
+
+def _find_index(file: any) -> (int, int, dict):
+    # the footer at the end of the file, or the last complete one before the remains of an interrupted append
+    file.seek(0, os.SEEK_END)
+    end = file.tell()
+    file.seek(0)
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Missing magic number")
+    if end >= len(MAGIC) + FOOTER.size:
+        file.seek(end - FOOTER.size)
+        index_offset, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic == MAGIC and len(MAGIC) <= index_offset < end - FOOTER.size:
+            file.seek(index_offset)
+            return index_offset, end, json.loads(file.read(end - FOOTER.size - index_offset))
+
+    block = 1 << 20
+    search_end = end
+    while search_end > len(MAGIC):
+        start = max(len(MAGIC), search_end - block)
+        file.seek(start)
+        data = file.read(search_end - start + len(MAGIC) - 1)
+        found = data.rfind(MAGIC)
+        while found >= 0:
+            footer_end = start + found + len(MAGIC)
+            if footer_end - FOOTER.size >= len(MAGIC) and footer_end <= end:
+                file.seek(footer_end - FOOTER.size)
+                index_offset, _ = FOOTER.unpack(file.read(FOOTER.size))
+                if len(MAGIC) <= index_offset < footer_end - FOOTER.size:
+                    file.seek(index_offset)
+                    try:
+                        return index_offset, footer_end, json.loads(file.read(footer_end - FOOTER.size - index_offset))
+                    except ValueError:
+                        pass
+            found = data.rfind(MAGIC, 0, found + len(MAGIC) - 1)
+        search_end = start
+    raise ValueError("Missing index")
+
+
+def _compact(path: str, index: dict) -> None:
+    # copy the chunks behind each other into a new file and replace the old one in a single step
+    chunks = []
+    with open(path, 'rb') as source, open(path + ".tmp", 'wb') as target:
+        target.write(MAGIC)
+        for position, size, rows in index["chunks"]:
+            source.seek(position)
+            chunks.append([target.tell(), size, rows])
+            target.write(source.read(size))
+        _write_index(target, {**index, "chunks": chunks}, target.tell())
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the modules import each other by their flat names, as they do when run from the Python directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FileFormat import FileParent  # noqa: E402
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1)
+
+
+@pytest.fixture
+def file_parent(tmp_path):
+    # a trailing separator keeps the backslash-joined file names inside tmp_path
+    return FileParent("test_file", str(tmp_path) + os.sep)
+
+
+@pytest.fixture
+def experiment(file_parent):
+    return file_parent.add_experiment("experiment")
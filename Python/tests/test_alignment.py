@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from Alignment import AlignedView, Aligner, _fft_length, align_chunks, apply_shifts
+
+
+def drifting_traces(rng, num_traces=60, num_samples=200, max_drift=8, noise=0.05):
+    # every trace is the reference pattern delayed by its drift, so a shift equal to the drift aligns it again
+    reference = np.convolve(rng.standard_normal(num_samples + 2 * max_drift), np.ones(5) / 5, mode="same")
+    drifts = rng.integers(-max_drift, max_drift + 1, num_traces)
+    traces = np.array([reference[max_drift - drift:max_drift - drift + num_samples] for drift in drifts])
+    traces += noise * rng.standard_normal(traces.shape)
+    return traces, drifts, reference[max_drift:max_drift + num_samples]
+
+
+def direct_shifts(traces, shifts):
+    # sample j of an aligned trace is sample j + shift, clamped to the ends of the trace
+    index = np.clip(np.arange(traces.shape[1]) + np.asarray(shifts)[:, np.newaxis], 0, traces.shape[1] - 1)
+    return np.take_along_axis(traces, index, axis=1)
+
+
+def test_estimate(rng):
+    traces, drifts, reference = drifting_traces(rng)
+
+    shifts, scores = Aligner(reference, max_shift=10).estimate(traces)
+
+    np.testing.assert_array_equal(shifts, drifts)
+    assert np.all(scores > 0.95) and np.all(scores <= 1 + 1e-9)
+    np.testing.assert_array_equal(Aligner(reference, 10, (60, 140), np.float32).estimate(traces)[0], drifts)
+    assert Aligner(reference, 10).estimate(traces[3])[0][0] == drifts[3]
+
+
+def test_scores_are_normalized_correlations(rng):
+    traces, _, reference = drifting_traces(rng, num_traces=5)
+    aligner = Aligner(reference, max_shift=4, window=(20, 120))
+
+    shifts, scores = aligner.estimate(traces)
+
+    for trace, shift, score in zip(traces, shifts, scores):
+        candidates = [np.corrcoef(trace[20 + s:120 + s], reference[20:120])[0, 1] for s in range(-4, 5)]
+        assert shift == np.argmax(candidates) - 4
+        assert score == pytest.approx(max(candidates), abs=1e-9)
+
+
+def test_align(rng):
+    traces, drifts, reference = drifting_traces(rng, noise=0.0)
+
+    aligned, shifts, _ = Aligner(reference, max_shift=10).align(traces)
+
+    np.testing.assert_array_equal(shifts, drifts)
+    # away from the ends, which are filled with the edge samples, every aligned trace is the reference
+    np.testing.assert_allclose(aligned[:, 10:-10], np.broadcast_to(reference[10:-10], (60, 180)), atol=1e-12)
+    chunks = list(align_chunks([traces[:25], traces[25:]], Aligner(reference, max_shift=10)))
+    np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), aligned)
+
+
+def test_apply_shifts(rng):
+    traces = rng.standard_normal((7, 12)).astype(np.float32)
+    shifts = np.array([0, 1, -1, 5, -5, 11, -40])
+
+    aligned = apply_shifts(traces, shifts)
+
+    assert aligned.dtype == np.float32
+    np.testing.assert_array_equal(aligned, direct_shifts(traces, shifts))
+    np.testing.assert_array_equal(apply_shifts(traces[0], [3]), direct_shifts(traces[:1], [3])[0])
+
+
+def test_aligner_rejects_bad_windows(rng):
+    reference = rng.standard_normal(100)
+
+    with pytest.raises(ValueError):
+        Aligner(reference, max_shift=10, window=(5, 50))
+    with pytest.raises(ValueError):
+        Aligner(reference, max_shift=10, window=(40, 41))
+    with pytest.raises(ValueError):
+        Aligner(reference, max_shift=10).estimate(np.zeros((2, 90)))
+
+
+def test_aligned_view(rng):
+    traces, drifts, reference = drifting_traces(rng)
+    aligner = Aligner(reference, max_shift=10)
+    expected = aligner.align(traces)[0]
+
+    view = AlignedView(traces, aligner)
+    assert view.shape == traces.shape and len(view) == 60
+    np.testing.assert_array_equal(view[5], expected[5])
+    np.testing.assert_array_equal(view[-3, 10:20], expected[-3, 10:20])
+    np.testing.assert_array_equal(view[10:40:3], expected[10:40:3])
+    np.testing.assert_array_equal(view[[59, 0, 7]], expected[[59, 0, 7]])
+    np.testing.assert_array_equal(view[drifts > 0], expected[drifts > 0])
+    np.testing.assert_array_equal(np.concatenate(list(view.iter_chunks(16))), expected)
+    np.testing.assert_array_equal(view.shifts(chunk_size=7), drifts)
+    np.testing.assert_array_equal(np.asarray(view), expected)
+
+
+def test_experiment_align_traces(experiment, rng):
+    traces, drifts, reference = drifting_traces(rng)
+    traces = traces.astype(np.float32)
+    experiment.add_dataset("traces", traces, np.float32)
+    expected = Aligner(reference, max_shift=10).align(traces)[0]
+
+    dataset = experiment.align_traces("traces", reference, max_shift=10, chunk_size=16)
+
+    assert dataset.name == "traces_aligned"
+    np.testing.assert_array_equal(dataset.read_all(), expected)
+    np.testing.assert_array_equal(experiment.get_dataset("traces_aligned_shifts").read_all(), drifts)
+    assert dataset.metadata["aligned_from"] == "traces" and dataset.metadata["alignment_max_shift"] == 10
+
+    view = experiment.align_traces("traces", reference=0, max_shift=10, lazy=True)
+    assert isinstance(view, AlignedView)
+    np.testing.assert_array_equal(view.shifts(), drifts - drifts[0])
+
+
+def test_fft_length():
+    for length in (1, 2, 7, 97, 1000, 1025, 4097):
+        size = _fft_length(length)
+        assert size >= length and _is_smooth(size)
+        assert all(not _is_smooth(candidate) for candidate in range(length, size))
+
+
+def _is_smooth(number):
+    for prime in (2, 3, 5):
+        while number % prime == 0:
+            number //= prime
+    return number == 1
@@ -0,0 +1,45 @@
+import numpy as np
+
+from Benchmark import compare, generate_masked_traces, run_benchmarks
+from DPA import calculate_dpa, calculate_second_order_dpa_tiled
+from LeakageModels import hamming_weight, intermediate_values
+
+
+def test_generated_leakage():
+    traces, iv = generate_masked_traces(4000, 20, snr=2.0, seed=3)
+
+    assert traces.shape == (4000, 20) and traces.dtype == np.float32 and iv.shape == (4000, 16)
+    np.testing.assert_array_equal(traces, generate_masked_traces(4000, 20, snr=2.0, seed=3)[0])
+    # the mask leaks at sample 5 and the masked value at sample 10, under noise of variance 4 / snr
+    mask_noise = traces[:, 5] - hamming_weight(iv, (14, 15))
+    masked_noise = traces[:, 10] - hamming_weight(iv, (12, 13))
+    np.testing.assert_allclose([np.var(mask_noise), np.var(masked_noise), np.var(traces[:, 0])], 2.0, rtol=0.1)
+
+    # masking hides the value from a first-order attack but not from a second-order one
+    assert np.max(np.abs(calculate_dpa(traces, iv)[0])) < 0.1
+    second_order = calculate_second_order_dpa_tiled(traces, iv, combine="product")
+    pairs_a, pairs_b = np.triu_indices(20, 1)
+    best = np.argmax(np.abs(second_order))
+    assert (pairs_a[best], pairs_b[best]) == (5, 10)
+
+
+def test_generated_fixed_value():
+    traces, iv = generate_masked_traces(100, 8, seed=1, fixed_value=0x00ff, first_order_leak=1.0, dtype=np.float64)
+
+    assert traces.dtype == np.float64
+    np.testing.assert_array_equal(intermediate_values(iv), 8)
+
+
+def test_run_benchmarks():
+    config = {"traces": 200, "samples": 16, "second_order_traces": 100, "second_order_samples": 8, "window_width": 2,
+              "chunk_size": 64, "repeat": 1}
+
+    report = run_benchmarks(config, only=["t_test", "dataset_append"])
+
+    assert [result["name"] for result in report["results"]] == ["t_test", "dataset_append"]
+    assert report["config"]["traces"] == 200 and report["config"]["seed"] == 0
+    assert compare(report, report) == []
+
+    slower = {"results": [{**result, "seconds": {"median": 3 * result["seconds"]["median"]}}
+                          for result in report["results"]]}
+    assert compare(report, slower) == ["t_test: 3.00x slower", "dataset_append: 3.00x slower"]
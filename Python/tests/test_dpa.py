@@ -0,0 +1,346 @@
+import os
+
+import numpy as np
+import pytest
+
+from DPA import (CPAAccumulator, calculate_dpa, calculate_dpa_convergence, calculate_dpa_multi, calculate_dpa_streaming,
+                 calculate_second_order_dpa_mem_efficient, calculate_second_order_dpa_poi,
+                 calculate_second_order_dpa_tiled, calculate_window_averages, guessing_entropy, iterate_chunks,
+                 iterate_window_averages, poi_indices, second_order_pairs, select_poi, tile_block_size)
+from LeakageModels import intermediate_values
+
+
+def direct_correlation(hypotheses, traces):
+    # (hypotheses x samples) correlations of every hypothesis column with every sample
+    hypotheses = hypotheses - hypotheses.mean(axis=0)
+    traces = traces - traces.mean(axis=0)
+    return (hypotheses.T @ traces) / np.outer(np.linalg.norm(hypotheses, axis=0), np.linalg.norm(traces, axis=0))
+
+
+def leaky_traces(rng, num_traces=500, num_samples=30, sample=11):
+    iv = rng.integers(0, 256, (num_traces, 16), dtype=np.uint8)
+    traces = rng.standard_normal((num_traces, num_samples))
+    traces[:, sample] += intermediate_values(iv)
+    return traces, iv
+
+
+def test_cpa_accumulator(rng):
+    traces = rng.standard_normal((400, 25)) + 10
+    hypotheses = rng.integers(0, 9, (400, 3)).astype(np.float64)
+
+    accumulator = CPAAccumulator()
+    for start, stop in ((0, 1), (1, 150), (150, 400)):
+        accumulator.update(traces[start:stop], hypotheses[start:stop])
+
+    assert accumulator.n == 400
+    np.testing.assert_allclose(accumulator.correlation(), direct_correlation(hypotheses, traces), rtol=1e-9,
+                               atol=1e-12)
+
+
+def test_calculate_dpa(rng):
+    traces, iv = leaky_traces(rng)
+
+    cpa_output, guess_corr, guess = calculate_dpa(traces, iv)
+
+    expected = direct_correlation(intermediate_values(iv)[:, np.newaxis].astype(np.float64), traces)[0]
+    np.testing.assert_allclose(cpa_output, expected, rtol=1e-10)
+    assert guess == 0 and guess_corr == pytest.approx(np.max(np.abs(expected)))
+
+
+def test_calculate_dpa_streaming(rng):
+    traces, iv = leaky_traces(rng)
+    expected = direct_correlation(intermediate_values(iv)[:, np.newaxis].astype(np.float64), traces)[0]
+
+    cpa_output, guess_corr, guess = calculate_dpa_streaming(iterate_chunks(traces, iv, chunk_size=128))
+    np.testing.assert_allclose(cpa_output, expected, rtol=1e-10)
+    assert guess == 0 and guess_corr == pytest.approx(np.max(np.abs(expected)))
+    assert np.argmax(np.abs(cpa_output)) == 11
+
+    hypotheses = np.stack((intermediate_values(iv), iv[:, 0]), axis=1)
+    cpa_output, _, guess = calculate_dpa_streaming(iterate_chunks(traces, hypotheses, chunk_size=64),
+                                                   leakage_model=None)
+    np.testing.assert_allclose(cpa_output, direct_correlation(hypotheses.astype(np.float64), traces), rtol=1e-10)
+    assert cpa_output.shape == (2, 30) and guess == 0
+
+
+def test_calculate_dpa_streaming_from_dataset(experiment, rng):
+    traces, iv = leaky_traces(rng)
+    experiment.add_dataset("traces", traces, np.float64)
+    experiment.add_dataset("iv", iv, np.uint8)
+
+    chunks = iterate_chunks(experiment.get_dataset("traces"), experiment.get_dataset("iv"), chunk_size=100)
+    cpa_output = calculate_dpa_streaming(chunks)[0]
+
+    np.testing.assert_allclose(cpa_output, calculate_dpa(traces, iv)[0], rtol=1e-10)
+
+
+def test_calculate_dpa_multi(rng):
+    traces, iv = leaky_traces(rng, sample=4)
+    # a random S-box, without one the Hamming weights of complementary key guesses are perfectly anticorrelated
+    sbox = rng.permutation(256).astype(np.uint8)
+    key_guesses = sbox[iv[:, :1] ^ np.arange(256, dtype=np.uint8)]
+    hypotheses = np.unpackbits(key_guesses[:, :, np.newaxis], axis=2).sum(axis=2)
+    # the traces leak the Hamming weight of the S-box output under key guess 37
+    traces[:, 20] += 2 * hypotheses[:, 37]
+
+    cpa_output, max_cpa, ranking, ge = calculate_dpa_multi(traces, hypotheses, correct_hypothesis=37,
+                                                           block_size=100)
+
+    expected = direct_correlation(hypotheses.astype(np.float64), traces)
+    np.testing.assert_allclose(cpa_output, expected, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(max_cpa, np.max(np.abs(expected), axis=1), rtol=1e-9)
+    assert ranking[0] == 37 and ge == 0
+    assert guessing_entropy(np.stack((ranking, np.roll(ranking, 2))), 37) == 1
+    # a ranking without the correct hypothesis must not count as a perfect recovery
+    with pytest.raises(ValueError):
+        guessing_entropy(ranking, 256)
+    with pytest.raises(ValueError):
+        guessing_entropy(np.stack((ranking[1:], ranking[ranking != 37])), 37)
+
+
+def test_calculate_dpa_multi_float32(rng):
+    traces = (rng.normal(0, 0.05, (600, 10)) + 200).astype(np.float32)
+    hypotheses = rng.integers(0, 9, (600, 4))
+    traces[:, 3] += 0.05 * hypotheses[:, 2]
+
+    cpa_output = calculate_dpa_multi(traces, hypotheses, dtype=np.float32, block_size=256)[0]
+
+    expected = direct_correlation(hypotheses.astype(np.float64), traces.astype(np.float64))
+    np.testing.assert_allclose(cpa_output, expected, atol=1e-5)
+
+
+def direct_second_order(traces, hypotheses, combine="absdiff", pairs=None):
+    # the combined traces of every pair (i, j > i), or of the given pairs, correlated with every hypothesis column
+    pairs_a, pairs_b = np.triu_indices(traces.shape[1], 1) if pairs is None else pairs
+    if combine == "absdiff":
+        combined = np.abs(traces[:, pairs_a] - traces[:, pairs_b])
+    else:
+        centered = traces - traces.mean(axis=0)
+        combined = centered[:, pairs_a] * centered[:, pairs_b]
+    return direct_correlation(np.asarray(hypotheses, dtype=np.float64).reshape(len(traces), -1), combined)
+
+
+def masked_traces(rng, num_traces=400, num_samples=14):
+    # the two shares of a masked value leak at samples 3 and 9
+    secret = rng.integers(0, 9, num_traces)
+    mask = rng.integers(0, 9, num_traces)
+    traces = rng.standard_normal((num_traces, num_samples))
+    traces[:, 3] += mask
+    traces[:, 9] += np.abs(secret - mask)
+    return traces, secret
+
+
+@pytest.mark.parametrize("combine", ["absdiff", "product"])
+@pytest.mark.parametrize("block_size, tile_size", [(256, 2 ** 24), (4, 300), (5, 1)])
+def test_second_order_tiled(rng, combine, block_size, tile_size):
+    traces, secret = masked_traces(rng)
+
+    cpa_output = calculate_second_order_dpa_tiled(traces, hypothesis=secret, combine=combine, block_size=block_size,
+                                                  tile_size=tile_size)
+
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces, secret, combine)[0], rtol=1e-9, atol=1e-12)
+
+
+def test_second_order_tiled_hypotheses(rng):
+    traces, secret = masked_traces(rng)
+    hypotheses = np.stack((secret, rng.integers(0, 9, len(secret))), axis=1)
+
+    cpa_output = calculate_second_order_dpa_tiled(traces, hypothesis=hypotheses, block_size=6, tile_size=500)
+
+    assert cpa_output.shape == (2, 14 * 13 // 2)
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces, hypotheses), rtol=1e-9, atol=1e-12)
+
+
+def test_second_order_tiled_float32(rng):
+    traces, secret = masked_traces(rng)
+    traces = (traces + 100).astype(np.float32)
+
+    cpa_output = calculate_second_order_dpa_tiled(traces, hypothesis=secret, block_size=4, tile_size=1000,
+                                                  dtype=np.float32)
+
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces.astype(np.float64), secret)[0], atol=1e-5)
+
+
+def test_second_order_mem_efficient(rng):
+    traces, secret = masked_traces(rng)
+    iv = rng.integers(0, 256, (len(traces), 16), dtype=np.uint8)
+
+    cpa_output = calculate_second_order_dpa_mem_efficient(traces, iv, window_width=3)
+
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces, intermediate_values(iv))[0], rtol=1e-9,
+                               atol=1e-12)
+    assert tile_block_size(400 * 3, 400) == 1
+    assert tile_block_size(2 ** 24, 10 ** 6) == 128
+    assert tile_block_size(2 ** 24, 100) == 256
+
+
+def test_calculate_dpa_second_order(rng):
+    traces, secret = masked_traces(rng)
+    averaged = np.array([traces[i:i + 5].mean(axis=0) for i in range(len(traces) - 5)])
+
+    cpa_output, guess_corr, _ = calculate_dpa(traces, None, order=2, hypothesis=secret)
+
+    expected = direct_second_order(averaged, secret[:len(averaged)])[0]
+    np.testing.assert_allclose(cpa_output, expected, rtol=1e-9, atol=1e-12)
+    assert guess_corr == pytest.approx(np.max(np.abs(expected)))
+
+
+def shared_memory_blocks():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def test_second_order_parallel(rng):
+    traces, secret = masked_traces(rng, num_samples=20)
+    hypotheses = np.stack((secret, rng.integers(0, 9, len(secret))), axis=1)
+    blocks = shared_memory_blocks()
+
+    cpa_output = calculate_second_order_dpa_tiled(traces, hypothesis=hypotheses, block_size=4, n_jobs=2)
+    serial = calculate_second_order_dpa_tiled(traces, hypothesis=hypotheses, block_size=4)
+
+    # the row ranges of the workers split the tiles differently, which only changes the rounding
+    np.testing.assert_allclose(cpa_output, serial, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(calculate_dpa(traces, None, order=2, hypothesis=secret, n_jobs=2)[0],
+                               calculate_dpa(traces, None, order=2, hypothesis=secret)[0], rtol=1e-12, atol=1e-15)
+    del cpa_output
+    assert shared_memory_blocks() <= blocks
+
+
+def direct_window_averages(traces, window_size, traces_max):
+    return np.array([traces[i:i + window_size].mean(axis=0) for i in range(traces_max)]).reshape(
+        (traces_max,) + traces.shape[1:])
+
+
+def test_window_averages(rng):
+    traces = rng.standard_normal((103, 7))
+
+    np.testing.assert_allclose(calculate_window_averages(traces, block_size=16),
+                               direct_window_averages(traces, 5, 98), rtol=1e-12)
+    np.testing.assert_allclose(calculate_window_averages(traces, window_size=3, traces_max=40),
+                               direct_window_averages(traces, 3, 40), rtol=1e-12)
+    # more windows than the traces hold are clamped
+    assert calculate_window_averages(traces, window_size=5, traces_max=500).shape == (98, 7)
+    assert calculate_window_averages(traces[:4], window_size=5).shape == (0, 7)
+
+    out = np.zeros((40, 7), dtype=np.float32)
+    calculate_window_averages(traces.astype(np.float32), traces_max=40, out=out)
+    np.testing.assert_allclose(out, direct_window_averages(traces, 5, 40), rtol=1e-5, atol=1e-6)
+    assert calculate_window_averages(traces.astype(np.int16)).dtype == np.float64
+
+
+@pytest.mark.parametrize("traces_max", [0, 30, 97, 98, 500])
+def test_iterate_window_averages(rng, traces_max):
+    traces = rng.standard_normal((103, 7))
+    chunks = (traces[start:start + size] for start, size in zip((0, 2, 3, 40, 41, 90), (2, 1, 37, 1, 49, 13)))
+
+    averages = list(iterate_window_averages(chunks, window_size=5, traces_max=traces_max))
+
+    np.testing.assert_allclose(np.concatenate(averages),
+                               calculate_window_averages(traces, window_size=5, traces_max=traces_max), rtol=1e-12)
+
+
+def test_dpa_convergence(rng):
+    traces, iv = leaky_traces(rng, num_traces=330)
+    hypotheses = np.stack((intermediate_values(iv), iv[:, 3]), axis=1)
+
+    counts, max_corr, first = calculate_dpa_convergence(iterate_chunks(traces, hypotheses, chunk_size=64), 50,
+                                                        leakage_model=None)
+
+    assert list(counts) == [50, 100, 150, 200, 250, 300, 330]
+    expected = [np.max(np.abs(direct_correlation(hypotheses[:n].astype(np.float64), traces[:n])), axis=1)
+                for n in counts]
+    np.testing.assert_allclose(max_corr, expected, rtol=1e-9)
+    crossed = np.array(expected) >= 4.5 / np.sqrt(counts)[:, np.newaxis]
+    np.testing.assert_array_equal(first, np.where(crossed.any(axis=0), counts[np.argmax(crossed, axis=0)], -1))
+    assert first[0] == 50
+
+    counts, _, first = calculate_dpa_convergence(iterate_chunks(traces, iv, chunk_size=1000), [10, 64, 65],
+                                                 threshold=2.0)
+    assert list(counts) == [10, 64, 65, 330] and list(first) == [-1]
+    with pytest.raises(ValueError):
+        calculate_dpa_convergence(iterate_chunks(traces, iv, chunk_size=64), 0)
+
+
+def test_poi_indices():
+    assert list(poi_indices(slice(2, 5), 10)) == [2, 3, 4]
+    assert list(poi_indices((2, 5), 10)) == [2, 3, 4]
+    assert list(poi_indices((7, 2, 5), 10)) == [2, 5, 7]
+    assert list(poi_indices((4,), 10)) == [4]
+    assert list(poi_indices([(0, 2), slice(6, None), range(1, 4)], 8)) == [0, 1, 2, 3, 6, 7]
+    assert list(poi_indices([5, -1, 5], 10)) == [5, 9]
+    assert list(poi_indices(np.arange(6) % 2 == 1, 6)) == [1, 3, 5]
+    assert list(poi_indices(slice(1, 7, 2), None)) == [1, 3, 5]
+
+
+def test_second_order_pairs():
+    pairs_a, pairs_b = second_order_pairs([1, 4, 6])
+    assert list(zip(pairs_a, pairs_b)) == [(1, 4), (1, 6), (4, 6)]
+
+    # samples in both sets are paired once, as (a, b) with a < b
+    pairs_a, pairs_b = second_order_pairs([1, 4], (4, 9, 1))
+    assert sorted(zip(pairs_a.tolist(), pairs_b.tolist())) == [(1, 4), (1, 9), (4, 9)]
+
+
+@pytest.mark.parametrize("poi, poi_b", [((2, 8), None), ([9, 3, 12, 0], None), ((3, 9, 11), (2, 12)),
+                                         ([(0, 3), (8, 10)], None), ((2, 6), [4, 5, 9, 3]), ((3, 4), (3, 4))])
+@pytest.mark.parametrize("combine", ["absdiff", "product"])
+def test_second_order_poi(rng, poi, poi_b, combine):
+    traces, secret = masked_traces(rng)
+
+    cpa_output, pairs_a, pairs_b = calculate_second_order_dpa_poi(traces, hypothesis=secret, poi=poi, poi_b=poi_b,
+                                                                  combine=combine, block_size=3, tile_size=200)
+
+    expected_a, expected_b = second_order_pairs(poi, poi_b, traces.shape[1])
+    np.testing.assert_array_equal(pairs_a, expected_a)
+    np.testing.assert_array_equal(pairs_b, expected_b)
+    assert len(set(zip(pairs_a, pairs_b)) | set(zip(pairs_b, pairs_a))) == 2 * len(pairs_a)
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces, secret, combine, (pairs_a, pairs_b))[0],
+                               rtol=1e-9, atol=1e-12)
+
+
+def test_second_order_poi_entry_points(rng):
+    traces, secret = masked_traces(rng)
+    iv = rng.integers(0, 256, (len(traces), 16), dtype=np.uint8)
+    hypothesis = intermediate_values(iv)
+    averaged = calculate_window_averages(traces)
+
+    cpa_output = calculate_dpa(traces, iv, order=2, poi=[3, 9, 4], n_jobs=2)[0]
+    np.testing.assert_allclose(cpa_output, direct_second_order(averaged, hypothesis[:len(averaged)], "absdiff",
+                                                               second_order_pairs([3, 9, 4]))[0], rtol=1e-9)
+
+    cpa_output = calculate_dpa(traces, iv, order=2, poi=(0, 4), poi_b=(8, 10))[0]
+    np.testing.assert_allclose(cpa_output, direct_second_order(averaged, hypothesis[:len(averaged)], "absdiff",
+                                                               second_order_pairs((0, 4), (8, 10)))[0], rtol=1e-9)
+
+    for n_jobs in (1, 2):
+        cpa_output = calculate_second_order_dpa_mem_efficient(traces, iv, 3, poi=slice(2, 11), n_jobs=n_jobs)
+        np.testing.assert_allclose(cpa_output, direct_second_order(traces, hypothesis, "absdiff",
+                                                                   second_order_pairs(slice(2, 11)))[0], rtol=1e-9)
+
+    # cross pairs of two windows are split over the workers like the pair triangle
+    serial = calculate_dpa(traces, iv, order=2, poi=(0, 6), poi_b=[slice(4, 8), (11, 14)])[0]
+    parallel = calculate_dpa(traces, iv, order=2, poi=(0, 6), poi_b=[slice(4, 8), (11, 14)], n_jobs=2)[0]
+    np.testing.assert_allclose(parallel, serial, rtol=1e-12, atol=1e-15)
+    parallel = calculate_second_order_dpa_mem_efficient(traces, iv, 3, poi=(0, 6), poi_b=(4, 14), n_jobs=2)
+    np.testing.assert_allclose(parallel, direct_second_order(traces, hypothesis, "absdiff",
+                                                             second_order_pairs((0, 6), (4, 14)))[0], rtol=1e-9)
+    hypotheses = np.stack((secret, hypothesis, secret % 3), axis=1)
+    cpa_output, pairs_a, pairs_b = calculate_second_order_dpa_poi(traces, hypothesis=hypotheses, poi=[1, 9],
+                                                                  poi_b=(2, 12), block_size=2, n_jobs=3)
+    np.testing.assert_allclose(cpa_output, direct_second_order(traces, hypotheses, "absdiff", (pairs_a, pairs_b)),
+                               rtol=1e-9)
+
+
+def test_select_poi(rng):
+    traces, secret = masked_traces(rng)
+    traces[:, 4] += traces[:, 3]
+
+    selected, score = select_poi(traces, secret, num_poi=1)
+    assert list(selected) == [9]
+    classes = [traces[secret == label] for label in np.unique(secret)]
+    snr = (np.var([c.mean(axis=0) for c in classes], axis=0) / np.mean([c.var(axis=0) for c in classes], axis=0))
+    np.testing.assert_allclose(score, snr, rtol=1e-9)
+
+    selected, score = select_poi(traces, num_poi=3)
+    np.testing.assert_allclose(score, traces.var(axis=0), rtol=1e-9)
+    assert list(selected) == sorted(np.argsort(-score)[:3])
+    assert list(select_poi(traces, num_poi=2, min_distance=2)[0]) == [4, 9]
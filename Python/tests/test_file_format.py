@@ -0,0 +1,352 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from FileFormat import FileParent, MetadataIndex, _npy_header
+
+
+def write_tight_npy(path, data):
+    # a .npy file whose header has no padding beyond the 64-byte alignment, as written by older tools
+    header = _npy_header(data.dtype, data.shape)
+    header_len = -(-(10 + len(header) + 1) // 64) * 64 - 10
+    with open(path, 'wb') as file:
+        file.write(np.lib.format.magic(1, 0) + header_len.to_bytes(2, 'little')
+                   + (header.ljust(header_len - 1) + '\n').encode('latin1'))
+        file.write(data.tobytes())
+    return header_len - len(header) - 1
+
+
+def reopen(file_parent, **kwargs):
+    return FileParent(file_parent.name, file_parent.path[:-len(file_parent.name)], existing=True, **kwargs)
+
+
+def test_append_round_trip(experiment, rng):
+    data = rng.standard_normal((10, 6)).astype(np.float32)
+    dataset = experiment.add_dataset("traces", data[:3], np.float32)
+
+    with dataset.appender() as appender:
+        appender.append(data[3:7])
+        appender.append(data[7])
+    dataset.append(data[8:])
+
+    np.testing.assert_array_equal(dataset.read_all(), data)
+    np.testing.assert_array_equal(dataset.read_data(2, 9, mmap=True), data[2:9])
+    assert dataset.metadata["num_traces"] == 10
+    assert np.load(dataset.get_file_path()).shape == (10, 6)
+
+
+def test_append_creates_dataset(experiment, rng):
+    data = rng.integers(0, 256, (5, 3), dtype=np.uint8)
+    dataset = experiment.add_dataset("labels", data[:0], np.uint8)
+
+    dataset.append(data[:2])
+    dataset.append(data[2:])
+
+    np.testing.assert_array_equal(dataset.read_all(), data)
+
+
+def test_append_after_reopen(file_parent, experiment, rng):
+    data = rng.standard_normal((8, 4))
+    experiment.add_dataset("traces", data[:5], np.float64)
+    experiment.get_dataset("traces").read_all(mmap=True)
+
+    reopened = reopen(file_parent)
+    dataset = reopened.get_experiment("experiment").get_dataset("traces")
+    dataset.append(data[5:])
+
+    np.testing.assert_array_equal(dataset.read_all(), data)
+
+
+def test_append_rejects_mismatched_rows(experiment):
+    dataset = experiment.add_dataset("traces", np.zeros((2, 4)), np.float64)
+
+    with pytest.raises(ValueError):
+        dataset.append(np.zeros((2, 5)))
+    with pytest.raises(ValueError):
+        dataset.append(np.zeros((2, 4), dtype=np.float32), np.float32)
+    np.testing.assert_array_equal(dataset.read_all(), np.zeros((2, 4)))
+
+
+def test_append_grows_tight_header(experiment, rng):
+    # pick a row shape whose header leaves no room for another digit of the row count
+    for row_shape in ((1,) * ones + (num_samples,) for ones in range(24) for num_samples in (1, 10, 100)):
+        data = rng.standard_normal((1,) + row_shape).astype(np.float32)
+        dataset = experiment.add_dataset(f"traces_{len(row_shape)}_{row_shape[-1]}", data, np.float32)
+        if write_tight_npy(dataset.get_file_path(), data) == 0:
+            break
+    else:
+        pytest.fail("No row shape gives a tight header")
+
+    dataset.read_all(mmap=True)
+    extra = rng.standard_normal((20,) + row_shape).astype(np.float32)
+    with dataset.appender() as appender:
+        appender.append(extra[:9])
+        appender.append(extra[9:])
+
+    expected = np.concatenate((data, extra))
+    np.testing.assert_array_equal(np.load(dataset.get_file_path()), expected)
+    np.testing.assert_array_equal(dataset.read_all(mmap=True), expected)
+    assert dataset.metadata["num_traces"] == 21
+
+
+def test_copies_do_not_keep_the_file_mapped(experiment, rng):
+    data = rng.standard_normal((6, 3))
+    dataset = experiment.add_dataset("traces", data, np.float64)
+
+    np.testing.assert_array_equal(dataset.read_data(1, 4), data[1:4])
+    np.testing.assert_array_equal(dataset.read_all(), data)
+    assert dataset._memmap is None
+
+    np.testing.assert_array_equal(dataset.read_data(1, 4, mmap=True), data[1:4])
+    assert dataset._memmap is not None
+
+
+def test_replacing_mapped_data(experiment, rng):
+    dataset = experiment.add_dataset("traces", rng.standard_normal((6, 3)), np.float64)
+    dataset.read_all(mmap=True)
+
+    replacement = rng.standard_normal((4, 2))
+    dataset.add_data(replacement, np.float64)
+    np.testing.assert_array_equal(dataset.read_all(mmap=True), replacement)
+
+    dataset.add_chunked_data(replacement, np.float64)
+    np.testing.assert_array_equal(dataset.read_all(), replacement)
+    dataset.add_data(replacement[:2], np.float64)
+    np.testing.assert_array_equal(dataset.read_all(mmap=True), replacement[:2])
+
+
+def test_delete_mapped_dataset(experiment, rng, monkeypatch):
+    dataset = experiment.add_dataset("traces", rng.standard_normal((6, 3)), np.float64)
+    dataset.read_all(mmap=True)
+    path = dataset.get_file_path()
+
+    monkeypatch.setattr("builtins.input", lambda *args: "y")
+    experiment.delete_dataset("traces")
+
+    assert dataset._memmap is None
+    assert not os.path.exists(path)
+    assert "traces" not in experiment.dataset
+
+
+def test_metadata_index():
+    index = MetadataIndex()
+    index.add_all("a", {"device": "stm32", "temperature": 25, "gain": [1, 2]})
+    index.add_all("b", {"device": "stm32f4", "temperature": 40.5, "flag": True})
+    index.add_all("c", {"device": "xmega", "temperature": 10})
+
+    assert index.query("device", "stm32") == ["a"]
+    assert index.query("device", "stm32.*", regex=True) == ["a", "b"]
+    assert index.query("temperature", "*") == ["a", "b", "c"]
+    assert index.query("gain", [1, 2]) == ["a"]
+    assert index.query("missing", 1) == []
+    assert index.query_range("temperature", 20) == ["a", "b"]
+    assert index.query_range("temperature", high=25) == ["c", "a"]
+    assert index.query_range("flag") == []
+
+    index.add("c", "temperature", 50)
+    assert index.query_range("temperature", 20, 45) == ["a", "b"]
+    assert index.query("temperature", 10) == []
+
+    index.discard("a", "device")
+    assert index.query("device", "stm32.*", regex=True) == ["b"]
+    assert index.query_range("temperature") == ["a", "b", "c"]
+
+    index.remove("b")
+    assert index.query("temperature", "*") == ["a", "c"]
+    assert index.query("flag", True) == []
+
+
+def test_metadata_index_keeps_registration_order():
+    index = MetadataIndex()
+    for name in ("a", "b", "c", "d"):
+        index.register(name)
+    index.add("d", "device", "x2")
+    index.add("b", "device", "x1")
+    index.add("a", "device", "x2")
+    index.add("c", "gain", 1)
+    index.add("b", "gain", 1)
+
+    assert index.query("device", "x.*", regex=True) == ["a", "b", "d"]
+    assert index.query("device", "*") == ["a", "b", "d"]
+    assert index.query("device", "x2") == ["a", "d"]
+    index.add("c", "gain", 1)
+    assert index.query("gain", 1) == ["b", "c"]
+
+    index.remove("a")
+    index.add("a", "device", "x2")
+    assert index.query("device", "x2") == ["d", "a"]
+
+
+def test_metadata_queries(file_parent, rng):
+    for name, temperature in (("cold", 0), ("warm", 25), ("hot", 60)):
+        experiment = file_parent.add_experiment(name)
+        experiment.update_metadata("temperature", temperature)
+        for gain in (1, 2):
+            dataset = experiment.add_dataset(f"traces_{gain}", rng.standard_normal((2, 3)), np.float64)
+            dataset.update_metadata("gain", gain)
+
+    assert [e.name for e in file_parent.query_experiments_in_range("temperature", 10)] == ["warm", "hot"]
+    assert [e.name for e in file_parent.query_experiments_with_metadata("temperature", 0)] == ["cold"]
+    experiment = file_parent.get_experiment("warm")
+    assert [d.name for d in experiment.query_datasets_with_metadata("gain", 2)] == ["traces_2"]
+
+    # the experiments come back in the order they were added, not the order their metadata was set
+    file_parent.get_experiment("hot").update_metadata("device", "stm32f4")
+    file_parent.get_experiment("cold").update_metadata("device", "stm32")
+    assert [e.name for e in file_parent.query_experiments_with_metadata("device", "stm32.*", regex=True)] == \
+        ["cold", "hot"]
+
+    reopened = reopen(file_parent)
+    assert [e.name for e in reopened.query_experiments_in_range("temperature", high=30)] == ["cold", "warm"]
+    assert [e.name for e in reopened.query_experiments_with_metadata("device", "*")] == ["cold", "hot"]
+    experiment = reopened.get_experiment("hot")
+    assert [d.name for d in experiment.query_datasets_in_range("gain", 1, 1)] == ["traces_1"]
+
+
+def test_chunked_dataset(experiment, rng):
+    data = rng.uniform(-1, 1, (30, 5)).astype(np.float32)
+    dataset = experiment.add_chunked_dataset("traces", data[:20], np.float32, chunk_rows=8)
+
+    dataset.append(data[20:])
+    np.testing.assert_array_equal(dataset.read_all(), data)
+    np.testing.assert_array_equal(dataset.read_data(5, 25), data[5:25])
+    assert dataset.metadata["num_traces"] == 30
+
+    dataset.add_chunked_data(data, np.float32, quantize="int16")
+    assert experiment.query_datasets_with_metadata("quantization_scale", "*") == [dataset]
+    np.testing.assert_allclose(dataset.read_all(), data, atol=dataset.metadata["quantization_scale"])
+
+    dataset.add_data(data, np.float32)
+    assert "quantization_scale" not in dataset.metadata
+    assert experiment.query_datasets_with_metadata("quantization_offset", "*") == []
+    np.testing.assert_array_equal(dataset.read_all(mmap=True), data)
+
+
+def read_json(file_parent):
+    with open(f"{file_parent.path}\\metadataHolder.json") as json_file:
+        return json.load(json_file)
+
+
+def test_batched_metadata_writes(file_parent, experiment):
+    with file_parent.batch():
+        experiment.update_metadata("temperature", 25)
+        with file_parent.batch():
+            file_parent.update_metadata("operator", "lab")
+        assert "operator" not in read_json(file_parent)["metadata"]
+        experiment.update_metadata("gain", 2)
+        assert read_json(file_parent)["experiments"][0]["metadata"].get("temperature") is None
+
+    on_disk = read_json(file_parent)
+    assert on_disk["metadata"]["operator"] == "lab"
+    assert on_disk["experiments"][0]["metadata"]["temperature"] == 25
+    assert on_disk["experiments"][0]["metadata"]["gain"] == 2
+    assert not os.path.exists(f"{file_parent.path}\\metadataHolder.json.tmp")
+
+
+def test_batch_writes_on_error(file_parent):
+    with pytest.raises(RuntimeError):
+        with file_parent.batch():
+            file_parent.update_metadata("operator", "lab")
+            raise RuntimeError
+
+    assert read_json(file_parent)["metadata"]["operator"] == "lab"
+
+
+def test_lazy_open(file_parent, experiment, rng):
+    data = rng.standard_normal((4, 3))
+    experiment.add_dataset("traces", data, np.float64)
+    file_parent.add_experiment("other")
+
+    reopened = reopen(file_parent, lazy=True)
+    assert set(reopened.experiments) == {"experiment", "other"}
+    assert reopened.experiments.get_loaded("experiment") is None
+
+    experiment = reopened.get_experiment("experiment")
+    assert reopened.experiments.get_loaded("experiment") is experiment
+    assert reopened.experiments.get_loaded("other") is None
+    assert experiment.dataset.get_loaded("traces") is None
+    np.testing.assert_array_equal(experiment.get_dataset("traces").read_all(), data)
+
+
+def test_verify_removes_missing_files(file_parent, experiment, rng):
+    for name in ("first", "second", "third"):
+        experiment.add_dataset(name, rng.standard_normal((2, 2)), np.float64)
+    os.remove(experiment.get_dataset("first").get_file_path())
+
+    reopened = reopen(file_parent)
+    experiment = reopened.get_experiment("experiment")
+    assert set(experiment.dataset) == {"second", "third"}
+    assert [d["name"] for d in read_json(reopened)["experiments"][0]["datasets"]] == ["second", "third"]
+
+    # the remaining entries are renumbered, so metadata still goes to the right dataset
+    experiment.get_dataset("third").update_metadata("gain", 3)
+    assert read_json(reopened)["experiments"][0]["datasets"][1]["metadata"]["gain"] == 3
+    assert reopened.verify() == []
+
+
+def test_segmented_view(experiment, rng):
+    traces = rng.standard_normal((12, 5))
+    # a segmented capture stores the traces back to back, alternating between the groups
+    dataset = experiment.add_dataset("capture", traces.ravel(), np.float64)
+    experiment.update_metadata("samples_per_trace", 5)
+
+    view = experiment.segmented_view("capture")
+    np.testing.assert_array_equal(view.fixed, traces[0::2])
+    np.testing.assert_array_equal(view.random, traces[1::2])
+    assert np.shares_memory(view.fixed, dataset.get_memmap())
+
+    dataset.update_metadata("segment_groups", ["a", "b", "c"])
+    np.testing.assert_array_equal(dataset.segmented_view().group("c"), traces[2::3])
+    np.testing.assert_array_equal(dataset.segmented_view(10, ["fixed", "random"]).random,
+                                  traces.reshape(-1, 10)[1::2])
+    with pytest.raises(ValueError):
+        dataset.segmented_view(7)
+
+
+def test_dataset_view(experiment, rng):
+    traces = rng.standard_normal((30, 4))
+    view = experiment.add_dataset("traces", traces, np.float64).view()
+
+    sliced = view[2:20:3]
+    assert isinstance(sliced, type(view)) and sliced.shape == (6, 4)
+    np.testing.assert_array_equal(sliced.read(), traces[2:20:3])
+    np.testing.assert_array_equal(sliced[-1], traces[17])
+    np.testing.assert_array_equal(sliced[[0, -1, 3], 1:], traces[2:20:3][[0, -1, 3], 1:])
+    np.testing.assert_array_equal(sliced[np.arange(6) % 2 == 0], traces[2:20:3][::2])
+    with pytest.raises(IndexError):
+        view[0:10][[15]]
+    with pytest.raises(IndexError):
+        view[0:10][[-11]]
+    with pytest.raises(IndexError):
+        view[0:10][10]
+
+
+def test_concatenated_view(experiment, rng):
+    parts = [rng.standard_normal((rows, 4)) for rows in (3, 7, 1, 5)]
+    for index, part in enumerate(parts):
+        experiment.add_dataset(f"traces_p{index * 5}", part, np.float64)
+    experiment.add_dataset("traces_other", parts[0], np.float64)
+    data = np.concatenate(parts)
+
+    view = experiment.concat_view(r"traces_p\d+")
+    assert view.shape == (16, 4) and len(view) == 16
+    np.testing.assert_array_equal(np.asarray(view), data)
+    np.testing.assert_array_equal(view[-1], data[-1])
+    np.testing.assert_array_equal(view[2:12, 1], data[2:12, 1])
+    np.testing.assert_array_equal(view[14:1:-3], data[14:1:-3])
+    np.testing.assert_array_equal(view[[15, 0, 4, 10, 3]], data[[15, 0, 4, 10, 3]])
+    np.testing.assert_array_equal(view[data[:, 0] > 0], data[data[:, 0] > 0])
+    assert view[5:5].shape == (0, 4)
+    np.testing.assert_array_equal(np.concatenate(list(view.iter_chunks(4))), data)
+    assert [len(chunk) for chunk in view.iter_chunks(4)] == [3, 4, 3, 1, 4, 1]
+
+
+def test_concatenated_segmented_view(experiment, rng):
+    parts = [rng.standard_normal((rows, 3)) for rows in (4, 6)]
+    for index, part in enumerate(parts):
+        experiment.add_dataset(f"capture_{index}", part.ravel(), np.float64)
+
+    view = experiment.concat_view(r"capture_\d", group="random", samples_per_trace=3)
+    np.testing.assert_array_equal(view.read(), np.concatenate([part[1::2] for part in parts]))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from DPA import calculate_dpa, intermediate_value
+from LeakageModels import (bit, bits, hamming_distance, hamming_weight, identity, intermediate_values, popcount,
+                           word)
+
+
+@pytest.fixture
+def iv(rng):
+    return rng.integers(0, 256, (200, 16), dtype=np.uint8)
+
+
+def test_intermediate_values_match_scalar_model(iv):
+    expected = [intermediate_value([int(x) for x in row]) for row in iv]
+
+    np.testing.assert_array_equal(intermediate_values(iv), expected)
+    np.testing.assert_array_equal(intermediate_values(iv.astype(np.int64)), expected)
+
+
+def test_word_models(iv):
+    words = iv[:, 14].astype(np.uint64) << np.uint64(8) | iv[:, 15]
+
+    np.testing.assert_array_equal(word(iv, (14, 15)), words)
+    np.testing.assert_array_equal(identity(iv, 3), iv[:, 3])
+    np.testing.assert_array_equal(hamming_weight(iv), [bin(int(w)).count("1") for w in words])
+    np.testing.assert_array_equal(bit(iv, 9), (words >> np.uint64(9)) & np.uint64(1))
+    np.testing.assert_array_equal(bits(iv), [[(int(w) >> i) & 1 for i in range(16)] for w in words])
+
+
+def test_hamming_distance(iv):
+    expected = [bin(int(a) ^ int(b)).count("1") for a, b in zip(iv[:, 0], iv[:, 5])]
+
+    np.testing.assert_array_equal(hamming_distance(iv, 0, 5), expected)
+    with pytest.raises(ValueError):
+        hamming_distance(iv, (0, 1), 2)
+
+
+def test_popcount(rng):
+    values = rng.integers(0, 2 ** 40, 100, dtype=np.int64)
+
+    np.testing.assert_array_equal(popcount(values), [bin(int(v)).count("1") for v in values])
+
+
+def test_precomputed_hypothesis(iv, rng):
+    traces = rng.standard_normal((len(iv), 8))
+
+    np.testing.assert_array_equal(calculate_dpa(traces, None, hypothesis=intermediate_values(iv))[0],
+                                  calculate_dpa(traces, iv)[0])
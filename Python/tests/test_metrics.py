@@ -0,0 +1,275 @@
+import numpy as np
+import pytest
+
+from Metrics import (HigherOrderTTestAccumulator, PearsonAccumulator, SNRAccumulator, TTestAccumulator,
+                     pearson_correlation, t_test_convergence)
+
+
+def welch_t(fixed, random):
+    return ((fixed.mean(axis=0) - random.mean(axis=0))
+            / np.sqrt(fixed.var(axis=0, ddof=1) / len(fixed) + random.var(axis=0, ddof=1) / len(random)))
+
+
+def batches(data, sizes):
+    start = 0
+    for size in sizes:
+        yield data[start:start + size]
+        start += size
+
+
+def test_t_test_accumulator(rng):
+    fixed = rng.normal(3.0, 1.0, (57, 20))
+    random = rng.normal(3.1, 1.5, (43, 20))
+
+    accumulator = TTestAccumulator()
+    for fixed_batch, random_batch in zip(batches(fixed, [1, 20, 30, 6]), batches(random, [10, 0, 33, 0])):
+        accumulator.update(fixed_batch, random_batch if len(random_batch) else None)
+
+    assert accumulator.n_fixed == 57 and accumulator.n_random == 43
+    np.testing.assert_allclose(accumulator.t_value(), welch_t(fixed, random), rtol=1e-10)
+
+
+def test_t_test_accumulator_float32(rng):
+    # a large offset would lose the variance if the batches were not centered before squaring
+    fixed = (rng.normal(0.0, 0.01, (500, 16)) + 100).astype(np.float32)
+    random = (rng.normal(0.001, 0.01, (500, 16)) + 100).astype(np.float32)
+
+    accumulator = TTestAccumulator(np.float32)
+    for start in range(0, 500, 128):
+        accumulator.update(fixed[start:start + 128], random[start:start + 128])
+
+    expected = welch_t(fixed.astype(np.float64), random.astype(np.float64))
+    np.testing.assert_allclose(accumulator.t_value(), expected, rtol=1e-3, atol=1e-3)
+
+
+def test_t_test_accumulator_too_few_traces(rng):
+    accumulator = TTestAccumulator()
+    accumulator.update(rng.standard_normal((5, 3)), rng.standard_normal(3))
+
+    np.testing.assert_array_equal(accumulator.t_value(), np.zeros(3))
+
+
+def test_experiment_t_test(experiment, rng):
+    fixed = rng.normal(0.0, 1.0, (300, 12)).astype(np.float32)
+    random = rng.normal(0.2, 1.0, (250, 12)).astype(np.float32)
+    experiment.add_dataset("fixed", fixed, np.float32)
+    experiment.add_dataset("random", random, np.float32)
+
+    t, t_max = experiment.calculate_t_test("fixed", "random", chunk_size=64)
+
+    expected = welch_t(fixed.astype(np.float64), random.astype(np.float64))
+    np.testing.assert_allclose(t, expected, rtol=1e-9)
+    np.testing.assert_allclose(experiment.calculate_t_test("fixed", "random", dtype=np.float32)[0], expected,
+                               rtol=1e-4, atol=1e-4)
+
+
+def preprocessed(traces, order):
+    # the traces of a univariate t-test of the given order, see Schneider and Moradi, CHES 2015
+    if order == 1:
+        return traces
+    centered = traces - traces.mean(axis=0)
+    if order == 2:
+        return centered ** 2
+    return (centered / traces.std(axis=0)) ** order
+
+
+def welch_t_population(fixed, random):
+    return ((fixed.mean(axis=0) - random.mean(axis=0))
+            / np.sqrt(fixed.var(axis=0) / len(fixed) + random.var(axis=0) / len(random)))
+
+
+def test_higher_order_t_test_accumulator(rng):
+    fixed = rng.normal(0.0, 1.0, (400, 10))
+    random = rng.gamma(2.0, 1.0, (300, 10)) + 5
+
+    accumulator = HigherOrderTTestAccumulator(4)
+    for fixed_batch, random_batch in zip(batches(fixed, [7, 93, 300]), batches(random, [150, 1, 149])):
+        accumulator.update(fixed_batch, random_batch)
+
+    t_values = accumulator.t_values()
+    assert t_values.shape == (4, 10)
+    np.testing.assert_allclose(t_values[0], welch_t(fixed, random), rtol=1e-9)
+    for order in range(2, 5):
+        expected = welch_t_population(preprocessed(fixed, order), preprocessed(random, order))
+        np.testing.assert_allclose(accumulator.t_value(order), expected, rtol=1e-8)
+
+    with pytest.raises(ValueError):
+        accumulator.t_value(5)
+
+
+def direct_snr(traces, labels):
+    classes = np.unique(labels)
+    means = np.array([traces[labels == label].mean(axis=0) for label in classes])
+    variances = np.array([traces[labels == label].var(axis=0) for label in classes])
+    return means, variances, means.var(axis=0) / variances.mean(axis=0)
+
+
+def test_snr_accumulator(rng):
+    labels = rng.integers(0, 9, 600)
+    traces = rng.standard_normal((600, 15)) + np.outer(labels, np.linspace(0, 1, 15))
+
+    # the first batch misses the larger labels, so the accumulator has to grow
+    accumulator = SNRAccumulator(num_classes=4)
+    order = np.argsort(labels < 5, kind="stable")[::-1]
+    traces, labels = traces[order], labels[order]
+    for start, stop in ((0, 250), (250, 251), (251, 600)):
+        accumulator.update(traces[start:stop], labels[start:stop])
+
+    means, variances, snr = direct_snr(traces, labels)
+    seen, class_means, class_variances = accumulator.class_statistics()
+    np.testing.assert_array_equal(seen, np.arange(9))
+    np.testing.assert_allclose(class_means, means, rtol=1e-12)
+    np.testing.assert_allclose(class_variances, variances, rtol=1e-10)
+    np.testing.assert_allclose(accumulator.snr(), snr, rtol=1e-10)
+
+
+def test_snr_accumulator_float32(rng):
+    labels = rng.integers(0, 4, 800)
+    traces = (rng.normal(0, 0.01, (800, 6)) + 50 + 0.002 * labels[:, np.newaxis]).astype(np.float32)
+
+    accumulator = SNRAccumulator(dtype=np.float32)
+    for start in range(0, 800, 300):
+        accumulator.update(traces[start:start + 300], labels[start:start + 300])
+
+    np.testing.assert_allclose(accumulator.snr(), direct_snr(traces.astype(np.float64), labels)[2], rtol=1e-3)
+
+
+def test_snr_accumulator_rejects_bad_labels(rng):
+    accumulator = SNRAccumulator()
+    with pytest.raises(ValueError):
+        accumulator.update(rng.standard_normal((3, 2)), [0, -1, 2])
+    with pytest.raises(ValueError):
+        accumulator.update(rng.standard_normal((3, 2)), [0.5, 1, 2])
+    with pytest.raises(ValueError):
+        accumulator.update(rng.standard_normal((3, 2)), [0, 1])
+    with pytest.raises(ValueError):
+        accumulator.snr()
+
+
+def test_experiment_snr(experiment, rng):
+    keys = np.repeat(rng.integers(0, 256, (1, 16), dtype=np.uint8), 500, axis=0)
+    plaintexts = rng.integers(0, 256, (500, 16), dtype=np.uint8)
+    labels = (keys[:, 0] ^ plaintexts[:, 0]) & 0x0f
+    traces = rng.standard_normal((500, 20)).astype(np.float32)
+    traces[:, 7] += labels
+    experiment.add_dataset("traces", traces, np.float32)
+    experiment.add_dataset("keys", keys, np.uint8)
+    experiment.add_dataset("plaintexts", plaintexts, np.uint8)
+
+    snr = experiment.calculate_snr("traces", lambda key, pt: (key[:, 0] ^ pt[:, 0]) & 0x0f, "keys", "plaintexts",
+                                   chunk_size=128)
+
+    np.testing.assert_allclose(snr, direct_snr(traces.astype(np.float64), labels)[2], rtol=1e-9)
+    assert np.argmax(snr) == 7
+
+    experiment.add_dataset("short_keys", keys[:499], np.uint8)
+    experiment.add_dataset("long_plaintexts", np.concatenate((plaintexts, plaintexts[:1])), np.uint8)
+    with pytest.raises(ValueError):
+        experiment.calculate_snr("traces", lambda key, pt: key[:, 0] ^ pt[:, 0], "short_keys", "plaintexts")
+    with pytest.raises(ValueError):
+        experiment.calculate_snr("traces", lambda key, pt: key[:, 0] ^ pt[:, 0], "keys", "long_plaintexts")
+
+
+def direct_correlation(predicted, observed):
+    predicted = predicted - predicted.mean(axis=0)
+    observed = observed - observed.mean(axis=0)
+    return (predicted * observed).sum(axis=0) / np.sqrt((predicted ** 2).sum(axis=0) * (observed ** 2).sum(axis=0))
+
+
+def test_pearson_accumulator(rng):
+    observed = rng.standard_normal((300, 12))
+    predicted = observed + rng.standard_normal((300, 12))
+
+    accumulator = PearsonAccumulator()
+    for start, stop in ((0, 1), (1, 120), (120, 300)):
+        accumulator.update(predicted[start:stop], observed[start:stop])
+
+    expected = [np.corrcoef(predicted[:, i], observed[:, i])[0, 1] for i in range(12)]
+    np.testing.assert_allclose(accumulator.correlation(), expected, rtol=1e-10)
+    np.testing.assert_allclose(pearson_correlation(predicted, observed), expected, rtol=1e-10)
+
+
+def test_pearson_accumulator_broadcasts(rng):
+    predicted = rng.integers(0, 9, 400).astype(np.float64)
+    observed = rng.standard_normal((400, 8)) + np.outer(predicted, np.arange(8) / 8)
+
+    accumulator = PearsonAccumulator()
+    accumulator.update(predicted[:150], observed[:150])
+    accumulator.update(predicted[150:, np.newaxis], observed[150:])
+
+    expected = direct_correlation(predicted[:, np.newaxis], observed)
+    np.testing.assert_allclose(accumulator.correlation(), expected, rtol=1e-10)
+    np.testing.assert_allclose(pearson_correlation(predicted, observed), expected, rtol=1e-10)
+    np.testing.assert_allclose(pearson_correlation(predicted, observed[:, 3]), expected[3:4], rtol=1e-10)
+
+    with pytest.raises(ValueError):
+        accumulator.update(predicted[:3], observed[:4])
+
+
+def test_pearson_accumulator_float32(rng):
+    observed = (rng.normal(0, 0.01, (1000, 5)) + 30).astype(np.float32)
+    predicted = (observed - 30 + rng.normal(0, 0.01, (1000, 5))).astype(np.float32)
+
+    accumulator = PearsonAccumulator(np.float32)
+    for start in range(0, 1000, 256):
+        accumulator.update(predicted[start:start + 256], observed[start:start + 256])
+
+    expected = direct_correlation(predicted.astype(np.float64), observed.astype(np.float64))
+    np.testing.assert_allclose(accumulator.correlation(), expected, rtol=1e-4)
+
+
+def test_experiment_correlation(experiment, rng):
+    predicted = rng.integers(0, 9, 350).astype(np.float32)
+    observed = (rng.standard_normal((350, 10)) + np.outer(predicted, np.ones(10))).astype(np.float32)
+    experiment.add_dataset("predicted", predicted, np.float32)
+    experiment.add_dataset("observed", observed, np.float32)
+    experiment.add_dataset("short", observed[:100], np.float32)
+
+    corr = experiment.calculate_correlation("predicted", "observed", chunk_size=64)
+
+    expected = direct_correlation(predicted.astype(np.float64)[:, np.newaxis], observed.astype(np.float64))
+    np.testing.assert_allclose(corr, expected, rtol=1e-9)
+    with pytest.raises(ValueError):
+        experiment.calculate_correlation("predicted", "short")
+
+
+def test_t_test_convergence(rng):
+    fixed = rng.normal(0.0, 1.0, (260, 8))
+    random = rng.normal(0.6, 1.0, (230, 8))
+    chunks = [(fixed[start:start + 70], random[start:start + 70] if start < 230 else None)
+              for start in range(0, 260, 70)]
+
+    counts, max_t, first = t_test_convergence(chunks, [40, 100, 101, 250], threshold=4.5)
+
+    assert list(counts) == [40, 100, 101, 250, 260]
+    expected = [np.max(np.abs(welch_t(fixed[:n], random[:n]))) for n in counts]
+    np.testing.assert_allclose(max_t, expected, rtol=1e-9)
+    crossed = np.array(expected) >= 4.5
+    assert crossed[-1] and first == counts[np.argmax(crossed)]
+
+    counts, max_t, first = t_test_convergence(chunks, 100, threshold=1e9, order=2)
+    assert list(counts) == [100, 200, 260] and max_t.shape == (3, 2) and list(first) == [-1, -1]
+    np.testing.assert_allclose(max_t[:, 0], [np.max(np.abs(welch_t(fixed[:n], random[:n]))) for n in counts],
+                               rtol=1e-9)
+
+    for step in (0, -50):
+        with pytest.raises(ValueError):
+            t_test_convergence(chunks, step)
+
+
+def test_experiment_t_test_checkpoints(experiment, rng):
+    fixed = rng.normal(0.0, 1.0, (300, 12))
+    random = rng.normal(0.2, 1.0, (300, 12))
+    experiment.add_dataset("fixed", fixed, np.float64)
+    experiment.add_dataset("random", random, np.float64)
+
+    _, t_max = experiment.calculate_t_test("fixed", "random", chunk_size=64, checkpoints=100)
+    np.testing.assert_allclose(t_max, [np.max(np.abs(welch_t(fixed[:n], random[:n]))) for n in (100, 200, 300)],
+                               rtol=1e-9)
+
+    _, t_max = experiment.calculate_t_test("fixed", "random", chunk_size=64, checkpoints=[10, 250])
+    np.testing.assert_allclose(t_max, [np.max(np.abs(welch_t(fixed[:n], random[:n]))) for n in (10, 250, 300)],
+                               rtol=1e-9)
+
+    with pytest.raises(ValueError):
+        experiment.calculate_t_test("fixed", "random", checkpoints=0)
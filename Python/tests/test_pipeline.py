@@ -0,0 +1,101 @@
+import threading
+
+import numpy as np
+import pytest
+
+from Pipeline import prefetch
+
+
+def test_prefetch_keeps_order():
+    assert list(prefetch(iter(range(100)), depth=3)) == list(range(100))
+    assert list(prefetch([], depth=1)) == []
+
+
+def test_prefetch_reads_ahead():
+    produced = []
+    second_loaded = threading.Event()
+
+    def items():
+        for index in range(3):
+            produced.append(index)
+            if index == 1:
+                second_loaded.set()
+            yield index
+
+    iterator = prefetch(items(), depth=2)
+    assert next(iterator) == 0
+    # the next item is loaded while the first one is processed
+    assert second_loaded.wait(5)
+    assert list(iterator) == [1, 2]
+
+
+def test_prefetch_caps_bytes():
+    held = []
+    lock = threading.Lock()
+
+    def items():
+        for _ in range(6):
+            with lock:
+                held.append(1)
+            yield np.zeros(100, dtype=np.uint8)
+
+    consumed = 0
+    for _ in prefetch(items(), depth=10, max_bytes=250):
+        consumed += 1
+        with lock:
+            # the current item and two loaded ones reach the cap, a fourth may be produced and wait for room
+            assert len(held) - consumed <= 3
+    assert consumed == 6
+
+
+def test_prefetch_materializes_memory_maps(tmp_path):
+    path = str(tmp_path / "data.npy")
+    np.save(path, np.arange(10))
+    data = np.load(path, mmap_mode='r')
+
+    item, = prefetch([(data[2:5], "label")])
+    assert not np.shares_memory(item[0], data)
+    np.testing.assert_array_equal(item[0], [2, 3, 4])
+    assert next(iter(prefetch([data], materialize=False))) is data
+
+
+def test_prefetch_raises_producer_errors():
+    def items():
+        yield 1
+        raise KeyError("missing")
+
+    iterator = prefetch(items())
+    assert next(iterator) == 1
+    with pytest.raises(KeyError):
+        next(iterator)
+
+
+def test_prefetch_stops_producer():
+    stopped = threading.Event()
+
+    def items():
+        try:
+            for index in range(1000):
+                yield index
+        finally:
+            stopped.set()
+
+    for item in prefetch(items(), depth=1):
+        if item == 3:
+            break
+    assert stopped.wait(5)
+
+
+def test_iter_datasets(experiment, rng):
+    parts = [rng.standard_normal((rows, 3)) for rows in (5, 2, 4)]
+    for index, part in enumerate(parts):
+        experiment.add_dataset(f"traces_p{index}", part, np.float64)
+
+    names, data = zip(*experiment.iter_datasets(r"traces_p\d"))
+    assert names == ("traces_p0", "traces_p1", "traces_p2")
+    np.testing.assert_array_equal(np.concatenate(data), np.concatenate(parts))
+
+    chunks = list(experiment.iter_datasets(["traces_p2", "traces_p0"], chunk_size=3, depth=1))
+    assert [(name, len(chunk)) for name, chunk in chunks] == [("traces_p2", 3), ("traces_p2", 1), ("traces_p0", 3),
+                                                              ("traces_p0", 2)]
+    np.testing.assert_array_equal(np.concatenate([chunk for _, chunk in chunks]), np.concatenate((parts[2], parts[0])))
@@ -0,0 +1,90 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from DPA import calculate_dpa, calculate_dpa_streaming, iterate_chunks
+from Profiling import NULL_PROFILER, Profiler, get_profiler
+
+
+def test_nested_stages():
+    records = []
+    profiler = Profiler(callback=records.append)
+
+    with profiler.stage("outer"):
+        with profiler.stage("inner") as record:
+            record["bytes_read"] += 10
+            buffer = np.ones(2 ** 20, dtype=np.uint8)
+        del buffer
+        with profiler.stage("inner"):
+            profiler.add_bytes_read(5)
+
+    assert [record["stage"] for record in records] == ["outer/inner", "outer/inner", "outer"]
+    assert records[-1]["bytes_read"] == 15
+    assert records[0]["peak_bytes"] >= 2 ** 20
+    assert records[-1]["peak_bytes"] >= records[0]["peak_bytes"]
+    assert not tracemalloc.is_tracing()
+
+    summary = profiler.summary()
+    assert list(summary) == ["outer/inner", "outer"]
+    assert summary["outer/inner"]["calls"] == 2 and summary["outer/inner"]["bytes_read"] == 15
+
+
+def test_stage_records_errors():
+    profiler = Profiler(trace_memory=False)
+
+    with pytest.raises(ValueError):
+        with profiler.stage("failing"):
+            raise ValueError
+
+    assert profiler.records[0]["stage"] == "failing" and profiler.records[0]["peak_bytes"] is None
+
+
+def test_iterate_counts_bytes():
+    profiler = Profiler(trace_memory=False)
+    items = [(np.zeros(4), np.zeros(2, dtype=np.uint8)), (np.zeros(1), np.zeros(1, dtype=np.uint8))]
+
+    assert len(list(profiler.iterate("read", items))) == 2
+    # the wait for the end of the items is a call as well
+    summary = profiler.summary()["read"]
+    assert summary["calls"] == 3 and summary["bytes_read"] == 43
+
+
+def test_null_profiler():
+    assert get_profiler(None) is NULL_PROFILER
+    items = [1, 2]
+    assert NULL_PROFILER.iterate("read", items) is items
+    with NULL_PROFILER.stage("anything"):
+        NULL_PROFILER.add_bytes_read(1)
+
+
+def test_profiled_dpa(rng):
+    traces = rng.standard_normal((300, 10))
+    iv = rng.integers(0, 256, (300, 16), dtype=np.uint8)
+    profiler = Profiler(trace_memory=False)
+
+    np.testing.assert_array_equal(calculate_dpa(traces, iv, profiler=profiler)[0], calculate_dpa(traces, iv)[0])
+    calculate_dpa_streaming(iterate_chunks(traces, iv, chunk_size=100), profiler=profiler)
+
+    summary = profiler.summary()
+    assert {"calculate_dpa/trace_moments", "calculate_dpa/hypothesis", "calculate_dpa/covariance",
+            "calculate_dpa"} <= set(summary)
+    assert summary["calculate_dpa_streaming/read"]["calls"] == 4
+    assert summary["calculate_dpa_streaming/read"]["bytes_read"] == traces.nbytes + iv.nbytes
+
+
+def test_profiled_experiment(experiment, rng):
+    experiment.add_dataset("fixed", rng.standard_normal((50, 6)), np.float64)
+    experiment.add_dataset("random", rng.standard_normal((50, 6)), np.float64)
+    profiler = Profiler()
+
+    experiment.calculate_t_test("fixed", "random", chunk_size=20, profiler=profiler)
+    experiment.save_profile(profiler, "t_test", to_visualization=True)
+
+    summary = experiment.metadata["profile_t_test"]
+    assert summary["calculate_t_test/read"]["calls"] == 4
+    assert summary["calculate_t_test/read"]["bytes_read"] == 2 * 50 * 6 * 8
+    assert summary["calculate_t_test/moments"]["calls"] == 3
+    with open(experiment.get_visualization_path() + "profile_t_test.json") as json_file:
+        assert json.load(json_file)["summary"] == summary
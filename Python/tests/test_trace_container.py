@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+import pytest
+
+from TraceContainer import CODECS, ChunkedTraceFile, quantization_parameters
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_round_trip(tmp_path, rng, codec, shuffle):
+    path = str(tmp_path / "traces.trc")
+    data = rng.standard_normal((50, 7)).astype(np.float32)
+
+    container = ChunkedTraceFile.create(path, (7,), np.float32, codec, chunk_rows=16, shuffle=shuffle)
+    container.append(data)
+    container.close()
+
+    container = ChunkedTraceFile(path)
+    assert container.shape == (50, 7)
+    assert container.dtype == np.float32
+    np.testing.assert_array_equal(np.asarray(container), data)
+    np.testing.assert_array_equal(container.read(10, 40), data[10:40])
+    np.testing.assert_array_equal(container[-3], data[-3])
+    np.testing.assert_array_equal(container[45:5:-4, 2], data[45:5:-4, 2])
+    np.testing.assert_array_equal(container[[49, 0, 17, 16]], data[[49, 0, 17, 16]])
+    np.testing.assert_array_equal(container[data[:, 0] > 0], data[data[:, 0] > 0])
+    assert container[20:20].shape == (0, 7)
+    container.close()
+
+
+def test_append(tmp_path, rng):
+    path = str(tmp_path / "traces.trc")
+    data = rng.integers(-1000, 1000, (40, 3, 2), dtype=np.int16)
+
+    container = ChunkedTraceFile.create(path, (3, 2), np.int16, chunk_rows=8)
+    container.append(data[:5])
+    container.append(data[5])
+    container.close()
+    for start, stop in ((6, 19), (19, 40)):
+        container = ChunkedTraceFile(path, writable=True)
+        container.append(data[start:stop])
+        container.close()
+
+    container = ChunkedTraceFile(path)
+    np.testing.assert_array_equal(container.read(0, 40), data)
+    assert [rows for _, _, rows in container.index["chunks"]] == [5, 1, 8, 5, 8, 8, 5]
+    container.close()
+
+    container = ChunkedTraceFile(path, writable=True)
+    with pytest.raises(ValueError):
+        container.append(np.zeros((2, 3, 3), dtype=np.int16))
+    container.close()
+
+
+def test_quantized(tmp_path, rng):
+    path = str(tmp_path / "traces.trc")
+    data = rng.uniform(-0.5, 0.5, (30, 10))
+    scale, offset = quantization_parameters(data, "int8")
+
+    container = ChunkedTraceFile.create(path, (10,), np.float64, quantize="int8", scale=scale, offset=offset)
+    container.append(data)
+    container.close()
+
+    container = ChunkedTraceFile(path)
+    assert container.stored_dtype == np.int8
+    np.testing.assert_allclose(container.read(0, 30), data, rtol=0, atol=scale / 2 + 1e-12)
+    container.close()
+
+    with pytest.raises(ValueError):
+        ChunkedTraceFile.create(path, (10,), np.float64, quantize="int8")
+
+
+def test_interrupted_append(tmp_path, rng):
+    path = str(tmp_path / "traces.trc")
+    data = rng.standard_normal((20, 4))
+
+    container = ChunkedTraceFile.create(path, (4,), np.float64, chunk_rows=8)
+    container.append(data)
+    container.close()
+    # the remains of an append that stopped before writing its footer
+    with open(path, 'ab') as file:
+        file.write(b"\x00" * 100 + b"SCATRC01" + rng.bytes(3000))
+
+    container = ChunkedTraceFile(path, writable=True)
+    np.testing.assert_array_equal(container.read(0, 20), data)
+    container.append(data[:3])
+    container.close()
+
+    container = ChunkedTraceFile(path)
+    np.testing.assert_array_equal(np.asarray(container), np.concatenate((data, data[:3])))
+    container.close()
+
+
+def test_compaction(tmp_path, rng):
+    path = str(tmp_path / "traces.trc")
+    data = rng.standard_normal((60, 2))
+
+    container = ChunkedTraceFile.create(path, (2,), np.float64, codec="none")
+    for row in data:
+        container.append(row)
+    replaced_indexes = os.path.getsize(path)
+    container.close()
+
+    assert os.path.getsize(path) < replaced_indexes
+    assert not os.path.exists(path + ".tmp")
+    container = ChunkedTraceFile(path)
+    np.testing.assert_array_equal(np.asarray(container), data)
+    container.close()
+
+
+def test_not_a_container(tmp_path):
+    path = str(tmp_path / "traces.npy")
+    np.save(path, np.zeros(3))
+
+    with pytest.raises(ValueError):
+        ChunkedTraceFile(path)